@@ -5,4 +5,5 @@ export const endpoints = {
     chat: `${API_BASE}/chat`,
     upload: `${API_BASE}/documents/upload`,
     documents: `${API_BASE}/documents`,
+    jobs: `${API_BASE}/documents/jobs`,
 };
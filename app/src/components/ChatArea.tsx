@@ -100,6 +100,16 @@ export default function ChatArea() {
                                 <p className="whitespace-pre-wrap">{msg.content}</p>
                             )}
 
+                            {/* Queue / error status */}
+                            {!!msg.queuePosition && !msg.content && (
+                                <p className="text-xs text-slate-400 dark:text-slate-500 italic">
+                                    Waiting for the model (position {msg.queuePosition} in queue)...
+                                </p>
+                            )}
+                            {msg.error && (
+                                <p className="mt-2 text-xs text-red-600 dark:text-red-400">{msg.error}</p>
+                            )}
+
                             {/* Citations */}
                             {msg.citations && msg.citations.length > 0 && (
                                 <div className="mt-4 pt-3 border-t border-slate-200 dark:border-slate-700 flex flex-wrap gap-2">
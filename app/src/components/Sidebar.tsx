@@ -63,7 +63,7 @@ export default function Sidebar() {
                             {isUploading ? "Processing..." : "Drop PDF / Txt"}
                         </span>
                     </div>
-                    <input type="file" className="hidden" onChange={handleFileChange} disabled={isUploading} accept=".pdf,.txt" />
+                    <input type="file" className="hidden" onChange={handleFileChange} disabled={isUploading} accept=".pdf,.txt,.docx" />
                 </label>
                 {error && (
                     <div className="mt-2 text-xs text-red-500 flex items-center gap-1">
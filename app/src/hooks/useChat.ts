@@ -12,6 +12,9 @@ export interface Message {
     content: string;
     citations?: Citation[];
     meta?: { tps: number; duration: number };
+    requestId?: string; // From the 'start' event; POST /chat/{requestId}/cancel stops it
+    queuePosition?: number; // Set while waiting for the model
+    error?: string;
 }
 
 export function useChat() {
@@ -20,6 +23,12 @@ export function useChat() {
     const abortControllerRef = useRef<AbortController | null>(null);
 
     const sendMessage = useCallback(async (text: string, sources?: string[]) => {
+        // Drop the previous stream first (the backend cancels its generation), so
+        // none of its remaining events land on the new assistant message
+        abortControllerRef.current?.abort();
+        const controller = new AbortController();
+        abortControllerRef.current = controller;
+
         // 1. Add User Message
         const userMsg: Message = { role: 'user', content: text };
         setMessages((prev) => [...prev, userMsg]);
@@ -29,8 +38,6 @@ export function useChat() {
         const assistantMsg: Message = { role: 'assistant', content: '', citations: [] };
         setMessages((prev) => [...prev, assistantMsg]);
 
-        abortControllerRef.current = new AbortController();
-
         try {
             const response = await fetch(endpoints.chat, {
                 method: 'POST',
@@ -42,7 +49,7 @@ export function useChat() {
                     history: messages.map(m => ({ role: m.role, content: m.content })).slice(-5), // Send last 5 turns
                     sources: sources || null
                 }),
-                signal: abortControllerRef.current.signal,
+                signal: controller.signal,
             });
 
             if (!response.ok) throw new Error('Network error');
@@ -54,7 +61,7 @@ export function useChat() {
 
             while (true) {
                 const { done, value } = await reader.read();
-                if (done) break;
+                if (done || controller.signal.aborted) break;
 
                 buffer += decoder.decode(value, { stream: true });
                 const lines = buffer.split('\n');
@@ -64,30 +71,43 @@ export function useChat() {
 
                 for (const line of lines) {
                     if (!line.trim()) continue;
+                    // A newer question took over; its message is now the last one
+                    if (controller.signal.aborted) break;
+                    let event: any;
                     try {
-                        const event = JSON.parse(line);
-
-                        setMessages((prev) => {
-                            const newMsgs = [...prev];
-                            const lastIdx = newMsgs.length - 1;
-                            const lastMsg = { ...newMsgs[lastIdx] }; // IMMUTABLE COPY
-
-                            if (event.type === 'token') {
-                                lastMsg.content += event.data;
-                            } else if (event.type === 'citation') {
-                                lastMsg.citations = event.data;
-                            } else if (event.type === 'meta') {
-                                lastMsg.meta = { tps: event.tps, duration: event.duration };
-                            } else if (event.type === 'done') {
-                                setIsStreaming(false);
-                            }
-
-                            newMsgs[lastIdx] = lastMsg;
-                            return newMsgs;
-                        });
-
+                        event = JSON.parse(line);
                     } catch (e) {
                         console.error("JSON Parse Error", e, line);
+                        continue;
+                    }
+
+                    setMessages((prev) => {
+                        const newMsgs = [...prev];
+                        const lastIdx = newMsgs.length - 1;
+                        const lastMsg = { ...newMsgs[lastIdx] }; // IMMUTABLE COPY
+
+                        if (event.type === 'start') {
+                            lastMsg.requestId = event.request_id;
+                        } else if (event.type === 'queue') {
+                            lastMsg.queuePosition = event.position;
+                        } else if (event.type === 'token') {
+                            lastMsg.queuePosition = undefined;
+                            lastMsg.content += event.data;
+                        } else if (event.type === 'citation') {
+                            lastMsg.citations = event.data;
+                        } else if (event.type === 'meta') {
+                            lastMsg.meta = { tps: event.tps, duration: event.duration };
+                        } else if (event.type === 'error') {
+                            lastMsg.queuePosition = undefined;
+                            lastMsg.error = event.message || 'Generation failed.';
+                        }
+
+                        newMsgs[lastIdx] = lastMsg;
+                        return newMsgs;
+                    });
+
+                    if (event.type === 'done' || event.type === 'error') {
+                        setIsStreaming(false);
                     }
                 }
             }
@@ -109,7 +129,10 @@ export function useChat() {
                 });
             }
         } finally {
-            setIsStreaming(false);
+            // An aborted stream must not clear the flag for the one that replaced it
+            if (abortControllerRef.current === controller) {
+                setIsStreaming(false);
+            }
         }
     }, [messages]);
 
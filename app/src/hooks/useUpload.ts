@@ -19,8 +19,20 @@ export function useUpload() {
 
             if (!res.ok) throw new Error('Upload failed');
 
-            const data = await res.json();
-            return data; // { filename, chunks_count, status }
+            const data = await res.json(); // { filename, chunks_count, status, job_id }
+
+            // Ingestion runs in the background; poll the job until it finishes
+            while (data.job_id) {
+                await new Promise((resolve) => setTimeout(resolve, 1000));
+                const jobRes = await fetch(`${endpoints.jobs}/${data.job_id}`);
+                if (!jobRes.ok) throw new Error('Upload failed');
+                const job = await jobRes.json();
+                if (job.status === 'error') throw new Error(job.error || 'Indexing failed');
+                if (job.status === 'complete') {
+                    return { ...data, chunks_count: job.chunks, status: 'indexed' };
+                }
+            }
+            return data;
         } catch (err: any) {
             setError(err.message);
             throw err;
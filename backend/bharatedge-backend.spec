@@ -30,8 +30,15 @@ a = Analysis(
         'fastapi',
         'src.rag_engine',
         'src.ingestion',
+        'src.jobs',
         'src.llm_engine',
         'src.vector_db',
+        'src.embeddings',
+        'src.cache',
+        'src.answer_cache',
+        'src.tokenizer',
+        'src.scheduler',
+        'src.batching', 'src.lexical_index', 'src.reranker', 'src.registry', 'src.ocr', 'src.startup', 'src.downloader', 'src.model_registry', 'src.hardware', 'src.speculative',
         'src.models',
         'src.config',
         'chromadb.api.segment',
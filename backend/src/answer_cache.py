@@ -0,0 +1,103 @@
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional
+import numpy as np
+from src.models import DocumentChunk
+from src.config import ANSWER_CACHE_SIZE, ANSWER_CACHE_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+class SemanticAnswerCache:
+    """
+    Opt-in cache of completed answers for near-duplicate questions.
+
+    A cached answer is replayed only when the new query embedding is above
+    the similarity threshold AND retrieval returned exactly the same chunk
+    set (plus same source filter and previous turn), so the LLM would have
+    seen an identical context. Entries remember the generation of every
+    document they were built from and die as soon as one of them changes.
+    """
+
+    def __init__(self, get_source_generation: Callable[[str], int], max_entries: int = ANSWER_CACHE_SIZE, threshold: float = ANSWER_CACHE_THRESHOLD):
+        self.get_source_generation = get_source_generation
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _context_key(chunks: List[DocumentChunk], sources: Optional[List[str]], history: List[dict]) -> str:
+        last_turn = history[-1]['content'] if history else ""
+        parts = sorted(c.id or f"{c.source}:{c.page}:{c.text}" for c in chunks)
+        parts.append("|".join(sorted(sources)) if sources else "*")
+        parts.append(last_turn)
+        return hashlib.sha256("\n".join(parts).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def lookup(self, embedding, chunks: List[DocumentChunk], sources: Optional[List[str]], history: List[dict]) -> Optional[str]:
+        """
+        Return a cached answer for this query/context, or None.
+        """
+        if not chunks:
+            return None
+        key = self._context_key(chunks, sources, history)
+        query_vec = self._normalize(embedding)
+
+        with self.lock:
+            candidates = self.entries.get(key, [])
+            # Drop candidates built from documents that have changed since
+            candidates = [e for e in candidates if all(self.get_source_generation(s) == g for s, g in e["generations"].items())]
+            if candidates:
+                self.entries[key] = candidates
+            else:
+                self.entries.pop(key, None)
+
+            for entry in candidates:
+                if float(np.dot(query_vec, entry["embedding"])) >= self.threshold:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry["answer"]
+            self.misses += 1
+            return None
+
+    def store(self, embedding, chunks: List[DocumentChunk], sources: Optional[List[str]], history: List[dict], answer: str):
+        # No embedding (the embedder was still loading and retrieval fell back to BM25): nothing to match on later
+        if embedding is None or not chunks or not answer.strip():
+            return
+        key = self._context_key(chunks, sources, history)
+        entry = {
+            "embedding": self._normalize(embedding),
+            "answer": answer,
+            "generations": {c.source: self.get_source_generation(c.source) for c in chunks},
+            "created_at": time.time()
+        }
+        with self.lock:
+            self.entries.setdefault(key, []).append(entry)
+            self.entries.move_to_end(key)
+            while sum(len(v) for v in self.entries.values()) > self.max_entries:
+                oldest_key = next(iter(self.entries))
+                self.entries[oldest_key].pop(0)
+                if not self.entries[oldest_key]:
+                    del self.entries[oldest_key]
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": sum(len(v) for v in self.entries.values()),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,310 @@
+import queue
+import logging
+import threading
+from collections import deque
+from typing import Callable, Generator, List, Optional
+import numpy as np
+import llama_cpp
+from src.config import CPU_THREADS, BATCH_CTX_PER_SEQUENCE, BATCH_N_BATCH, LLM_TEMPERATURE
+
+logger = logging.getLogger(__name__)
+
+class BatchSequence:
+    """
+    One request decoding inside the shared batch context.
+    """
+
+    def __init__(self, tokens: List[int], max_tokens: int, stop: List[str]):
+        self.prompt_tokens = tokens
+        self.pending = list(tokens)   # prompt tokens not yet in the KV cache
+        self.generated = []
+        self.next_token = None        # sampled, not yet evaluated
+        self.n_past = 0
+        self.max_tokens = max_tokens
+        self.stop = stop
+        self.reserved = len(tokens) + max_tokens
+        self.seq_id = None
+        self.byte_buffer = b""
+        self.text_buffer = ""
+        self.out = queue.Queue()
+        self.cancelled = False
+
+class ContinuousBatcher:
+    """
+    Continuous batching over one llama.cpp context holding several sequences.
+
+    A background loop builds a llama_batch each step containing the next token
+    of every decoding sequence plus as many pending prompt tokens as fit in
+    n_batch, so new requests join the running batch at token boundaries.
+    The static prompt prefix lives in sequence 0 and is shared into new
+    sequences with llama_kv_cache_seq_cp (no re-evaluation, no extra KV cells).
+    """
+
+    PREFIX_SEQ = 0
+
+    def __init__(self, llm, max_sequences: int, ctx_per_sequence: int = BATCH_CTX_PER_SEQUENCE, n_batch: int = BATCH_N_BATCH,
+                 n_threads: int = CPU_THREADS, n_threads_batch: int = CPU_THREADS, temperature: float = LLM_TEMPERATURE, top_k: int = 40, top_p: float = 0.9, repeat_penalty: float = 1.2):
+        self.llm = llm
+        self.max_sequences = max_sequences
+        self.n_batch = n_batch
+        self.n_ctx = ctx_per_sequence * max_sequences
+        self.capacity = self.n_ctx  # KV cells available to request sequences
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.repeat_penalty = repeat_penalty
+        self.n_vocab = llm.n_vocab()
+        self.rng = np.random.default_rng()
+
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = self.n_ctx
+        params.n_batch = n_batch
+        params.n_ubatch = n_batch
+        params.n_seq_max = max_sequences + 1  # +1 for the shared prefix sequence
+        params.n_threads = n_threads
+        params.n_threads_batch = n_threads_batch
+        # Same weights as the single-sequence Llama; only the KV cache is new
+        self.ctx = llama_cpp.llama_new_context_with_model(llm.model, params)
+        if not self.ctx:
+            raise RuntimeError("Failed to create batched llama context")
+        self.batch = llama_cpp.llama_batch_init(n_batch, 0, max_sequences + 1)
+
+        self.stop_token_ids = {llm.token_eos()}
+        im_end = llm.tokenize(b"<|im_end|>", add_bos=False, special=True)
+        if len(im_end) == 1:
+            self.stop_token_ids.add(im_end[0])
+
+        self.prefix_tokens = []
+        self.waiting = deque()
+        self.active = []
+        self.free_seq_ids = list(range(1, max_sequences + 1))
+        self.reserved_total = 0
+        self.cond = threading.Condition()
+        self.ctx_lock = threading.Lock()
+        self.thread = threading.Thread(target=self._loop, name="llm-batcher", daemon=True)
+        self.thread.start()
+        logger.info(f"Continuous batching enabled: {max_sequences} sequences, n_ctx={self.n_ctx}")
+
+    # --- Public API ---
+
+    def set_prefix(self, tokens: List[int]):
+        """
+        Evaluate the static prompt prefix into sequence 0 for sharing.
+        """
+        with self.ctx_lock:
+            llama_cpp.llama_kv_cache_seq_rm(self.ctx, self.PREFIX_SEQ, -1, -1)
+            for start in range(0, len(tokens), self.n_batch):
+                part = tokens[start:start + self.n_batch]
+                self._clear_batch()
+                for j, tok in enumerate(part):
+                    self._add(tok, start + j, self.PREFIX_SEQ, False)
+                if llama_cpp.llama_decode(self.ctx, self.batch) != 0:
+                    logger.warning("Failed to evaluate prompt prefix in batch context.")
+                    llama_cpp.llama_kv_cache_seq_rm(self.ctx, self.PREFIX_SEQ, -1, -1)
+                    self.prefix_tokens = []
+                    self.capacity = self.n_ctx
+                    return
+            self.prefix_tokens = list(tokens)
+            self.capacity = self.n_ctx - len(tokens)
+
+    def generate(self, prompt: str, max_tokens: int, stop: List[str], should_stop: Optional[Callable[[], bool]] = None) -> Generator[str, None, None]:
+        """
+        Queue a prompt and stream its text pieces. Closing the generator, or
+        `should_stop` returning True, cancels the sequence at the next token boundary.
+        """
+        tokens = self.llm.tokenize(prompt.encode('utf-8'), special=True)
+        seq = BatchSequence(tokens, max_tokens, [s for s in stop if s])
+        if seq.reserved > self.capacity:
+            raise ValueError(f"Prompt of {len(tokens)} tokens does not fit the batch context")
+        with self.cond:
+            self.waiting.append(seq)
+            self.cond.notify_all()
+        try:
+            while True:
+                try:
+                    piece = seq.out.get(timeout=0.2)
+                except queue.Empty:
+                    # Still waiting for a slot or a token; notice cancellation meanwhile
+                    if should_stop and should_stop():
+                        return
+                    continue
+                if piece is None:
+                    return
+                if isinstance(piece, Exception):
+                    raise piece
+                yield piece
+        finally:
+            seq.cancelled = True
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {
+                "max_sequences": self.max_sequences,
+                "active": len(self.active),
+                "waiting": len(self.waiting),
+                "reserved_tokens": self.reserved_total,
+                "capacity_tokens": self.capacity
+            }
+
+    # --- Decode loop ---
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                while not self.waiting and not self.active:
+                    self.cond.wait()
+                self._admit()
+            with self.ctx_lock:
+                try:
+                    self._step()
+                except Exception as e:
+                    logger.error(f"Batched decode failed: {e}")
+                    for seq in list(self.active):
+                        seq.out.put(e)
+                        self._finish(seq, flush=False)
+
+    def _admit(self):
+        # FIFO: stop at the first sequence that does not fit yet
+        while self.waiting and self.free_seq_ids and self.reserved_total + self.waiting[0].reserved <= self.capacity:
+            seq = self.waiting.popleft()
+            if seq.cancelled:
+                seq.out.put(None)
+                continue
+            seq.seq_id = self.free_seq_ids.pop(0)
+            self.reserved_total += seq.reserved
+            n_prefix = len(self.prefix_tokens)
+            if n_prefix and seq.prompt_tokens[:n_prefix] == self.prefix_tokens:
+                # Keep at least one prompt token to evaluate so we get logits
+                shared = min(n_prefix, len(seq.prompt_tokens) - 1)
+                llama_cpp.llama_kv_cache_seq_cp(self.ctx, self.PREFIX_SEQ, seq.seq_id, 0, shared)
+                seq.n_past = shared
+                seq.pending = seq.prompt_tokens[shared:]
+            self.active.append(seq)
+
+    def _step(self):
+        self._clear_batch()
+        logit_rows = {}
+
+        for seq in list(self.active):
+            if seq.cancelled:
+                logger.info(f"Sequence {seq.seq_id} cancelled after {len(seq.generated)} tokens.")
+                self._finish(seq, flush=False)
+
+        # 1. One token for every sequence that is already decoding
+        for seq in self.active:
+            if not seq.pending and seq.next_token is not None:
+                logit_rows[self.batch.n_tokens] = seq
+                self._add(seq.next_token, seq.n_past, seq.seq_id, True)
+                seq.n_past += 1
+
+        # 2. Fill the rest of the batch with prompt tokens (prefill)
+        for seq in self.active:
+            room = self.n_batch - self.batch.n_tokens
+            if room <= 0:
+                break
+            if not seq.pending:
+                continue
+            part = seq.pending[:room]
+            done = len(part) == len(seq.pending)
+            for j, tok in enumerate(part):
+                last = done and j == len(part) - 1
+                if last:
+                    logit_rows[self.batch.n_tokens] = seq
+                self._add(tok, seq.n_past + j, seq.seq_id, last)
+            seq.pending = seq.pending[len(part):]
+            seq.n_past += len(part)
+
+        if self.batch.n_tokens == 0:
+            return
+        if llama_cpp.llama_decode(self.ctx, self.batch) != 0:
+            raise RuntimeError("llama_decode failed (KV cache full?)")
+
+        for row, seq in logit_rows.items():
+            logits = np.ctypeslib.as_array(llama_cpp.llama_get_logits_ith(self.ctx, row), shape=(self.n_vocab,))
+            self._emit(seq, self._sample(logits, seq))
+
+    def _sample(self, logits: np.ndarray, seq: BatchSequence) -> int:
+        logits = np.array(logits, dtype=np.float32)
+        if self.repeat_penalty != 1.0:
+            recent = np.unique(np.array((seq.prompt_tokens + seq.generated)[-64:], dtype=np.int64))
+            values = logits[recent]
+            logits[recent] = np.where(values > 0, values / self.repeat_penalty, values * self.repeat_penalty)
+        if self.temperature <= 0:
+            return int(np.argmax(logits))
+
+        # top-k, then top-p within the k candidates
+        top = np.argpartition(logits, -self.top_k)[-self.top_k:]
+        top = top[np.argsort(logits[top])[::-1]]
+        scaled = logits[top] / self.temperature
+        probs = np.exp(scaled - scaled.max())
+        probs /= probs.sum()
+        keep = int(np.searchsorted(np.cumsum(probs), self.top_p)) + 1
+        probs = probs[:keep] / probs[:keep].sum()
+        return int(top[self.rng.choice(keep, p=probs)])
+
+    def _emit(self, seq: BatchSequence, token: int):
+        if token in self.stop_token_ids:
+            self._finish(seq)
+            return
+        seq.generated.append(token)
+        seq.next_token = token
+
+        # Detokenize incrementally; multi-byte characters can span tokens
+        seq.byte_buffer += self.llm.detokenize([token])
+        try:
+            text = seq.byte_buffer.decode('utf-8')
+            seq.byte_buffer = b""
+        except UnicodeDecodeError:
+            if len(seq.byte_buffer) < 4:
+                text = ""
+            else:
+                text = seq.byte_buffer.decode('utf-8', errors='ignore')
+                seq.byte_buffer = b""
+        seq.text_buffer += text
+
+        for stop in seq.stop:
+            idx = seq.text_buffer.find(stop)
+            if idx != -1:
+                seq.text_buffer = seq.text_buffer[:idx]
+                self._finish(seq)
+                return
+
+        # Hold back a tail that could still grow into a stop string
+        hold = 0
+        for stop in seq.stop:
+            for n in range(min(len(stop) - 1, len(seq.text_buffer)), 0, -1):
+                if seq.text_buffer.endswith(stop[:n]):
+                    hold = max(hold, n)
+                    break
+        ready = seq.text_buffer[:len(seq.text_buffer) - hold]
+        seq.text_buffer = seq.text_buffer[len(ready):]
+        if ready:
+            seq.out.put(ready)
+
+        if len(seq.generated) >= seq.max_tokens:
+            self._finish(seq)
+
+    def _finish(self, seq: BatchSequence, flush: bool = True):
+        if seq not in self.active:
+            return
+        if flush and seq.text_buffer:
+            seq.out.put(seq.text_buffer)
+        seq.out.put(None)
+        llama_cpp.llama_kv_cache_seq_rm(self.ctx, seq.seq_id, -1, -1)
+        with self.cond:
+            self.active.remove(seq)
+            self.free_seq_ids.append(seq.seq_id)
+            self.reserved_total -= seq.reserved
+            self.cond.notify_all()
+
+    def _clear_batch(self):
+        self.batch.n_tokens = 0
+
+    def _add(self, token: int, pos: int, seq_id: int, logits: bool):
+        i = self.batch.n_tokens
+        self.batch.token[i] = token
+        self.batch.pos[i] = pos
+        self.batch.n_seq_id[i] = 1
+        self.batch.seq_id[i][0] = seq_id
+        self.batch.logits[i] = logits
+        self.batch.n_tokens = i + 1
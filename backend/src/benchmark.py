@@ -53,13 +53,23 @@ class BenchmarkSuite:
         
         # Lazy import to measure initialization time
         from src.rag_engine import RAGEngine
-        rag_engine = RAGEngine()
+        phases = {}
+        phase_start = time.time()
+        rag_engine = RAGEngine(load_models=False)
+        phases["vector_db"] = round(time.time() - phase_start, 4)
+        phase_start = time.time()
+        rag_engine.load_retrieval_models()
+        phases["embedder"] = round(time.time() - phase_start, 4)
+        phase_start = time.time()
+        rag_engine.load_llm()
+        phases["llm"] = round(time.time() - phase_start, 4)
         
         end_time = time.time()
         end_mem = self.monitor.get_ram_usage_mb()
         
         self.results["metrics"]["startup"] = {
             "time_seconds": round(end_time - start_time, 4),
+            "phase_seconds": phases,
             "ram_increase_mb": round(end_mem - start_mem, 2),
             "final_ram_mb": round(end_mem, 2)
         }
@@ -84,23 +94,162 @@ class BenchmarkSuite:
             "queries_run": len(queries)
         }
 
-    def benchmark_inference(self, rag_engine, prompt: str):
+    def benchmark_retrieval_modes(self, rag_engine, eval_set: list = None, k: int = None, samples: int = 50):
         """
-        Measure Tokens/Sec and Peak RAM.
+        Compare vector-only and hybrid (vector + BM25) retrieval: latency and recall@k.
+        `eval_set` is a list of {"query", "chunk_id"}; without one, queries are
+        sampled from indexed chunks (an 8-word span of a chunk must retrieve that chunk).
         """
-        logger.info("Running Inference Benchmark...")
-        
-        # Generator
+        import random
+        from src.config import TOP_K_RETRIEVAL
+        logger.info("Running Retrieval Mode Benchmark...")
+        k = k or TOP_K_RETRIEVAL
+
+        if eval_set is None:
+            indexed = rag_engine.vector_db.collection.get(limit=samples * 4, include=['documents'])
+            rng = random.Random(42)
+            eval_set = []
+            for cid, text in zip(indexed['ids'], indexed['documents']):
+                words = text.split()
+                if len(words) < 16:
+                    continue
+                start = rng.randrange(len(words) - 8)
+                eval_set.append({"query": " ".join(words[start:start + 8]), "chunk_id": cid})
+            eval_set = eval_set[:samples]
+        if not eval_set:
+            logger.warning("No indexed chunks to evaluate. Skipping retrieval mode benchmark.")
+            return
+
+        results = {}
+        for mode in ("vector", "hybrid"):
+            # Start cold so the second mode does not reuse the first one's results
+            rag_engine.vector_db.retrieval_cache.clear()
+            rag_engine.vector_db.query_embedding_cache.clear()
+            latencies = []
+            hits = 0
+            for item in eval_set:
+                start = time.time()
+                candidates = rag_engine.retrieve_candidates(item["query"], mode=mode, k=k)
+                latencies.append(time.time() - start)
+                hits += any(c.id == item["chunk_id"] for c in candidates[:k])
+            latencies.sort()
+            results[mode] = {
+                f"recall@{k}": round(hits / len(eval_set), 4),
+                "avg_latency_seconds": round(mean(latencies), 4),
+                "p90_latency_seconds": round(latencies[int(0.9 * (len(latencies) - 1))], 4),
+                "queries_run": len(eval_set)
+            }
+        self.results["metrics"]["retrieval_modes"] = results
+
+    def benchmark_reranker(self, rag_engine, queries: list):
+        """
+        Re-ranking cost vs. its saving: retrieval latency and packed context
+        tokens (i.e. prefill the LLM must do) with and without the re-ranker.
+        """
+        logger.info("Running Re-ranker Benchmark...")
+        reranker = rag_engine.reranker
+        if not reranker:
+            logger.warning("Re-ranker model not available. Skipping re-ranker benchmark.")
+            return
+
+        results = {}
+        for label, active in (("without_reranker", None), ("with_reranker", reranker)):
+            rag_engine.reranker = active
+            rag_engine.vector_db.retrieval_cache.clear()
+            latencies, context_tokens = [], []
+            for q in queries:
+                start = time.time()
+                chunks = rag_engine.retrieve_context(q)
+                latencies.append(time.time() - start)
+                context_tokens.append(rag_engine.context_tokens(chunks))
+            results[label] = {
+                "avg_latency_seconds": round(mean(latencies), 4),
+                "avg_context_tokens": round(mean(context_tokens), 1)
+            }
+        rag_engine.reranker = reranker
+        results["reranker"] = reranker.stats()
+        self.results["metrics"]["reranker"] = results
+
+    def benchmark_chunking(self, pages: list, repeats: int = 3):
+        """
+        Chunking throughput (chars/sec) of the native TextChunker vs. the
+        LangChain RecursiveCharacterTextSplitter, with the same size/overlap.
+        """
+        logger.info("Running Chunking Benchmark...")
+        from src.ingestion import DocumentIngestor
+        ingestor = DocumentIngestor()
+        total_chars = sum(len(text) for text, _ in pages)
+        splitters = {
+            "recursive": lambda: [c for text, _ in pages for c in ingestor.text_splitter.split_text(text)],
+            "native": lambda: [c for c, _, _ in ingestor.chunker.split_pages(pages)],
+            "native_span_pages": lambda: [c for c, _, _ in ingestor.chunker.split_pages(pages, span_pages=True)]
+        }
+
+        results = {}
+        for name, split in splitters.items():
+            durations = []
+            for _ in range(repeats):
+                start = time.time()
+                chunks = split()
+                durations.append(time.time() - start)
+            best = min(durations)
+            results[name] = {
+                "chars_per_sec": round(total_chars / best, 0) if best > 0 else 0,
+                "chunks": len(chunks),
+                "avg_chunk_chars": round(mean(len(c) for c in chunks), 1) if chunks else 0
+            }
+        self.results["metrics"]["chunking"] = results
+
+    def benchmark_embeddings(self, texts: list, backends: list = ("onnx", "sentence-transformers")):
+        """
+        Measure embeddings/sec and RSS for each available embedding backend.
+        """
+        logger.info("Running Embedding Benchmark...")
+        from src.embeddings import OnnxEmbeddingEngine, SentenceTransformerEmbeddingEngine
+        engines = {"onnx": OnnxEmbeddingEngine, "sentence-transformers": SentenceTransformerEmbeddingEngine}
+        results = {}
+
+        for backend in backends:
+            start_mem = self.monitor.get_ram_usage_mb()
+            load_start = time.time()
+            try:
+                engine = engines[backend]()
+            except Exception as e:
+                logger.warning(f"Skipping {backend} embedding backend: {e}")
+                continue
+            load_time = time.time() - load_start
+
+            engine.embed(texts[:4]) # Warm-up
+            start = time.time()
+            engine.embed(texts)
+            duration = time.time() - start
+
+            end_mem = self.monitor.get_ram_usage_mb()
+            results[backend] = {
+                "load_time_seconds": round(load_time, 4),
+                "embeddings_per_sec": round(len(texts) / duration, 2) if duration > 0 else 0,
+                "ram_increase_mb": round(end_mem - start_mem, 2),
+                "final_ram_mb": round(end_mem, 2)
+            }
+            del engine
+
+        self.results["metrics"]["embeddings"] = results
+
+    def _run_inference(self, llm_engine, prompt: str) -> dict:
         start_time = time.time()
         token_count = 0
         peak_ram = self.monitor.get_ram_usage_mb()
+        meta = {}
         
         # We manually call generate_response from internal LLM engine
-        stream = rag_engine.llm_engine.generate_response(prompt)
+        stream = llm_engine.generate_response(prompt)
         
         first_token_time = None
         
-        for _ in stream:
+        for piece in stream:
+            if isinstance(piece, dict):
+                meta = piece
+                continue
             if not first_token_time:
                 first_token_time = time.time()
             token_count += 1
@@ -109,17 +258,149 @@ class BenchmarkSuite:
                 peak_ram = current_ram
                 
         end_time = time.time()
-        total_time = end_time - start_time
         generation_time = end_time - (first_token_time or start_time)
         
         tps = token_count / generation_time if generation_time > 0 else 0
         
-        self.results["metrics"]["inference"] = {
+        return {
             "tokens_per_sec": round(tps, 2),
             "total_tokens": token_count,
             "time_to_first_token": round((first_token_time or end_time) - start_time, 4),
-            "peak_ram_mb": round(peak_ram, 2)
+            "peak_ram_mb": round(peak_ram, 2),
+            "speculative": meta.get("speculative")
+        }
+
+    def benchmark_inference(self, rag_engine, prompt: str, name: str = "inference"):
+        """
+        Measure Tokens/Sec and Peak RAM.
+        With speculative decoding enabled, the same prompt is also run on a
+        second engine loaded without a draft (a draft can only be set when the
+        context is created) to report the acceptance rate and the speedup.
+        """
+        logger.info("Running Inference Benchmark...")
+        llm_engine = rag_engine.llm_engine
+        results = self._run_inference(llm_engine, prompt)
+
+        if llm_engine.draft:
+            from src.llm_engine import LLMEngine
+            # Weights are mmapped, so the second engine mostly shares them with the first
+            baseline_engine = LLMEngine(speculative_mode="off")
+            try:
+                baseline = self._run_inference(baseline_engine, prompt)
+            finally:
+                del baseline_engine
+            results["baseline_tokens_per_sec"] = baseline["tokens_per_sec"]
+            results["speculative_speedup"] = round(results["tokens_per_sec"] / baseline["tokens_per_sec"], 2) if baseline["tokens_per_sec"] else None
+
+        self.results["metrics"][name] = results
+
+    def benchmark_generation_budget(self, rag_engine, queries: list):
+        """
+        Short questions: full context + fixed LLM_MAX_TOKENS vs the per-request
+        budget, on the full context and on the small context (created here if
+        SMALL_CONTEXT_WINDOW is off). Reports time to first token, total time,
+        tokens and the KV cache each request runs with.
+        """
+        from src.config import LLM_MAX_TOKENS, SMALL_CONTEXT_WINDOW
+        from src.batching import ContinuousBatcher
+        from src.hardware import kv_bytes_per_token
+        logger.info("Running Generation Budget Benchmark...")
+        llm_engine = rag_engine.llm_engine
+        if llm_engine.batcher:
+            logger.warning("Continuous batching is enabled; budgets only shrink KV reservations there. Skipping.")
+            return
+
+        small_ctx_size = SMALL_CONTEXT_WINDOW or 1536
+        small_ctx_ram_mb = None
+        created = False
+        if not llm_engine.small_ctx:
+            start_mem = self.monitor.get_ram_usage_mb()
+            llm_engine.small_ctx = ContinuousBatcher(llm_engine.llm, 1, ctx_per_sequence=small_ctx_size,
+                                                     n_threads=llm_engine.profile["n_threads"], n_threads_batch=llm_engine.profile["n_threads_batch"])
+            if llm_engine.prefix_tokens:
+                llm_engine.small_ctx.set_prefix(llm_engine.prefix_tokens)
+            small_ctx_ram_mb = round(self.monitor.get_ram_usage_mb() - start_mem, 2)
+            created = True
+
+        kv_mb = kv_bytes_per_token(llm_engine.model_info or {}) / 1024 / 1024
+        modes = {
+            "fixed_full": {"budget": False, "small": False, "n_ctx": llm_engine.n_ctx},
+            "budget_full": {"budget": True, "small": False, "n_ctx": llm_engine.n_ctx},
+            "budget_small": {"budget": True, "small": True, "n_ctx": small_ctx_size}
         }
+        results = {}
+        try:
+            for name, mode in modes.items():
+                ttfts, durations, tokens = [], [], []
+                for q in queries:
+                    chunks = rag_engine.retrieve_context(q)
+                    prompt = rag_engine.build_prompt(q, chunks)
+                    context_tokens = rag_engine.context_tokens(chunks)
+                    max_tokens = rag_engine.generation_budget(q, context_tokens, bool(chunks)) if mode["budget"] else LLM_MAX_TOKENS
+                    start = time.time()
+                    first = None
+                    count = 0
+                    for piece in llm_engine.generate_response(prompt, max_tokens=max_tokens, use_small_ctx=mode["small"]):
+                        if isinstance(piece, dict):
+                            continue
+                        if first is None:
+                            first = time.time()
+                        count += 1
+                    ttfts.append((first or time.time()) - start)
+                    durations.append(time.time() - start)
+                    tokens.append(count)
+                results[name] = {
+                    "avg_ttft_seconds": round(mean(ttfts), 4),
+                    "avg_total_seconds": round(mean(durations), 4),
+                    "avg_tokens": round(mean(tokens), 1),
+                    "kv_cache_mb": round(mode["n_ctx"] * kv_mb, 1)
+                }
+        finally:
+            if created:
+                llm_engine.small_ctx = None
+
+        results["small_ctx_ram_mb"] = small_ctx_ram_mb
+        results["intents"] = {q: rag_engine.classify_intent(q) for q in queries}
+        self.results["metrics"]["generation_budget"] = results
+
+    def benchmark_concurrency(self, rag_engine, prompt: str, levels: list = (1, 2, 4, 8)):
+        """
+        Measure aggregate Tokens/Sec with N concurrent streams.
+        Only meaningful with continuous batching (BHARATEDGE_BATCH_SEQUENCES >= max level);
+        without it the streams would share one llama context, so it is skipped.
+        """
+        import threading
+        logger.info("Running Concurrency Benchmark...")
+        llm_engine = rag_engine.llm_engine
+        if not llm_engine.batcher:
+            logger.warning("Continuous batching is disabled. Skipping concurrency benchmark.")
+            return
+
+        results = {}
+        for n in levels:
+            counts = [0] * n
+
+            def run(i):
+                for piece in llm_engine.generate_response(prompt):
+                    if not isinstance(piece, dict):
+                        counts[i] += 1
+
+            threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+            start = time.time()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            duration = time.time() - start
+
+            results[str(n)] = {
+                "aggregate_tokens_per_sec": round(sum(counts) / duration, 2) if duration > 0 else 0,
+                "per_stream_tokens_per_sec": round(sum(counts) / n / duration, 2) if duration > 0 else 0,
+                "total_tokens": sum(counts),
+                "wall_time_seconds": round(duration, 2)
+            }
+
+        self.results["metrics"]["concurrency"] = results
 
     def save_results(self):
         filename = f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
@@ -133,7 +414,16 @@ if __name__ == "__main__":
     print("Starting Benchmark Suite for BharatEdge AI...")
     suite = BenchmarkSuite()
     
-    # 1. Startup
+    # 0. Chunking (no models needed). Mixed paragraphs/sentences, ~2MB of text
+    sample_pages = [(("Clause 4.2 applies to all district offices. " * 12 + "\n\n") * 20, page) for page in range(1, 201)]
+    suite.benchmark_chunking(sample_pages)
+
+    # 1. Embedding backends (before startup, so RSS is not skewed by the LLM)
+    # Chunk-sized sample texts
+    sample_texts = [f"Section {i}: The annual report covers revenue, expenses and project milestones for the district. " * 8 for i in range(256)]
+    suite.benchmark_embeddings(sample_texts)
+
+    # 1b. Startup
     engine = suite.benchmark_startup()
     
     # 2. Retrieval (Needs data indexed ideally, but will run empty/light if not)
@@ -141,10 +431,21 @@ if __name__ == "__main__":
     # We will use generic queries.
     queries = ["What is the summary?", "financial report 2024", "project deadlines"]
     suite.benchmark_retrieval(engine, queries)
+    suite.benchmark_retrieval_modes(engine)
+    suite.benchmark_reranker(engine, queries)
     
     # 3. Inference
     dummy_prompt = "User: Write a poem about a futuristic India.\nAssistant:"
     suite.benchmark_inference(engine, dummy_prompt)
+    # RAG-shaped prompt: the answer can quote its context, which prompt-lookup drafting exploits
+    rag_prompt = engine.build_prompt("What is the summary?", engine.retrieve_context("What is the summary?"))
+    suite.benchmark_inference(engine, rag_prompt, name="inference_rag")
+
+    # 3a. Per-request budgets and the small context on short questions
+    suite.benchmark_generation_budget(engine, ["When was the report published?", "Who approved the budget?", "What is the project deadline?"])
+
+    # 3b. Concurrent streams (continuous batching)
+    suite.benchmark_concurrency(engine, dummy_prompt)
     
     # 4. Save
     suite.save_results()
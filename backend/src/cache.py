@@ -0,0 +1,58 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+class LRUCache:
+    """
+    Small thread-safe LRU cache with hit/miss counters and an approximate
+    memory footprint, so sizes can be tuned from /cache/stats.
+    """
+
+    def __init__(self, max_entries: int, sizeof: Callable[[Any], int] = sys.getsizeof):
+        self.max_entries = max_entries
+        self.sizeof = sizeof
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.approx_bytes = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_entries <= 0:
+            return
+        size = self.sizeof(value) + sys.getsizeof(key)
+        with self.lock:
+            if key in self.data:
+                self.approx_bytes -= self.data.pop(key)[1]
+            self.data[key] = (value, size)
+            self.approx_bytes += size
+            while len(self.data) > self.max_entries:
+                _, (_, evicted_size) = self.data.popitem(last=False)
+                self.approx_bytes -= evicted_size
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.approx_bytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.data),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "approx_memory_kb": round(self.approx_bytes / 1024, 1)
+            }
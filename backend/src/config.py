@@ -16,19 +16,27 @@ else:
 
 DATA_DIR = os.path.join(BACKEND_DIR, "data")
 DB_DIR = os.path.join(BACKEND_DIR, "database")
+MANIFEST_DIR = os.path.join(DB_DIR, "manifests")
 MODELS_DIR = os.path.join(BACKEND_DIR, "models")
 LOG_DIR = os.path.join(BACKEND_DIR, "logs")
 LOG_FILE = os.path.join(LOG_DIR, "backend.log")
 
+# Staged Startup
+# Components load in the background in this order once the HTTP server is up;
+# /health reports each one's readiness without triggering loads.
+STARTUP_ORDER = [c.strip() for c in os.getenv("BHARATEDGE_STARTUP_ORDER", "vector_db,embedder,llm").split(",") if c.strip()]
+STARTUP_WARM = os.getenv("BHARATEDGE_STARTUP_WARM", "true").lower() == "true"
+
 # Hardware Configuration (8GB RAM Target)
 # n_ctx: Context window (limited to saving RAM on low-spec units)
 MAX_CONTEXT_WINDOW = 4096 
 
 # n_threads Detection
-import multiprocessing
 def get_optimal_threads():
     try:
-        cores = multiprocessing.cpu_count()
+        import psutil
+        # Physical cores: SMT siblings share the FPUs, so counting them oversubscribes llama.cpp
+        cores = psutil.cpu_count(logical=False) or psutil.cpu_count()
         # For 4 cores, use 4. For more, use cores-1 to keep system responsive.
         return max(1, cores if cores <= 4 else cores - 1)
     except:
@@ -48,6 +56,33 @@ N_GPU_LAYERS = 35 if USE_GPU else 0
 # User must place these models here manually or via script
 LLM_MODEL_FILENAME = "qwen2.5-3b-instruct-q4_k_m.gguf"
 LLM_MODEL_PATH = os.path.join(MODELS_DIR, LLM_MODEL_FILENAME)
+LLM_MODEL_URL = os.getenv("BHARATEDGE_LLM_URL", f"https://huggingface.co/Qwen/Qwen2.5-3B-Instruct-GGUF/resolve/main/{LLM_MODEL_FILENAME}")
+# Expected SHA-256 of the GGUF. If unset, the checksum Hugging Face publishes for the file is used.
+LLM_MODEL_SHA256 = os.getenv("BHARATEDGE_LLM_SHA256") or None
+
+# Model download (/setup/init): parallel Range requests, resumable via a .part.json manifest
+DOWNLOAD_SEGMENTS = int(os.getenv("BHARATEDGE_DOWNLOAD_SEGMENTS", "4"))
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+DOWNLOAD_TIMEOUT_SECONDS = 30
+
+# Model validation results (GGUF header + tensor index), keyed by path, size and mtime
+MODEL_REGISTRY_PATH = os.path.join(MODELS_DIR, "model_registry.json")
+# Hardware profile (threads, n_batch, n_ctx, mmap/mlock) chosen per machine and model.
+# BHARATEDGE_CALIBRATE=true benchmarks prefill/decode across thread counts and batch
+# sizes on the next LLM load and saves the winner; otherwise RAM/core heuristics apply.
+HARDWARE_PROFILE_PATH = os.path.join(MODELS_DIR, "hardware_profile.json")
+CALIBRATE_ON_LOAD = os.getenv("BHARATEDGE_CALIBRATE", "false").lower() == "true"
+CALIBRATION_PREFILL_TOKENS = 1024
+CALIBRATION_DECODE_TOKENS = 32
+# RAM kept free for the OS, UI and embedder when sizing the KV cache and deciding on mlock
+MEMORY_RESERVE_MB = int(os.getenv("BHARATEDGE_MEMORY_RESERVE_MB", "1536"))
+# Hand-set values always win over the profile
+LLM_THREADS = int(os.getenv("BHARATEDGE_LLM_THREADS", "0")) or None
+LLM_THREADS_BATCH = int(os.getenv("BHARATEDGE_LLM_THREADS_BATCH", "0")) or None
+LLM_N_CTX = int(os.getenv("BHARATEDGE_CONTEXT_WINDOW", "0")) or None
+LLM_N_BATCH = int(os.getenv("BHARATEDGE_LLM_BATCH", "0")) or None
+LLM_USE_MLOCK = os.getenv("BHARATEDGE_MLOCK", "").lower() == "true" if os.getenv("BHARATEDGE_MLOCK") else None
+LLM_USE_MMAP = os.getenv("BHARATEDGE_MMAP", "").lower() == "true" if os.getenv("BHARATEDGE_MMAP") else None
 
 # Embedding Model - Offline Configuration
 # User must download 'all-MiniLM-L6-v2' and place it in backend/models/embeddings/all-MiniLM-L6-v2
@@ -56,8 +91,18 @@ EMBEDDING_MODEL_NAME = os.path.abspath(os.path.join(MODELS_DIR, "embeddings", "a
 # Ensure the directory structure exists in code (or user creates it)
 EMBEDDING_CACHE_DIR = os.path.join(MODELS_DIR, "embeddings")
 
+# Embedding Backend
+# "auto" uses the int8 ONNX export when present (no torch import), else sentence-transformers.
+# Create the ONNX export with scripts/export_onnx_embedding.py.
+EMBEDDING_BACKEND = os.getenv("BHARATEDGE_EMBEDDING_BACKEND", "auto").lower()
+EMBEDDING_ONNX_PATH = os.path.join(EMBEDDING_MODEL_NAME, "onnx", "model_int8.onnx")
+EMBEDDING_BATCH_SIZE = int(os.getenv("BHARATEDGE_EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_THREADS = int(os.getenv("BHARATEDGE_EMBEDDING_THREADS", str(CPU_THREADS)))
+EMBEDDING_MAX_SEQ_LENGTH = 256  # all-MiniLM-L6-v2 was trained with 256 word pieces
+
 os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(DB_DIR, exist_ok=True)
+os.makedirs(MANIFEST_DIR, exist_ok=True)
 os.makedirs(MODELS_DIR, exist_ok=True)
 os.makedirs(LOG_DIR, exist_ok=True)
 # We Create the embedding folder too so user sees it
@@ -69,16 +114,146 @@ os.makedirs(EMBEDDING_CACHE_DIR, exist_ok=True)
 # semantic meaning while keeping granularity high for retrieval.
 CHUNK_SIZE_CHARS = 1000 
 CHUNK_OVERLAP_CHARS = 200
+# "native" = single-pass TextChunker in ingestion.py; "recursive" = LangChain's RecursiveCharacterTextSplitter
+CHUNKER = os.getenv("BHARATEDGE_CHUNKER", "native").lower()
+# Let chunks run across page breaks (attributed to the page they start on, with page_end recorded)
+CHUNK_SPAN_PAGES = os.getenv("BHARATEDGE_CHUNK_SPAN_PAGES", "false").lower() == "true"
+
+# PDF Parsing
+# Large PDFs are parsed in parallel page ranges, one PyMuPDF handle per worker process.
+PDF_PARSE_WORKERS = int(os.getenv("BHARATEDGE_PARSE_WORKERS", str(CPU_THREADS)))
+PDF_PARALLEL_MIN_PAGES = 32  # Below this, process start-up costs more than it saves
+
+# Text and DOCX Parsing
+# Files without pages are streamed paragraph by paragraph and cut into logical
+# sections at headings (or every SECTION_MAX_CHARS); the section number takes the place of a page number.
+SECTION_MAX_CHARS = 20000
+TEXT_READ_CHARS = 1024 * 1024  # Longest slice read at once from a text file (bounds memory on newline-free exports)
+
+# OCR (scanned PDFs)
+# Pages whose text layer has fewer than OCR_MIN_TEXT_CHARS characters are rendered
+# at OCR_DPI and read with easyocr. Each OCR worker holds its own reader (~1GB), so the
+# worker count is also capped by available RAM / OCR_WORKER_MEMORY_MB, and a worker
+# whose RSS passes OCR_WORKER_MEMORY_MB gets the pool restarted.
+OCR_ENABLED = os.getenv("BHARATEDGE_OCR", "true").lower() == "true"
+OCR_DPI = int(os.getenv("BHARATEDGE_OCR_DPI", "200"))
+OCR_LANGUAGES = os.getenv("BHARATEDGE_OCR_LANGUAGES", "en,hi").split(",")
+OCR_WORKERS = int(os.getenv("BHARATEDGE_OCR_WORKERS", str(max(1, min(2, CPU_THREADS // 4)))))
+OCR_WORKER_MEMORY_MB = int(os.getenv("BHARATEDGE_OCR_WORKER_MEMORY_MB", "1200"))
+OCR_BATCH_PAGES = 4         # Pages per worker task
+OCR_REORDER_PAGES = 64      # Text pages held back (to keep page order) while an earlier page is OCR'd
+OCR_MIN_TEXT_CHARS = 16     # A page number or stamp alone does not count as a text layer
+OCR_IDLE_SECONDS = 300      # Shut the OCR workers down after this long without work
+OCR_CACHE_DIR = os.path.join(DB_DIR, "ocr_cache")
+OCR_MODEL_DIR = os.path.join(MODELS_DIR, "easyocr")
+
+# Ingestion Jobs
+# Uploads are parsed/embedded on a background worker pool so /chat and /health stay responsive.
+# Embedding is CPU-bound, so one worker (jobs queue up) is the right default on 4-core machines.
+INGEST_WORKERS = int(os.getenv("BHARATEDGE_INGEST_WORKERS", "1"))
+INGEST_JOB_HISTORY = 100  # Finished jobs kept for status queries
+# Chunks are embedded and upserted in micro-batches of this size, so ingestion
+# memory is bounded by the batch, not by the document.
+INGEST_BATCH_SIZE = int(os.getenv("BHARATEDGE_INGEST_BATCH_SIZE", "64"))
 
 # Context Budget
 # Phi-3 / Qwen context window is typically 4096 tokens.
 # We reserve space for system prompt, user query, and generation.
 # Target ~2000 tokens for retrieved context to leave room for the rest.
 MAX_RETRIEVAL_TOKENS = 2500
-TOP_K_RETRIEVAL = 20  # Increased further to ensure secondary documents are not crowded out
+# Candidates fetched from each retriever. Hybrid search recovers the exact-match
+# hits (invoice/section numbers, names, Indic terms) that needed k=20 with vectors alone.
+TOP_K_RETRIEVAL = int(os.getenv("BHARATEDGE_TOP_K", "10"))
+
+# Hybrid Retrieval
+# "hybrid" fuses MiniLM vector search with a BM25 index using reciprocal rank fusion; "vector" disables BM25.
+RETRIEVAL_MODE = os.getenv("BHARATEDGE_RETRIEVAL_MODE", "hybrid").lower()
+RRF_K = 60                  # Standard RRF damping constant
+BM25_K1 = 1.2
+BM25_B = 0.75
+LEXICAL_INDEX_DIR = os.path.join(DB_DIR, "bm25")
+# Postings buffered while building a document's segment before spilling a sorted run to disk
+LEXICAL_SPILL_POSTINGS = 200000
+LEXICAL_MERGE_FAN_IN = 32   # Runs merged per pass (bounds open file handles)
+
+# Document Registry
+# Per-document records (hash, pages, chunks, times) serving /documents and source filters.
+REGISTRY_PATH = os.path.join(DB_DIR, "documents.json")
+DOCUMENT_PAGE_MAX = 1000        # Largest /documents page a client can request (no limit returns all)
+# Source-filtered searches over at most this many chunks are scored exactly against
+# the documents' own embeddings (by chunk ID) instead of a Chroma metadata filter.
+FILTERED_SEARCH_MAX_CHUNKS = 20000
+DOCUMENT_EMBEDDING_CACHE_DOCS = 32  # Per-document embedding matrices kept in RAM
+# Written once documents indexed before manifests/registry/BM25 existed have been backfilled
+INDEX_BACKFILL_MARKER = os.path.join(DB_DIR, ".index_backfill_v1")
+BACKFILL_PAGE_SIZE = 1000       # Chroma rows read per page while backfilling
+
+# Re-ranking
+# An int8 ONNX cross-encoder re-scores the fused candidates in one batch and only
+# the best RERANK_TOP_N go on to budget packing. Export it with scripts/export_onnx_reranker.py.
+# If scoring takes longer than RERANKER_TIMEOUT_MS it is aborted and retrieval order is kept.
+RERANKER_ENABLED = os.getenv("BHARATEDGE_RERANKER", "true").lower() == "true"
+RERANKER_MODEL_DIR = os.path.abspath(os.path.join(MODELS_DIR, "rerankers", "ms-marco-MiniLM-L-6-v2"))
+RERANKER_ONNX_PATH = os.path.join(RERANKER_MODEL_DIR, "onnx", "model_int8.onnx")
+RERANKER_MAX_SEQ_LENGTH = 320  # Query + one 1000-char chunk
+RERANKER_TIMEOUT_MS = float(os.getenv("BHARATEDGE_RERANKER_TIMEOUT_MS", "300"))
+RERANK_TOP_N = int(os.getenv("BHARATEDGE_RERANK_TOP_N", "6"))
+
+# Query Caches (LRU, entries)
+# Users repeat questions and the UI resends the same source filter; both caches
+# are cheap (~1.5KB per embedding, a few KB per result list).
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("BHARATEDGE_QUERY_EMBEDDING_CACHE", "1024"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("BHARATEDGE_RETRIEVAL_CACHE", "256"))
+
+# Semantic Answer Cache (opt-in)
+# Replays a stored answer when a new question is this similar (cosine) and
+# retrieves exactly the same chunks. Invalidated when a source document changes.
+ANSWER_CACHE_ENABLED = os.getenv("BHARATEDGE_ANSWER_CACHE", "false").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("BHARATEDGE_ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_SIZE = 128
 
 # LLM Generation Settings
 LLM_TEMPERATURE = 0.1       # Low temperature for factual RAG
 LLM_MAX_TOKENS = 512        # Max new tokens to generate
 LLM_CONTEXT_WINDOW = 4096   # Total context window of the model
 
+# Per-request generation budget (max new tokens), picked from the question's intent:
+# short factual lookups rarely need more than a couple of sentences.
+DYNAMIC_BUDGET_ENABLED = os.getenv("BHARATEDGE_DYNAMIC_BUDGET", "true").lower() == "true"
+GENERATION_BUDGETS = {"short": 128, "normal": 320, "long": LLM_MAX_TOKENS}
+# "normal" questions over this much retrieved context get the long budget (multi-source answers)
+LONG_CONTEXT_TOKENS = 1024
+# Second, pre-allocated small llama.cpp context on the same weights for requests whose
+# prompt + budget fit. Smaller KV cache and attention buffers -> faster first token. 0 disables.
+SMALL_CONTEXT_WINDOW = int(os.getenv("BHARATEDGE_SMALL_CTX", "0"))
+
+# Speculative decoding (single-sequence path only; the batcher and small context decode normally)
+# "prompt_lookup": draft tokens by matching n-grams from the prompt, no extra model; answers that
+#                  quote the retrieved context verbatim are accepted several tokens per step.
+# "draft":         greedy drafts from a small GGUF with the same vocabulary (Qwen2.5-0.5B).
+# "off":           plain decoding.
+# Either mode makes llama.cpp keep logits for every context position (n_ctx x vocab floats).
+SPECULATIVE_MODE = os.getenv("BHARATEDGE_SPECULATIVE", "off").lower()
+SPECULATIVE_DRAFT_TOKENS = int(os.getenv("BHARATEDGE_DRAFT_TOKENS", "8"))
+PROMPT_LOOKUP_NGRAM = 2
+DRAFT_MODEL_PATH = os.getenv("BHARATEDGE_DRAFT_MODEL", os.path.join(MODELS_DIR, "qwen2.5-0.5b-instruct-q4_k_m.gguf"))
+
+# Continuous Batching (shared kiosk deployments)
+# >1 decodes that many concurrent chats in one multi-sequence llama.cpp context.
+# Each sequence gets its own BATCH_CTX_PER_SEQUENCE slice of the KV cache (~36KB/token for Qwen2.5-3B).
+BATCH_MAX_SEQUENCES = int(os.getenv("BHARATEDGE_BATCH_SEQUENCES", "1"))
+BATCH_CTX_PER_SEQUENCE = LLM_CONTEXT_WINDOW
+BATCH_N_BATCH = 512
+
+# Generation Scheduler
+# Only BATCH_MAX_SEQUENCES requests use the model at a time; the rest wait in a bounded queue.
+GEN_QUEUE_SIZE = int(os.getenv("BHARATEDGE_GEN_QUEUE_SIZE", "8"))
+GEN_DEADLINE_SECONDS = float(os.getenv("BHARATEDGE_GEN_DEADLINE", "300"))
+GEN_METRICS_WINDOW = 500    # Recent requests used for latency percentiles
+
+
+# Prompt Prefix Cache
+# The static system block is evaluated once and its KV state is saved here,
+# so later requests (and cold starts) only evaluate the per-request suffix.
+PROMPT_CACHE_ENABLED = os.getenv("BHARATEDGE_PROMPT_CACHE", "true").lower() == "true"
+PROMPT_CACHE_DIR = os.path.join(MODELS_DIR, "prompt_cache")
@@ -0,0 +1,289 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+import requests
+from src.config import DOWNLOAD_SEGMENTS, DOWNLOAD_CHUNK_BYTES, DOWNLOAD_TIMEOUT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+class DownloadError(Exception):
+    """Raised when a download fails or its checksum does not match."""
+
+class RangedDownloader:
+    """
+    Resumable, parallel HTTP download into `dest`.
+
+    The file is split into `segments` byte ranges fetched concurrently with
+    Range requests into a sparse `<dest>.part` file. Per-segment progress is
+    saved to `<dest>.part.json` as it goes, so an interrupted download resumes
+    where each segment stopped. A SHA-256 follows the contiguous downloaded
+    prefix while segments are written, and the file is moved into place only
+    after the digest matches. Servers without range support get one
+    sequential stream (not resumable).
+
+    Works against any HTTP server; pass `session` to use a custom one.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        dest: str,
+        sha256: Optional[str] = None,
+        segments: int = DOWNLOAD_SEGMENTS,
+        chunk_bytes: int = DOWNLOAD_CHUNK_BYTES,
+        session: Optional[requests.Session] = None,
+        on_progress: Optional[Callable[[Dict], None]] = None
+    ):
+        self.url = url
+        self.fetch_url = url  # after redirects; may be a short-lived signed URL
+        self.dest = dest
+        self.part_path = dest + ".part"
+        self.manifest_path = dest + ".part.json"
+        self.expected_sha256 = sha256.lower() if sha256 else None
+        self.n_segments = max(1, segments)
+        self.chunk_bytes = chunk_bytes
+        self.session = session or requests.Session()
+        self.on_progress = on_progress
+
+        self.lock = threading.Lock()
+        self.size = 0
+        self.segments: List[Dict] = []
+        self.hasher = hashlib.sha256()
+        self.hashed_upto = 0
+        self.started_at = None
+        self.resumed_bytes = 0
+        self.cancelled = False
+
+    # --- Remote metadata ---
+
+    def _probe(self) -> Dict:
+        """
+        Size, range support, validator and (on Hugging Face) the published SHA-256.
+        """
+        response = self.session.head(self.url, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        published_sha256 = None
+        # Hugging Face puts the LFS object's SHA-256 in X-Linked-Etag on the redirect
+        for r in list(response.history) + [response]:
+            linked = r.headers.get("X-Linked-Etag", "").strip('"')
+            if re.fullmatch(r"[0-9a-fA-F]{64}", linked):
+                published_sha256 = linked.lower()
+        return {
+            "url": response.url,
+            "size": int(response.headers.get("Content-Length", 0)),
+            "ranges": response.headers.get("Accept-Ranges", "").lower() == "bytes",
+            "etag": response.headers.get("ETag"),
+            "sha256": published_sha256
+        }
+
+    # --- Resume manifest ---
+
+    def _load_manifest(self, info: Dict) -> Optional[List[Dict]]:
+        if not (os.path.exists(self.manifest_path) and os.path.exists(self.part_path)):
+            return None
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except Exception as e:
+            logger.warning(f"Corrupt download manifest, restarting: {e}")
+            return None
+        # Only resume the same remote object
+        if manifest.get("url") != self.url or manifest.get("size") != info["size"] or manifest.get("etag") != info["etag"]:
+            logger.info("Remote file changed since the partial download. Restarting.")
+            return None
+        return manifest["segments"]
+
+    def _save_manifest(self, etag: Optional[str]):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"url": self.url, "size": self.size, "etag": etag, "segments": self.segments}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _plan_segments(self) -> List[Dict]:
+        step = -(-self.size // self.n_segments)
+        return [
+            {"index": i, "start": start, "end": min(start + step, self.size), "downloaded": 0}
+            for i, start in enumerate(range(0, self.size, step))
+        ]
+
+    # --- Progress ---
+
+    def progress(self) -> Dict:
+        with self.lock:
+            downloaded = sum(s["downloaded"] for s in self.segments)
+            elapsed = time.time() - self.started_at if self.started_at else 0
+            speed = (downloaded - self.resumed_bytes) / elapsed if elapsed > 0 else 0
+            return {
+                "total_bytes": self.size,
+                "downloaded_bytes": downloaded,
+                "verified_bytes": self.hashed_upto,
+                "speed_mbps": round(speed / 1024 / 1024, 2),
+                "segments": [
+                    {
+                        "index": s["index"],
+                        "start": s["start"],
+                        "end": s["end"],
+                        "downloaded": s["downloaded"],
+                        "done": s["downloaded"] >= s["end"] - s["start"]
+                    }
+                    for s in self.segments
+                ]
+            }
+
+    def _report(self):
+        if self.on_progress:
+            self.on_progress(self.progress())
+
+    # --- Incremental hashing ---
+
+    def _contiguous_end(self) -> int:
+        end = 0
+        for s in self.segments:
+            end = s["start"] + s["downloaded"]
+            if s["downloaded"] < s["end"] - s["start"]:
+                break
+        return end
+
+    def _advance_hash(self, reader):
+        """
+        Feed newly contiguous bytes (read back from the part file) into the digest.
+        Called with self.lock held by whichever thread extended the prefix.
+        """
+        target = self._contiguous_end()
+        while self.hashed_upto < target:
+            reader.seek(self.hashed_upto)
+            block = reader.read(min(self.chunk_bytes * 4, target - self.hashed_upto))
+            if not block:
+                break
+            self.hasher.update(block)
+            self.hashed_upto += len(block)
+
+    # --- Transfer ---
+
+    def _fetch_segment(self, segment: Dict, etag: Optional[str]):
+        offset = segment["start"] + segment["downloaded"]
+        if offset >= segment["end"]:
+            return
+        headers = {"Range": f"bytes={offset}-{segment['end'] - 1}"}
+        if etag:
+            headers["If-Range"] = etag
+        with self.session.get(self.fetch_url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT_SECONDS) as response:
+            if response.status_code != 206:
+                raise DownloadError(f"Server ignored range request for segment {segment['index']} (HTTP {response.status_code})")
+            last_saved = time.time()
+            # Unbuffered, so bytes counted as downloaded are already visible to the hashing reader
+            with open(self.part_path, "r+b", buffering=0) as writer, open(self.part_path, "rb") as reader:
+                writer.seek(offset)
+                try:
+                    for data in response.iter_content(chunk_size=self.chunk_bytes):
+                        if self.cancelled:
+                            raise DownloadError("Download cancelled")
+                        data = data[:segment["end"] - offset]
+                        writer.write(data)
+                        offset += len(data)
+                        with self.lock:
+                            segment["downloaded"] += len(data)
+                            if segment["start"] <= self.hashed_upto <= offset:
+                                self._advance_hash(reader)
+                            if time.time() - last_saved > 1.0:
+                                self._save_manifest(etag)
+                                last_saved = time.time()
+                        self._report()
+                        if offset >= segment["end"]:
+                            break
+                finally:
+                    # Record progress even when interrupted, so the next attempt resumes here
+                    with self.lock:
+                        self._save_manifest(etag)
+        if offset < segment["end"]:
+            raise DownloadError(f"Segment {segment['index']} ended early at byte {offset}")
+
+    def _download_sequential(self, info: Dict):
+        """
+        Fallback for servers without range support: a single stream, hashed inline.
+        """
+        self.segments = [{"index": 0, "start": 0, "end": self.size, "downloaded": 0}]
+        with self.session.get(self.fetch_url, stream=True, timeout=DOWNLOAD_TIMEOUT_SECONDS) as response:
+            response.raise_for_status()
+            with open(self.part_path, "wb") as f:
+                for data in response.iter_content(chunk_size=self.chunk_bytes):
+                    if self.cancelled:
+                        raise DownloadError("Download cancelled")
+                    f.write(data)
+                    with self.lock:
+                        self.hasher.update(data)
+                        self.segments[0]["downloaded"] += len(data)
+                        self.hashed_upto = self.segments[0]["downloaded"]
+                    self._report()
+        if self.size and self.segments[0]["downloaded"] != self.size:
+            raise DownloadError(f"Download ended early at byte {self.segments[0]['downloaded']} of {self.size}")
+
+    def download(self) -> str:
+        """
+        Download (or resume) into place. Returns the verified SHA-256.
+        """
+        info = self._probe()
+        self.size = info["size"]
+        self.fetch_url = info["url"]
+        expected = self.expected_sha256 or info["sha256"]
+        self.started_at = time.time()
+
+        if not info["ranges"] or self.size == 0:
+            logger.info("Server does not support range requests. Downloading in one stream.")
+            self._download_sequential(info)
+        else:
+            segments = self._load_manifest(info)
+            if segments is None:
+                self.segments = self._plan_segments()
+                with open(self.part_path, "wb") as f:
+                    f.truncate(self.size)  # Sparse where the filesystem supports it
+            else:
+                self.segments = segments
+            with self.lock:
+                self.resumed_bytes = sum(s["downloaded"] for s in self.segments)
+                self._save_manifest(info["etag"])
+                if self.resumed_bytes:
+                    logger.info(f"Resuming download at {self.resumed_bytes / 1024 / 1024:.0f}MB of {self.size / 1024 / 1024:.0f}MB")
+                    # The digest cannot be persisted, so re-hash what is already contiguous
+                    with open(self.part_path, "rb") as reader:
+                        self._advance_hash(reader)
+
+            logger.info(f"Downloading {self.size / 1024 / 1024:.0f}MB in {len(self.segments)} segments")
+            with ThreadPoolExecutor(max_workers=len(self.segments), thread_name_prefix="download") as pool:
+                futures = [pool.submit(self._fetch_segment, s, info["etag"]) for s in self.segments]
+                try:
+                    for future in futures:
+                        future.result()
+                except BaseException:
+                    self.cancelled = True  # Stop the other segments; progress stays in the manifest
+                    raise
+            with self.lock, open(self.part_path, "rb") as reader:
+                self._advance_hash(reader)
+
+        digest = self.hasher.hexdigest()
+        if self.hashed_upto != self.size and self.size:
+            raise DownloadError(f"Hashed {self.hashed_upto} of {self.size} bytes")
+        if expected and digest != expected:
+            # Corrupt data cannot be resumed from; start clean next time
+            self._discard()
+            raise DownloadError(f"SHA-256 mismatch: expected {expected}, got {digest}")
+        if not expected:
+            logger.warning(f"No published checksum for {self.url}. Downloaded SHA-256: {digest}")
+
+        os.replace(self.part_path, self.dest)
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        self._report()
+        logger.info(f"Downloaded {self.dest} ({self.size / 1024 / 1024:.0f}MB, sha256 {digest[:12]}...) in {time.time() - self.started_at:.1f}s")
+        return digest
+
+    def _discard(self):
+        for path in (self.part_path, self.manifest_path):
+            if os.path.exists(path):
+                os.remove(path)
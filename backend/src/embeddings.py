@@ -0,0 +1,125 @@
+import os
+import logging
+from typing import List
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from src.config import (
+    EMBEDDING_MODEL_NAME,
+    EMBEDDING_BACKEND,
+    EMBEDDING_ONNX_PATH,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_THREADS,
+    EMBEDDING_MAX_SEQ_LENGTH
+)
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingEngine(EmbeddingFunction[Documents]):
+    """
+    Base class for pluggable embedding backends.
+    Implements Chroma's EmbeddingFunction protocol so an engine can be handed
+    straight to a collection, and exposes `embed` for direct batched use.
+    """
+    name = "base"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def __call__(self, input: Documents) -> Embeddings:
+        if not input:
+            return []
+        return self.embed(list(input)).tolist()
+
+class SentenceTransformerEmbeddingEngine(EmbeddingEngine):
+    """
+    Original backend: sentence-transformers on torch. Heavier to import and
+    hold in RAM, but works without an exported ONNX model.
+    """
+    name = "sentence-transformers"
+
+    def __init__(self, model_path: str = EMBEDDING_MODEL_NAME, batch_size: int = EMBEDDING_BATCH_SIZE):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_path)
+        self.model.max_seq_length = EMBEDDING_MAX_SEQ_LENGTH
+        self.batch_size = batch_size
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True)
+
+class OnnxEmbeddingEngine(EmbeddingEngine):
+    """
+    int8-quantized ONNX Runtime backend for all-MiniLM-L6-v2.
+    Mean pooling + L2 normalisation, matching the sentence-transformers pipeline.
+    Export the model once with scripts/export_onnx_embedding.py.
+    """
+    name = "onnx"
+
+    def __init__(
+        self,
+        onnx_path: str = EMBEDDING_ONNX_PATH,
+        model_path: str = EMBEDDING_MODEL_NAME,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        threads: int = EMBEDDING_THREADS,
+        max_seq_length: int = EMBEDDING_MAX_SEQ_LENGTH
+    ):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_seq_length)
+        self.tokenizer.enable_padding()
+        self.batch_size = batch_size
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        # Sort by length so each batch pads to a similar length, then restore order
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        result = np.empty((len(texts), 0), dtype=np.float32)
+
+        for start in range(0, len(order), self.batch_size):
+            idx = order[start:start + self.batch_size]
+            encoded = self.tokenizer.encode_batch([texts[i] for i in idx])
+            input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+            token_embeddings = self.session.run(None, feeds)[0]
+
+            # Mean pooling over real tokens, then L2 normalise
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+            if result.shape[1] == 0:
+                result = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            result[idx] = pooled
+
+        return result
+
+def get_embedding_engine(backend: str = EMBEDDING_BACKEND) -> EmbeddingEngine:
+    """
+    Build the configured embedding backend.
+    'auto' prefers ONNX when onnxruntime and the exported model are available,
+    and falls back to sentence-transformers otherwise.
+    """
+    if backend in ("auto", "onnx"):
+        if os.path.exists(EMBEDDING_ONNX_PATH):
+            try:
+                engine = OnnxEmbeddingEngine()
+                logger.info(f"Embedding backend: onnx ({EMBEDDING_ONNX_PATH})")
+                return engine
+            except Exception as e:
+                logger.warning(f"ONNX embedding backend unavailable, falling back to sentence-transformers: {e}")
+        elif backend == "onnx":
+            logger.warning(f"ONNX model not found at {EMBEDDING_ONNX_PATH}. Run scripts/export_onnx_embedding.py. Falling back to sentence-transformers.")
+
+    logger.info("Embedding backend: sentence-transformers")
+    return SentenceTransformerEmbeddingEngine()
@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, Optional
+import psutil
+from src.config import (
+    HARDWARE_PROFILE_PATH,
+    MAX_CONTEXT_WINDOW,
+    MEMORY_RESERVE_MB,
+    CALIBRATION_PREFILL_TOKENS,
+    CALIBRATION_DECODE_TOKENS,
+    BATCH_MAX_SEQUENCES,
+    N_GPU_LAYERS,
+    LLM_THREADS,
+    LLM_THREADS_BATCH,
+    LLM_N_BATCH,
+    LLM_N_CTX,
+    LLM_USE_MLOCK,
+    LLM_USE_MMAP
+)
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZES = (256, 512, 1024)
+
+# Hand-set BHARATEDGE_* values, applied on top of any profile
+_OVERRIDES = {
+    "n_threads": LLM_THREADS,
+    "n_threads_batch": LLM_THREADS_BATCH,
+    "n_batch": LLM_N_BATCH,
+    "n_ctx": LLM_N_CTX,
+    "use_mlock": LLM_USE_MLOCK,
+    "use_mmap": LLM_USE_MMAP
+}
+
+def machine_info() -> Dict:
+    memory = psutil.virtual_memory()
+    return {
+        "physical_cores": psutil.cpu_count(logical=False) or psutil.cpu_count() or 1,
+        "logical_cores": psutil.cpu_count() or 1,
+        "total_ram_mb": int(memory.total / 1024 / 1024),
+        "available_ram_mb": int(memory.available / 1024 / 1024)
+    }
+
+def kv_bytes_per_token(model_info: Dict) -> int:
+    """
+    f16 K and V for every layer. Falls back to Qwen2.5-3B's ~36KB/token.
+    """
+    try:
+        head_dim = model_info["embedding_length"] // model_info["head_count"]
+        return 2 * 2 * model_info["block_count"] * (model_info["head_count_kv"] or model_info["head_count"]) * head_dim
+    except (KeyError, TypeError, ZeroDivisionError):
+        return 36 * 1024
+
+def default_profile(model_info: Optional[Dict], machine: Dict) -> Dict:
+    """
+    Heuristic profile from core count and free RAM, used until (or instead of)
+    calibration: physical cores only, the largest power-of-two context whose
+    KV cache fits next to the weights, and mlock only with RAM to spare.
+    """
+    model_info = model_info or {}
+    physical = machine["physical_cores"]
+    threads = max(1, physical if physical <= 4 else physical - 1)
+    if model_info.get("n_params") and model_info["n_params"] < 1_000_000_000:
+        threads = min(threads, 4)  # Thread sync outweighs extra cores on tiny models
+
+    model_mb = (model_info.get("size_bytes") or 0) / 1024 / 1024
+    kv_mb_per_token = kv_bytes_per_token(model_info) * max(1, BATCH_MAX_SEQUENCES) / 1024 / 1024
+    headroom_mb = machine["available_ram_mb"] - model_mb - MEMORY_RESERVE_MB
+
+    n_ctx = min(MAX_CONTEXT_WINDOW, model_info.get("context_length") or MAX_CONTEXT_WINDOW)
+    # Never below 2048: the RAG prompt (context + 512-token reply) needs it
+    while n_ctx > 2048 and n_ctx * kv_mb_per_token > headroom_mb:
+        n_ctx //= 2
+
+    # Larger batches need a bigger compute buffer; only worth it with spare RAM
+    n_batch = 1024 if headroom_mb - n_ctx * kv_mb_per_token > 1024 else 512
+    return {
+        "n_threads": threads,
+        "n_threads_batch": threads,
+        "n_batch": n_batch,
+        "n_ctx": n_ctx,
+        "use_mmap": True,
+        # Pinning the weights stops the OS paging them out, but on a tight box it forces everything else into swap
+        "use_mlock": headroom_mb - n_ctx * kv_mb_per_token > MEMORY_RESERVE_MB,
+        "calibrated": False
+    }
+
+class HardwareProfiles:
+    """
+    Saved runtime profiles, one per (model file, machine). A profile stays
+    valid until the model file or the core count / installed RAM changes.
+    """
+
+    def __init__(self, path: str = HARDWARE_PROFILE_PATH):
+        self.path = path
+        self.profiles = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.profiles = json.load(f)
+            except Exception as e:
+                logger.warning(f"Corrupt hardware profile file, ignoring: {e}")
+
+    @staticmethod
+    def key(model_info: Dict, machine: Dict) -> str:
+        size, mtime = model_info.get("signature") or (0, 0)
+        return f"{os.path.basename(model_info.get('path', ''))}|{size}|{mtime}|{machine['physical_cores']}c|{machine['total_ram_mb'] // 1024}g|{N_GPU_LAYERS}"
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self.lock:
+            profile = self.profiles.get(key)
+            return dict(profile) if profile else None
+
+    def put(self, key: str, profile: Dict):
+        with self.lock:
+            self.profiles[key] = profile
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.profiles, f, indent=1)
+            os.replace(tmp_path, self.path)
+
+def _set_threads(llm, n_threads: int, n_threads_batch: int):
+    import llama_cpp
+    llama_cpp.llama_set_n_threads(llm.ctx, n_threads, n_threads_batch)
+
+def calibrate(model_path: str, model_info: Dict, machine: Dict) -> Dict:
+    """
+    Short prefill and decode probes across thread counts and batch sizes.
+    Prefill (compute bound) and decode (memory-bandwidth bound) often peak at
+    different thread counts, so they are tuned separately. Takes a few
+    seconds per setting on a 3B model.
+    """
+    from llama_cpp import Llama
+    profile = default_profile(model_info, machine)
+    physical, logical = machine["physical_cores"], machine["logical_cores"]
+    thread_options = sorted({max(1, physical // 2), max(1, physical - 1), physical, logical})
+    batch_options = [b for b in BATCH_SIZES if b <= CALIBRATION_PREFILL_TOKENS] or [BATCH_SIZES[0]]
+    largest_batch = max(batch_options)
+
+    started = time.time()
+    logger.info(f"Calibrating {os.path.basename(model_path)}: threads {thread_options}, batches {batch_options}...")
+    llm = Llama(
+        model_path=model_path,
+        n_ctx=CALIBRATION_PREFILL_TOKENS + CALIBRATION_DECODE_TOKENS + 64,
+        n_batch=largest_batch,
+        n_threads=physical,
+        n_gpu_layers=N_GPU_LAYERS,
+        use_mmap=profile["use_mmap"],
+        verbose=False
+    )
+    try:
+        text = "The quick brown fox jumps over the lazy dog while the river flows past the old mill. " * 64
+        tokens = llm.tokenize(text.encode("utf-8"))[:CALIBRATION_PREFILL_TOKENS]
+        decode_tokens = tokens[:CALIBRATION_DECODE_TOKENS]
+
+        def prefill(threads: int, n_batch: int) -> float:
+            _set_threads(llm, threads, threads)
+            llm.n_batch = n_batch
+            llm.reset()
+            start = time.perf_counter()
+            llm.eval(tokens)
+            return len(tokens) / (time.perf_counter() - start)
+
+        def decode(threads: int) -> float:
+            _set_threads(llm, threads, profile["n_threads_batch"])
+            llm.reset()
+            llm.eval(tokens[:16])
+            start = time.perf_counter()
+            for token in decode_tokens:
+                llm.eval([token])
+            return len(decode_tokens) / (time.perf_counter() - start)
+
+        prefill(physical, largest_batch)  # Warm-up: page in the weights
+        # Threads at the largest batch first, then batch sizes at the best thread count
+        prefill_results = {(t, largest_batch): prefill(t, largest_batch) for t in thread_options}
+        best_threads = max(prefill_results.items(), key=lambda kv: kv[1])[0][0]
+        prefill_results.update({(best_threads, b): prefill(best_threads, b) for b in batch_options if b != largest_batch})
+        (profile["n_threads_batch"], profile["n_batch"]), best_prefill = max(prefill_results.items(), key=lambda kv: kv[1])
+        decode_results = {t: decode(t) for t in thread_options}
+        profile["n_threads"], best_decode = max(decode_results.items(), key=lambda kv: kv[1])
+    finally:
+        if hasattr(llm, "close"):
+            llm.close()
+        del llm
+
+    profile.update({
+        "calibrated": True,
+        "calibrated_at": time.time(),
+        "prefill_tps": round(best_prefill, 1),
+        "decode_tps": round(best_decode, 2),
+        "probes": {
+            "prefill": {f"{t}t/{b}": round(v, 1) for (t, b), v in prefill_results.items()},
+            "decode": {f"{t}t": round(v, 2) for t, v in decode_results.items()}
+        }
+    })
+    logger.info(
+        f"Calibration done in {time.time() - started:.1f}s: decode {profile['n_threads']} threads "
+        f"({best_decode:.1f} t/s), prefill {profile['n_threads_batch']} threads x n_batch {profile['n_batch']} ({best_prefill:.0f} t/s)"
+    )
+    return profile
+
+def runtime_profile(model_path: str, model_info: Dict, calibrate_now: bool = False) -> Dict:
+    """
+    Runtime settings for loading `model_path`: the saved profile for this
+    model and machine (calibrating first when asked and none exists), else
+    the heuristic default. BHARATEDGE_* overrides are applied last.
+    """
+    machine = machine_info()
+    profiles = HardwareProfiles()
+    key = HardwareProfiles.key(model_info, machine)
+    profile = profiles.get(key)
+
+    if profile is None and calibrate_now:
+        try:
+            profile = calibrate(model_path, model_info, machine)
+            profiles.put(key, profile)
+        except Exception as e:
+            logger.warning(f"Calibration failed, using heuristic profile: {e}")
+            profile = None
+    if profile is None:
+        profile = default_profile(model_info, machine)
+    else:
+        # Free RAM varies between runs; re-check the memory-dependent settings
+        fallback = default_profile(model_info, machine)
+        profile["n_ctx"] = min(profile["n_ctx"], fallback["n_ctx"])
+        profile["use_mlock"] = profile["use_mlock"] and fallback["use_mlock"]
+
+    overridden = {k: v for k, v in _OVERRIDES.items() if v is not None}
+    profile.update(overridden)
+    profile["overrides"] = sorted(overridden)
+    profile["machine"] = machine
+    return profile
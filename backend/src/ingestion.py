@@ -1,12 +1,196 @@
 import os
+import re
+import zipfile
+import xml.etree.ElementTree as ET
 import fitz  # PyMuPDF
-from typing import List, Tuple, Dict
-from src.config import DATA_DIR, CHUNK_OVERLAP_CHARS, CHUNK_SIZE_CHARS
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_left, bisect_right
+from typing import List, Tuple, Dict, Iterable, Iterator, Optional
+from src.config import (
+    DATA_DIR, CHUNK_OVERLAP_CHARS, CHUNK_SIZE_CHARS, PDF_PARSE_WORKERS, PDF_PARALLEL_MIN_PAGES,
+    OCR_ENABLED, OCR_MIN_TEXT_CHARS, SECTION_MAX_CHARS, TEXT_READ_CHARS, CHUNKER, CHUNK_SPAN_PAGES
+)
 import logging
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from src.tokenizer import get_token_counter
+from src.ocr import get_ocr_pool
 
 logger = logging.getLogger(__name__)
 
+def _parse_page_range(file_path: str, start: int, end: int) -> List[Tuple[str, int]]:
+    """
+    Worker: extract pages [start, end) from its own fitz handle.
+    Module-level so it can be pickled into a process pool.
+    Pages without a text layer are returned with empty text (OCR candidates).
+    """
+    pages_content = []
+    with fitz.open(file_path) as doc:
+        for page_num in range(start, end):
+            text = doc[page_num].get_text()
+            text = " ".join(text.split())
+            pages_content.append((text, page_num + 1))  # 1-indexed pages
+    return pages_content
+
+WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+# Plain-text headings: Markdown "#", short numbered titles ("2.3 Scope"), or a line underlined with === / ---
+TEXT_HEADING_PATTERN = re.compile(r"^(#{1,6}\s+\S.*|\d{1,3}(\.\d{1,3})*\.?\s+[A-Z\u0900-\u0D7F][^.!?:;]{0,60})$")
+TEXT_UNDERLINE_PATTERN = re.compile(r"^(=+|-+)$")
+
+def _iter_sections(blocks: Iterable[Tuple[str, bool]], max_chars: int = SECTION_MAX_CHARS) -> Iterator[Tuple[str, int]]:
+    """
+    Group (paragraph, is_heading) blocks into logical sections numbered from 1.
+    A heading starts a new section; long runs without headings are cut at
+    paragraph boundaries every `max_chars`. Paragraphs stay separated by blank
+    lines so the splitter prefers those boundaries.
+    Yields: (section_text, section_number)
+    """
+    section_num = 0
+    parts = []
+    size = 0
+    has_body = False
+    for text, is_heading in blocks:
+        if (is_heading and has_body) or (size + len(text) > max_chars and parts):
+            section_num += 1
+            yield "\n\n".join(parts), section_num
+            parts, size, has_body = [], 0, False
+        parts.append(text)
+        size += len(text) + 2
+        has_body = has_body or not is_heading
+    if parts:
+        section_num += 1
+        yield "\n\n".join(parts), section_num
+
+class TextChunker:
+    """
+    Single-pass replacement for RecursiveCharacterTextSplitter.
+
+    One regex scan records every candidate cut, classed as paragraph, line,
+    sentence end, clause or word boundary. Each chunk then ends at the
+    strongest boundary in the back half of its window (bisect per class), so
+    text is never re-scanned per separator level. Sentence ends need trailing
+    whitespace ("12.5" is not one) and include the Devanagari danda. Overlap
+    starts on a sentence start where possible, else on a word start.
+    """
+
+    # Groups, strongest first: paragraph, line, sentence end, clause, word
+    BOUNDARY_PATTERN = re.compile(r"(\n\s*\n)|(\n)|([.!?\u0964])(?=\s)|(,)(?=\s)|(\s)")
+    CUT_AFTER = (False, False, True, True, False)  # punctuation stays with the chunk it ends
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE_CHARS, chunk_overlap: int = CHUNK_OVERLAP_CHARS):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.min_fill = chunk_size // 2
+
+    def _scan(self, text: str) -> List[List[int]]:
+        cuts = [[], [], [], [], []]
+        for m in self.BOUNDARY_PATTERN.finditer(text):
+            level = m.lastindex - 1
+            cuts[level].append(m.end() if self.CUT_AFTER[level] else m.start())
+        return cuts
+
+    @staticmethod
+    def _last_before(positions: List[int], limit: int) -> int:
+        i = bisect_right(positions, limit) - 1
+        return positions[i] if i >= 0 else -1
+
+    def _find_end(self, cuts: List[List[int]], start: int) -> int:
+        limit = start + self.chunk_size
+        # Strongest boundary that still fills at least half the chunk
+        for positions in cuts:
+            cut = self._last_before(positions, limit)
+            if cut > start + self.min_fill:
+                return cut
+        # Otherwise the furthest boundary of any kind, else a hard cut
+        cut = max(self._last_before(positions, limit) for positions in cuts)
+        return cut if cut > start else limit
+
+    def _next_start(self, text: str, cuts: List[List[int]], start: int, end: int) -> int:
+        target = end - self.chunk_overlap
+        if target > start:
+            # Earliest sentence (then word) boundary inside the overlap window
+            for levels in ((0, 1, 2), (3, 4)):
+                candidates = []
+                for level in levels:
+                    positions = cuts[level]
+                    i = bisect_left(positions, target)
+                    if i < len(positions) and positions[i] < end:
+                        candidates.append(positions[i])
+                if candidates:
+                    return self._skip_space(text, min(candidates))
+        return self._skip_space(text, end)
+
+    @staticmethod
+    def _skip_space(text: str, pos: int) -> int:
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+        return pos
+
+    def spans(self, text: str, final: bool = True) -> Tuple[List[Tuple[int, int]], int]:
+        """
+        (start, end) offsets of the chunks of `text`. With final=False the
+        last partial window is left for more text to arrive; the returned
+        offset is where chunking should resume.
+        """
+        cuts = self._scan(text)
+        spans = []
+        start = self._skip_space(text, 0)
+        while start < len(text):
+            if len(text) - start <= self.chunk_size:
+                if final:
+                    spans.append((start, len(text)))
+                    start = len(text)
+                break
+            end = self._find_end(cuts, start)
+            spans.append((start, end))
+            start = max(self._next_start(text, cuts, start, end), start + 1)
+        return spans, start
+
+    def split_text(self, text: str) -> List[str]:
+        spans, _ = self.spans(text)
+        return [chunk for chunk in (text[s:e].strip() for s, e in spans) if chunk]
+
+    def split_pages(self, pages: Iterable[Tuple[str, int]], span_pages: bool = False) -> Iterator[Tuple[str, int, int]]:
+        """
+        Chunk a stream of (text, page_number) pages.
+        With span_pages, chunks may cross page breaks; the buffer only holds
+        the unfinished tail, so memory stays bounded.
+        Yields: (chunk, first_page, last_page)
+        """
+        if not span_pages:
+            for text, page_num in pages:
+                for chunk in self.split_text(text):
+                    yield chunk, page_num, page_num
+            return
+
+        buffer = ""
+        marks = []  # (offset in buffer, page number) where each page starts
+
+        def emit(spans):
+            offsets = [offset for offset, _ in marks]
+            for s, e in spans:
+                chunk = buffer[s:e].strip()
+                if chunk:
+                    yield chunk, marks[bisect_right(offsets, s) - 1][1], marks[bisect_right(offsets, e - 1) - 1][1]
+
+        for text, page_num in pages:
+            if buffer:
+                buffer += "\n\n"
+            marks.append((len(buffer), page_num))
+            buffer += text
+            if len(buffer) < 4 * self.chunk_size:
+                continue
+            spans, resume = self.spans(buffer, final=False)
+            yield from emit(spans)
+            # Keep only the unfinished tail and the page marks that cover it
+            first = bisect_right([offset for offset, _ in marks], resume) - 1
+            marks = [(max(0, offset - resume), page) for offset, page in marks[first:]]
+            buffer = buffer[resume:]
+
+        spans, _ = self.spans(buffer)
+        yield from emit(spans)
+
 class DocumentIngestor:
     def __init__(self):
         # Initialize the splitter with our config
@@ -17,6 +201,7 @@ class DocumentIngestor:
             separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""],
             length_function=len,
         )
+        self.chunker = TextChunker(CHUNK_SIZE_CHARS, CHUNK_OVERLAP_CHARS)
 
     def save_upload(self, file_obj, filename: str) -> str:
         """
@@ -27,58 +212,192 @@ class DocumentIngestor:
             buffer.write(file_obj.read())
         return file_path
 
+    def iter_pdf_pages(self, file_path: str, stats: Optional[Dict] = None) -> Iterator[Tuple[str, int]]:
+        """
+        Extract text from PDF pages with page numbers, in page order. Pages
+        without a text layer are OCR'd (see src.ocr) while the text layer keeps
+        streaming, and slot back into place as their batches finish.
+        `stats`, if given, receives OCR pages, cache hits, pages/sec and peak RSS.
+        Yields: (text_content, page_number)
+        """
+        needs_ocr = lambda text: OCR_ENABLED and len(text) < OCR_MIN_TEXT_CHARS
+        yield from get_ocr_pool().ocr_pages(file_path, self.iter_pdf_text_layer(file_path), needs_ocr, stats=stats)
+
+    def iter_pdf_text_layer(self, file_path: str) -> Iterator[Tuple[str, int]]:
+        """
+        Extract the text layer of every page in order, as soon as pages are
+        ready. Large PDFs are split into page ranges parsed in parallel by a
+        process pool (each worker opens its own fitz document).
+        Yields: (text_content, page_number); text is empty for scanned pages.
+        """
+        with fitz.open(file_path) as doc:
+            page_count = doc.page_count
+
+        if PDF_PARSE_WORKERS <= 1 or page_count < PDF_PARALLEL_MIN_PAGES:
+            yield from _parse_page_range(file_path, 0, page_count)
+            return
+
+        # Several small ranges per worker keep the pool busy and let the first
+        # pages reach the chunker early.
+        range_size = max(8, -(-page_count // (PDF_PARSE_WORKERS * 4)))
+        ranges = [(start, min(start + range_size, page_count)) for start in range(0, page_count, range_size)]
+        logger.info(f"Parsing {page_count} pages with {PDF_PARSE_WORKERS} workers ({len(ranges)} ranges)")
+
+        workers = min(PDF_PARSE_WORKERS, len(ranges))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Bounded window of in-flight ranges: a slow consumer (embedding)
+            # stops the parser from racing ahead and buffering the whole PDF.
+            pending = deque()
+            next_range = 0
+            while pending or next_range < len(ranges):
+                while next_range < len(ranges) and len(pending) < workers * 2:
+                    start, end = ranges[next_range]
+                    pending.append(pool.submit(_parse_page_range, file_path, start, end))
+                    next_range += 1
+                # Waiting on futures in submission order keeps pages ordered
+                yield from pending.popleft().result()
+
     def parse_pdf(self, file_path: str) -> List[Tuple[str, int]]:
         """
         Extract text from PDF pages with page numbers.
         Returns: List of (text_content, page_number)
         """
-        doc = fitz.open(file_path)
-        pages_content = []
-        
-        for page_num, page in enumerate(doc):
-            text = page.get_text()
-            text = " ".join(text.split()).strip()
-            
-            if text:
-                pages_content.append((text, page_num + 1))  # 1-indexed pages
-                
-        return pages_content
+        return list(self.iter_pdf_pages(file_path))
 
-    def process_document(self, file_path: str) -> Tuple[List[str], List[Dict]]:
+    def iter_pages(self, file_path: str, stats: Optional[Dict] = None) -> Iterator[Tuple[str, int]]:
         """
-        End-to-end processing: Parse -> Clean -> Chunk.
-        Returns: (chunks, metadatas)
+        Parse stage as a stream: yields (text, page_number) pairs so chunking
+        can start before the whole file has been parsed.
         """
-        logger.info(f"Processing document: {file_path}")
         ext = file_path.split('.')[-1].lower()
-        raw_pages = []
         
         if ext == 'pdf':
-            raw_pages = self.parse_pdf(file_path)
+            yield from self.iter_pdf_pages(file_path, stats=stats)
         elif ext == 'txt':
-            with open(file_path, 'r', encoding='utf-8') as f:
-                raw_pages = [(f.read(), 1)]
+            yield from _iter_sections(self.iter_text_paragraphs(file_path))
+        elif ext == 'docx':
+            yield from _iter_sections(self.iter_docx_paragraphs(file_path))
         else:
             logger.warning(f"Unsupported file type: {ext}")
-            return [], []
-        
+
+    def iter_text_paragraphs(self, file_path: str) -> Iterator[Tuple[str, bool]]:
+        """
+        Stream a text file as (paragraph, is_heading) blocks; blank lines end
+        a paragraph. Memory is bounded by one paragraph, not the file.
+        """
+        lines = []
+        size = 0
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            for raw in iter(lambda: f.readline(TEXT_READ_CHARS), ""):
+                line = raw.strip()
+                if TEXT_UNDERLINE_PATTERN.match(line) and len(lines) == 1:
+                    # Setext heading: the single line above is the title
+                    yield lines.pop(), True
+                    size = 0
+                    continue
+                if not line or TEXT_HEADING_PATTERN.match(line) or size >= SECTION_MAX_CHARS:
+                    if lines:
+                        yield " ".join(lines), False
+                        lines, size = [], 0
+                    if line and TEXT_HEADING_PATTERN.match(line):
+                        yield line.lstrip("#").strip(), True
+                        continue
+                if line:
+                    lines.append(line)
+                    size += len(line) + 1
+        if lines:
+            yield " ".join(lines), False
+
+    def iter_docx_paragraphs(self, file_path: str) -> Iterator[Tuple[str, bool]]:
+        """
+        Stream a DOCX body as (paragraph, is_heading) blocks with iterparse,
+        clearing each paragraph once read, so large documents never sit in
+        memory as a full XML tree (python-docx would build one). Headings are
+        paragraphs whose style is "heading N"/"Title" or has an outline level.
+        """
+        with zipfile.ZipFile(file_path) as archive:
+            heading_styles = set()
+            if "word/styles.xml" in archive.namelist():
+                with archive.open("word/styles.xml") as f:
+                    for style in ET.parse(f).getroot().iter(f"{WORD_NS}style"):
+                        name = style.find(f"{WORD_NS}name")
+                        name = name.get(f"{WORD_NS}val", "").lower() if name is not None else ""
+                        if name.startswith("heading") or name == "title" or style.find(f"{WORD_NS}pPr/{WORD_NS}outlineLvl") is not None:
+                            heading_styles.add(style.get(f"{WORD_NS}styleId"))
+
+            with archive.open("word/document.xml") as f:
+                for event, element in ET.iterparse(f, events=("end",)):
+                    if element.tag != f"{WORD_NS}p":
+                        continue
+                    text = "".join(t.text or "" for t in element.iter(f"{WORD_NS}t"))
+                    text = " ".join(text.split())
+                    style = element.find(f"{WORD_NS}pPr/{WORD_NS}pStyle")
+                    is_heading = (
+                        (style is not None and style.get(f"{WORD_NS}val") in heading_styles)
+                        or element.find(f"{WORD_NS}pPr/{WORD_NS}outlineLvl") is not None
+                    )
+                    element.clear()
+                    if text:
+                        yield text, is_heading
+
+    def load_pages(self, file_path: str) -> List[Tuple[str, int]]:
+        """
+        Parse stage: read a supported file into (text, page_number) pairs.
+        """
+        return list(self.iter_pages(file_path))
+
+    def iter_chunks(self, raw_pages: Iterable[Tuple[str, int]], filename: str) -> Iterator[Tuple[str, Dict]]:
+        """
+        Chunk stage as a stream: split each page as it arrives and yield
+        (chunk, metadata) pairs without holding the whole document.
+        When the GGUF tokenizer is available, each chunk carries its exact LLM
+        token count (tagged with the tokenizer) so retrieval can pack context
+        without re-tokenizing. Estimates are not stored; those chunks are
+        counted at query time instead.
+        """
+        token_counter = get_token_counter()
+        if CHUNKER == "recursive":
+            chunks = ((chunk, page_num, page_num) for page_text, page_num in raw_pages for chunk in self.text_splitter.split_text(page_text))
+        else:
+            chunks = self.chunker.split_pages(raw_pages, span_pages=CHUNK_SPAN_PAGES)
+
+        for chunk, page_num, page_end in chunks:
+            # Metadata for citation
+            metadata = {
+                "source": filename,
+                "page": page_num,
+                "chunk_len": len(chunk)
+            }
+            if token_counter.exact:
+                metadata["n_tokens"] = token_counter.count(chunk)
+                metadata["tokenizer"] = token_counter.name
+            if page_end != page_num:
+                metadata["page_end"] = page_end
+            yield chunk, metadata
+
+    def chunk_pages(self, raw_pages: Iterable[Tuple[str, int]], filename: str) -> Tuple[List[str], List[Dict]]:
+        """
+        Chunk stage: split parsed pages and attach citation metadata.
+        """
         all_chunks = []
         all_metadatas = []
         
+        for chunk, metadata in self.iter_chunks(raw_pages, filename):
+            all_chunks.append(chunk)
+            all_metadatas.append(metadata)
+        
+        return all_chunks, all_metadatas
+
+    def process_document(self, file_path: str) -> Tuple[List[str], List[Dict]]:
+        """
+        End-to-end processing: Parse -> Clean -> Chunk.
+        Returns: (chunks, metadatas)
+        """
+        logger.info(f"Processing document: {file_path}")
         filename = os.path.basename(file_path)
         
-        for page_text, page_num in raw_pages:
-            # Split the text of this page
-            page_chunks = self.text_splitter.split_text(page_text)
-            
-            for chunk in page_chunks:
-                all_chunks.append(chunk)
-                # Metadata for citation
-                all_metadatas.append({
-                    "source": filename,
-                    "page": page_num,
-                    "chunk_len": len(chunk)
-                })
+        # Pages stream straight into the splitter
+        all_chunks, all_metadatas = self.chunk_pages(self.iter_pages(file_path), filename)
         
         logger.info(f"Generated {len(all_chunks)} chunks from {filename}")
         return all_chunks, all_metadatas
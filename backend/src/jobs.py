@@ -0,0 +1,157 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+from src.config import INGEST_WORKERS, INGEST_JOB_HISTORY
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionJobManager:
+    """
+    Runs document ingestion (parse -> chunk -> embed -> index) on a worker pool
+    so uploads never block the event loop. Job state is a plain dict per job,
+    readable at any time through `get_job` / `list_jobs`.
+    Stages: queued -> parse (chunking runs interleaved) -> embed -> index -> done,
+    with parse/embed/index repeating once per micro-batch.
+    """
+
+    def __init__(self, get_ingestor: Callable, get_vector_db: Callable, max_workers: int = INGEST_WORKERS):
+        # Engines are resolved lazily inside the worker, matching main.py's lazy loading
+        self.get_ingestor = get_ingestor
+        self.get_vector_db = get_vector_db
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, file_path: str) -> dict:
+        """
+        Queue a saved file for ingestion and return its job record immediately.
+        """
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            "job_id": job_id,
+            "filename": os.path.basename(file_path),
+            "status": "queued",
+            "stage": "queued",
+            "pages": 0,
+            "chunks": 0,
+            "added": 0,
+            "deleted": 0,
+            "unchanged": 0,
+            "batches": 0,
+            "stage_seconds": {},
+            "pages_per_sec": 0.0,
+            "chunks_per_sec": 0.0,
+            "ocr_pages": 0,
+            "ocr_cache_hits": 0,
+            "ocr_pages_per_sec": 0.0,
+            "ocr_peak_rss_mb": 0.0,
+            "error": None,
+            "created_at": time.time(),
+            "finished_at": None,
+        }
+        with self.lock:
+            self.jobs[job_id] = job
+            self._trim_history()
+        self.executor.submit(self._run, job_id, file_path)
+        return dict(job)
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list_jobs(self) -> List[dict]:
+        with self.lock:
+            return [dict(j) for j in reversed(self.jobs.values())]
+
+    def _update(self, job_id: str, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+
+    def _trim_history(self):
+        # Drop the oldest finished jobs; running/queued jobs are always kept
+        finished = [jid for jid, j in self.jobs.items() if j["status"] in ("complete", "error")]
+        for jid in finished[:max(0, len(self.jobs) - INGEST_JOB_HISTORY)]:
+            del self.jobs[jid]
+
+    def _run(self, job_id: str, file_path: str):
+        timings = {}
+        stage_start = [time.time()]
+        current = ["parse"]
+
+        def enter_stage(stage: str):
+            now = time.time()
+            if current[0] != stage:
+                timings[current[0]] = round(timings.get(current[0], 0.0) + now - stage_start[0], 3)
+                stage_start[0] = now
+                current[0] = stage
+            self._update(job_id, stage=stage, stage_seconds=dict(timings))
+
+        try:
+            ingestor = self.get_ingestor()
+            vector_db = self.get_vector_db()
+            if not ingestor or not vector_db:
+                raise RuntimeError("Ingestion engine not ready. Check model files.")
+
+            filename = os.path.basename(file_path)
+            job_start = time.time()
+            stage_start[0] = job_start
+            self._update(job_id, status="running", stage="parse")
+            logger.info(f"[job {job_id}] Processing document: {file_path}")
+
+            # Parse -> Chunk -> Embed -> Index as one pull-based stream: pages are
+            # parsed only as fast as micro-batches get embedded and committed.
+            counts = {"pages": 0, "chunks": 0}
+            ocr_stats = {}
+
+            def counted_pages():
+                for page in ingestor.iter_pages(file_path, stats=ocr_stats):
+                    counts["pages"] += 1
+                    yield page
+
+            def counted_chunks():
+                for item in ingestor.iter_chunks(counted_pages(), filename):
+                    counts["chunks"] += 1
+                    yield item
+
+            def report(batch_stats=None):
+                elapsed = time.time() - job_start
+                self._update(
+                    job_id,
+                    pages=counts["pages"],
+                    chunks=counts["chunks"],
+                    pages_per_sec=round(counts["pages"] / elapsed, 2) if elapsed > 0 else 0.0,
+                    chunks_per_sec=round(counts["chunks"] / elapsed, 2) if elapsed > 0 else 0.0,
+                    **ocr_stats,
+                    **(batch_stats or {})
+                )
+
+            stats = vector_db.add_document_stream(
+                filename,
+                counted_chunks(),
+                on_stage=enter_stage,
+                on_batch=report
+            )
+
+            vector_db.registry.update(
+                filename,
+                pages=counts["pages"],
+                file_hash=vector_db.registry.file_hash(file_path),
+                size_bytes=os.path.getsize(file_path)
+            )
+
+            enter_stage("done")
+            report(stats)
+            self._update(job_id, status="complete", finished_at=time.time())
+            logger.info(f"[job {job_id}] Indexed {filename}: {counts['pages']} pages, {counts['chunks']} chunks in {time.time() - job_start:.2f}s")
+            if ocr_stats.get("ocr_pages"):
+                logger.info(f"[job {job_id}] OCR: {ocr_stats['ocr_pages']} pages ({ocr_stats['ocr_cache_hits']} cached) at {ocr_stats['ocr_pages_per_sec']} pages/sec, peak worker RSS {ocr_stats['ocr_peak_rss_mb']}MB")
+        except Exception as e:
+            logger.error(f"[job {job_id}] Ingestion failed: {e}")
+            self._update(job_id, status="error", error=str(e), finished_at=time.time())
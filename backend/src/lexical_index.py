@@ -0,0 +1,387 @@
+import os
+import re
+import json
+import math
+import struct
+import heapq
+import shutil
+import hashlib
+import logging
+import threading
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from src.config import LEXICAL_INDEX_DIR, BM25_K1, BM25_B, LEXICAL_SPILL_POSTINGS, LEXICAL_MERGE_FAN_IN
+
+logger = logging.getLogger(__name__)
+
+# Latin/digit words plus the Indic blocks (Devanagari .. Malayalam). Indic vowel
+# signs are combining marks, which \w alone would split words on.
+TOKEN_PATTERN = re.compile(r"[\w\u0900-\u0D7F]+")
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-cased word tokens. Identifiers such as "INV-2024/0113" or "12.3"
+    also yield their parts, so partial matches still score.
+    """
+    tokens = TOKEN_PATTERN.findall(text.lower())
+    for compound in re.findall(r"\w+(?:[-/.]\w+)+", text.lower()):
+        tokens.append(compound)
+    return tokens
+
+class LexicalSegment:
+    """
+    The BM25 postings of one document, memory-mapped from a single file:
+        magic | header length | JSON header (terms, chunk IDs) | offsets | doc lengths | doc indices | term freqs
+    Only the term dictionary is held in memory; postings are paged in on demand.
+    """
+
+    MAGIC = b"BEBM25v1"
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(8) != self.MAGIC:
+                raise ValueError(f"Not a BM25 segment: {path}")
+            (header_len,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_len).decode("utf-8"))
+        self.source = header["source"]
+        self.chunk_ids = header["chunk_ids"]
+        self.terms = {term: i for i, term in enumerate(header["terms"])}
+        self.total_len = header["total_len"]
+
+        n_terms, n_docs, n_postings = len(header["terms"]), len(self.chunk_ids), header["n_postings"]
+        offset = self._align(16 + header_len)
+        self.offsets = self._map(offset, np.int64, n_terms + 1)
+        offset = self._align(offset + 8 * (n_terms + 1))
+        self.doc_lens = self._map(offset, np.int32, n_docs)
+        offset = self._align(offset + 4 * n_docs)
+        self.postings = self._map(offset, np.int32, n_postings)
+        offset = self._align(offset + 4 * n_postings)
+        self.freqs = self._map(offset, np.uint16, n_postings)
+
+    def _map(self, offset: int, dtype, count: int) -> np.ndarray:
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+    @staticmethod
+    def _align(offset: int) -> int:
+        return -(-offset // 8) * 8
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.chunk_ids)
+
+    def doc_freq(self, term: str) -> int:
+        i = self.terms.get(term)
+        return 0 if i is None else int(self.offsets[i + 1] - self.offsets[i])
+
+    def postings_for(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        i = self.terms.get(term)
+        if i is None:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.uint16)
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.postings[start:end], self.freqs[start:end]
+
+    def close(self):
+        # Drop the memmaps so the file can be replaced or deleted (required on Windows)
+        self.offsets = self.doc_lens = self.postings = self.freqs = None
+
+
+class SegmentWriter:
+    """
+    Builds one document's segment incrementally. Chunks are added one at a
+    time; postings are buffered up to LEXICAL_SPILL_POSTINGS and spilled to
+    disk as term-sorted runs, chunk IDs and lengths are appended to spill
+    files, and `finish` merges everything into the segment file. Memory stays
+    bounded by the buffer, not by the document.
+    Run record: term length | term | n | doc indices (int32) | term freqs (uint16)
+    """
+
+    def __init__(self, path: str, source: str, spill_postings: int = LEXICAL_SPILL_POSTINGS):
+        self.path = path
+        self.source = source
+        self.spill_postings = spill_postings
+        self.tmp_path = path + ".tmp"
+        self.work_dir = path + ".build"
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.ids_file = open(os.path.join(self.work_dir, "ids.jsonl"), "w", encoding="utf-8")
+        self.lens_file = open(os.path.join(self.work_dir, "lens.bin"), "wb")
+        self.runs: List[str] = []
+        self.n_merges = 0
+        self.buffer: Dict[str, List[Tuple[int, int]]] = {}
+        self.buffered = 0
+        self.n_docs = 0
+        self.total_len = 0
+
+    def add(self, chunk_id: str, text: str = None, counts: Counter = None):
+        if counts is None:
+            counts = Counter(tokenize(text))
+        doc = self.n_docs
+        for term, tf in counts.items():
+            self.buffer.setdefault(term, []).append((doc, min(tf, 65535)))
+        self.buffered += len(counts)
+        length = sum(counts.values())
+        self.lens_file.write(struct.pack("<i", length))
+        self.ids_file.write(json.dumps(chunk_id, ensure_ascii=False) + "\n")
+        self.total_len += length
+        self.n_docs += 1
+        if self.buffered >= self.spill_postings:
+            self._spill()
+
+    def chunk_ids(self) -> Iterator[str]:
+        """
+        The added chunk IDs in order, read back from the spill file.
+        """
+        self.ids_file.flush()
+        with open(self.ids_file.name, "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def _spill(self):
+        if not self.buffer:
+            return
+        path = os.path.join(self.work_dir, f"run{len(self.runs)}.bin")
+        with open(path, "wb") as f:
+            for term in sorted(self.buffer):
+                entries = self.buffer[term]
+                self._write_record(f, term, np.array([d for d, _ in entries], dtype=np.int32), np.array([tf for _, tf in entries], dtype=np.uint16))
+        self.runs.append(path)
+        self.buffer = {}
+        self.buffered = 0
+
+    @staticmethod
+    def _write_record(f, term: str, docs: np.ndarray, freqs: np.ndarray):
+        encoded = term.encode("utf-8")
+        f.write(struct.pack("<II", len(encoded), len(docs)))
+        f.write(encoded)
+        f.write(docs.tobytes())
+        f.write(freqs.tobytes())
+
+    @staticmethod
+    def _read_run(path: str) -> Iterator[Tuple[str, np.ndarray, np.ndarray]]:
+        with open(path, "rb") as f:
+            while True:
+                head = f.read(8)
+                if not head:
+                    return
+                term_len, n = struct.unpack("<II", head)
+                term = f.read(term_len).decode("utf-8")
+                docs = np.frombuffer(f.read(4 * n), dtype=np.int32)
+                freqs = np.frombuffer(f.read(2 * n), dtype=np.uint16)
+                yield term, docs, freqs
+
+    def _merge(self, runs: List[str]) -> Iterator[Tuple[str, np.ndarray, np.ndarray]]:
+        """
+        Merge term-sorted runs. Runs hold increasing doc ranges and heapq.merge
+        is stable, so each term's postings come out in doc order.
+        """
+        merged = heapq.merge(*(self._read_run(r) for r in runs), key=lambda record: record[0])
+        term, docs, freqs = None, [], []
+        for record_term, record_docs, record_freqs in merged:
+            if record_term != term and term is not None:
+                yield term, np.concatenate(docs), np.concatenate(freqs)
+                docs, freqs = [], []
+            term = record_term
+            docs.append(record_docs)
+            freqs.append(record_freqs)
+        if term is not None:
+            yield term, np.concatenate(docs), np.concatenate(freqs)
+
+    def _reduce_runs(self):
+        # Multi-pass merge so no more than LEXICAL_MERGE_FAN_IN runs are open at once
+        while len(self.runs) > LEXICAL_MERGE_FAN_IN:
+            group, self.runs = self.runs[:LEXICAL_MERGE_FAN_IN], self.runs[LEXICAL_MERGE_FAN_IN:]
+            path = os.path.join(self.work_dir, f"merged{self.n_merges}.bin")
+            self.n_merges += 1
+            with open(path, "wb") as f:
+                for term, docs, freqs in self._merge(group):
+                    self._write_record(f, term, docs, freqs)
+            for run in group:
+                os.remove(run)
+            self.runs.insert(0, path)  # Keeps runs in doc order
+
+    def finish(self) -> bool:
+        """
+        Write the finished segment to `tmp_path` (LexicalIndex.commit moves it
+        into place). False, with nothing written, for an empty document.
+        """
+        self._spill()
+        self.ids_file.close()
+        self.lens_file.close()
+        if self.n_docs == 0:
+            self.abort()
+            return False
+        self._reduce_runs()
+
+        # Postings go to side files while the term list is collected
+        side = {name: os.path.join(self.work_dir, f"{name}.bin") for name in ("offsets", "docs", "freqs")}
+        terms_path = os.path.join(self.work_dir, "terms.jsonl")
+        n_postings = 0
+        with open(side["offsets"], "wb") as offsets, open(side["docs"], "wb") as docs_f, \
+             open(side["freqs"], "wb") as freqs_f, open(terms_path, "w", encoding="utf-8") as terms_f:
+            offsets.write(struct.pack("<q", 0))
+            for term, docs, freqs in self._merge(self.runs):
+                terms_f.write(json.dumps(term, ensure_ascii=False) + "\n")
+                docs_f.write(docs.tobytes())
+                freqs_f.write(freqs.tobytes())
+                n_postings += len(docs)
+                offsets.write(struct.pack("<q", n_postings))
+
+        with open(self.tmp_path, "wb") as f:
+            f.write(LexicalSegment.MAGIC)
+            f.write(struct.pack("<Q", 0))  # header length, patched below
+            header_start = f.tell()
+            f.write(json.dumps({"source": self.source, "n_postings": n_postings, "total_len": self.total_len}, ensure_ascii=False)[:-1].encode("utf-8"))
+            for key, path in (("terms", terms_path), ("chunk_ids", self.ids_file.name)):
+                f.write(f', "{key}": ['.encode("utf-8"))
+                with open(path, "r", encoding="utf-8") as lines:
+                    for n, line in enumerate(lines):
+                        f.write(((", " if n else "") + line.rstrip("\n")).encode("utf-8"))
+                f.write(b"]")
+            f.write(b"}")
+            header_len = f.tell() - header_start
+            for part in (side["offsets"], self.lens_file.name, side["docs"], side["freqs"]):
+                f.write(b"\0" * (LexicalSegment._align(f.tell()) - f.tell()))
+                with open(part, "rb") as src:
+                    shutil.copyfileobj(src, f)
+            f.seek(len(LexicalSegment.MAGIC))
+            f.write(struct.pack("<Q", header_len))
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        return True
+
+    def abort(self):
+        for f in (self.ids_file, self.lens_file):
+            if not f.closed:
+                f.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+class LexicalIndex:
+    """
+    On-disk BM25 index kept next to Chroma, one segment file per document.
+    Segments are rebuilt by the ingestion stream and memory-mapped for search;
+    IDF and average length are computed over all indexed documents.
+    """
+
+    def __init__(self, index_dir: str = LEXICAL_INDEX_DIR, k1: float = BM25_K1, b: float = BM25_B):
+        self.index_dir = index_dir
+        self.k1 = k1
+        self.b = b
+        self.segments: Dict[str, LexicalSegment] = {}
+        self.lock = threading.RLock()
+        os.makedirs(index_dir, exist_ok=True)
+        self._load_segments()
+
+    def _segment_path(self, source: str) -> str:
+        name = hashlib.sha256(source.encode('utf-8')).hexdigest()[:24]
+        return os.path.join(self.index_dir, f"{name}.bm25")
+
+    def _load_segments(self):
+        for name in os.listdir(self.index_dir):
+            if name.endswith((".build", ".tmp")):
+                # Left over from an ingest that was interrupted
+                path = os.path.join(self.index_dir, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+                continue
+            if not name.endswith(".bm25"):
+                continue
+            try:
+                segment = LexicalSegment(os.path.join(self.index_dir, name))
+                self.segments[segment.source] = segment
+            except Exception as e:
+                logger.warning(f"Skipping unreadable BM25 segment {name}: {e}")
+        logger.info(f"Loaded BM25 index: {len(self.segments)} documents.")
+
+    def has_document(self, source: str) -> bool:
+        return source in self.segments
+
+    def writer(self, source: str) -> SegmentWriter:
+        """
+        Start building a replacement segment for `source`; install it with commit().
+        Builds into a temp file, so searches keep using the old segment meanwhile.
+        """
+        return SegmentWriter(self._segment_path(source), source)
+
+    def commit(self, writer: SegmentWriter):
+        """
+        Finish a writer and swap its segment in (an empty document removes it).
+        The merge runs outside the lock; only the file swap blocks searches.
+        """
+        built = writer.finish()
+        with self.lock:
+            old = self.segments.pop(writer.source, None)
+            if old:
+                old.close()
+            if built:
+                os.replace(writer.tmp_path, writer.path)
+                self.segments[writer.source] = LexicalSegment(writer.path)
+            elif os.path.exists(writer.path):
+                os.remove(writer.path)
+
+    def delete_document(self, source: str):
+        with self.lock:
+            segment = self.segments.pop(source, None)
+            if segment:
+                segment.close()
+            path = self._segment_path(source)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def search(self, query: str, k: int, sources: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+        """
+        Top-k (chunk_id, BM25 score) pairs, optionally restricted to some sources.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self.lock:
+            segments = list(self.segments.values())
+            n_docs = sum(s.n_docs for s in segments)
+            if n_docs == 0:
+                return []
+            avg_len = max(1.0, sum(s.total_len for s in segments) / n_docs)
+            idf = {}
+            for term in terms:
+                df = sum(s.doc_freq(term) for s in segments)
+                if df:
+                    idf[term] = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+            if sources:
+                wanted = set(sources)
+                segments = [s for s in segments if s.source in wanted]
+
+            results = []
+            for segment in segments:
+                scores = None
+                for term, weight in idf.items():
+                    docs, freqs = segment.postings_for(term)
+                    if not len(docs):
+                        continue
+                    if scores is None:
+                        scores = np.zeros(segment.n_docs, dtype=np.float32)
+                    tf = freqs.astype(np.float32)
+                    norm = self.k1 * (1 - self.b + self.b * segment.doc_lens[docs] / avg_len)
+                    scores[docs] += weight * tf * (self.k1 + 1) / (tf + norm)
+                if scores is None:
+                    continue
+                top = np.nonzero(scores)[0]
+                if len(top) > k:
+                    top = top[np.argpartition(scores[top], -k)[-k:]]
+                results.extend((segment.chunk_ids[i], float(scores[i])) for i in top)
+
+        results.sort(key=lambda r: r[1], reverse=True)
+        return results[:k]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "documents": len(self.segments),
+                "chunks": sum(s.n_docs for s in self.segments.values()),
+                "disk_kb": round(sum(os.path.getsize(s.path) for s in self.segments.values()) / 1024, 1)
+            }
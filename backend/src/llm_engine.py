@@ -1,22 +1,46 @@
 import os
+import ctypes
+import hashlib
 import logging
+import llama_cpp
 from llama_cpp import Llama
-from typing import Generator, List, Optional
+from typing import Callable, Generator, List, Optional
 from src.config import (
     LLM_MODEL_PATH, 
     LLM_CONTEXT_WINDOW, 
-    CPU_THREADS, 
     LLM_TEMPERATURE, 
     LLM_MAX_TOKENS,
     N_GPU_LAYERS,
-    MAX_CONTEXT_WINDOW
+    PROMPT_CACHE_ENABLED,
+    PROMPT_CACHE_DIR,
+    BATCH_MAX_SEQUENCES,
+    CALIBRATE_ON_LOAD,
+    SMALL_CONTEXT_WINDOW,
+    SPECULATIVE_MODE
 )
+from src.model_registry import get_model_registry
+from src.hardware import runtime_profile
 
 logger = logging.getLogger(__name__)
 
 class LLMEngine:
-    def __init__(self):
+    def __init__(self, speculative_mode: str = SPECULATIVE_MODE):
         self.llm = None
+        # Chosen per model and machine in load_model (see src.hardware)
+        self.model_info = None
+        self.profile = None
+        self.n_ctx = LLM_CONTEXT_WINDOW
+        # Static prompt prefix whose KV state is kept warm (see warm_prefix)
+        self.prefix_text = None
+        self.prefix_tokens = []
+        self.prefix_cache_path = None
+        # Continuous batching across concurrent requests (BATCH_MAX_SEQUENCES > 1)
+        self.batcher = None
+        # Small pre-allocated context for short requests (SMALL_CONTEXT_WINDOW > 0, no batching)
+        self.small_ctx = None
+        # Speculative decoding draft ("off" here gives a plain engine, e.g. a benchmark baseline)
+        self.speculative_mode = speculative_mode
+        self.draft = None
         self.load_model()
 
     def load_model(self):
@@ -27,60 +51,242 @@ class LLMEngine:
             logger.error(f"Model not found at {LLM_MODEL_PATH}. Prediction will fail.")
             return
 
-        logger.info(f"Loading LLM from {LLM_MODEL_PATH}...")
+        # Fail fast on truncated/corrupt files instead of deep inside llama.cpp
+        self.model_info = get_model_registry().gguf(LLM_MODEL_PATH)
+        if not self.model_info["valid"]:
+            logger.error(f"Model at {LLM_MODEL_PATH} is invalid ({self.model_info['error']}). Re-run setup to download it again.")
+            return
+        self.profile = runtime_profile(LLM_MODEL_PATH, self.model_info, calibrate_now=CALIBRATE_ON_LOAD)
+        self.n_ctx = self.profile["n_ctx"]
+
+        logger.info(
+            f"Loading LLM from {LLM_MODEL_PATH} ({self.model_info['architecture']}, {self.model_info['quantization']}): "
+            f"n_ctx={self.n_ctx}, threads={self.profile['n_threads']}/{self.profile['n_threads_batch']}, "
+            f"n_batch={self.profile['n_batch']}, mlock={self.profile['use_mlock']}, "
+            f"{'calibrated' if self.profile['calibrated'] else 'heuristic'} profile, overrides={self.profile['overrides']}..."
+        )
         try:
-            # CPU-focused loading
-            self.llm = Llama(
-                model_path=LLM_MODEL_PATH,
-                n_ctx=MAX_CONTEXT_WINDOW,
-                n_threads=CPU_THREADS,
-                n_batch=1024,      # Increased from 512 for faster prompt processing
-                n_gpu_layers=N_GPU_LAYERS, # Use GPU if configured
-                verbose=False
-            )
+            if self.speculative_mode != "off" and BATCH_MAX_SEQUENCES <= 1:
+                self.draft = self._build_draft()
+            self.llm = self._create_llm(self.draft)
+            if self.draft and self.draft.n_vocab is not None and self.draft.n_vocab != self.llm.n_vocab():
+                logger.warning(f"Draft model vocabulary ({self.draft.n_vocab}) differs from the main model ({self.llm.n_vocab()}). Reloading without speculative decoding.")
+                self.draft = None
+                self.llm = None
+                self.llm = self._create_llm(None)
             logger.info("LLM Loaded successfully.")
+            if BATCH_MAX_SEQUENCES > 1:
+                from src.batching import ContinuousBatcher
+                self.batcher = ContinuousBatcher(self.llm, BATCH_MAX_SEQUENCES, ctx_per_sequence=self.n_ctx,
+                                                 n_threads=self.profile["n_threads"], n_threads_batch=self.profile["n_threads_batch"])
+            elif 0 < SMALL_CONTEXT_WINDOW < self.n_ctx:
+                # A one-sequence batcher is exactly a second context on the same weights
+                # with its own sampler; only its (small) KV cache is new memory.
+                from src.batching import ContinuousBatcher
+                self.small_ctx = ContinuousBatcher(self.llm, 1, ctx_per_sequence=SMALL_CONTEXT_WINDOW,
+                                                   n_threads=self.profile["n_threads"], n_threads_batch=self.profile["n_threads_batch"])
+                logger.info(f"Small context ready: n_ctx={SMALL_CONTEXT_WINDOW} for short requests.")
         except Exception as e:
             logger.error(f"Failed to load LLM: {e}")
 
-    def generate_response(self, prompt: str, stop: list = ["<|im_end|>", "<|im_start|>", "User:", "<|user|>"]) -> Generator[str, None, None]:
+    def _create_llm(self, draft) -> Llama:
+        """
+        CPU-focused loading. The draft has to be passed here: llama-cpp-python
+        only keeps logits for every position (which verifying a draft needs)
+        when the context is created with draft_model set.
+        """
+        # With batching, generation runs in the batcher's own context, so the
+        # default context only needs to be big enough for housekeeping.
+        return Llama(
+            model_path=LLM_MODEL_PATH,
+            n_ctx=self.n_ctx if BATCH_MAX_SEQUENCES <= 1 else 512,
+            n_threads=self.profile["n_threads"],              # decode (memory-bandwidth bound)
+            n_threads_batch=self.profile["n_threads_batch"],  # prompt processing (compute bound)
+            n_batch=self.profile["n_batch"],
+            use_mmap=self.profile["use_mmap"],
+            use_mlock=self.profile["use_mlock"],
+            n_gpu_layers=N_GPU_LAYERS, # Use GPU if configured
+            draft_model=draft,         # create_completion verifies drafts in one batched eval per step
+            verbose=False
+        )
+
+    def _build_draft(self):
+        try:
+            from src.speculative import build_draft_model
+            return build_draft_model(self.n_ctx, self.profile["n_threads"], mode=self.speculative_mode)
+        except Exception as e:
+            # Older llama-cpp-python builds lack llama_speculative
+            logger.warning(f"Speculative decoding unavailable: {e}")
+            return None
+
+    def warm_prefix(self, prefix: str):
+        """
+        Evaluate the static prompt prefix once and persist its KV state to disk.
+        Later prompts starting with this prefix only evaluate their own suffix,
+        and a cold start loads the saved state instead of recomputing it.
+        """
+        if not self.llm or not PROMPT_CACHE_ENABLED:
+            return
+
+        self.prefix_text = prefix
+        self.prefix_tokens = self.llm.tokenize(prefix.encode('utf-8'), special=True)
+
+        if self.batcher:
+            # Shared into every batched sequence via the KV cache
+            self.batcher.set_prefix(self.prefix_tokens)
+            return
+        if self.small_ctx:
+            self.small_ctx.set_prefix(self.prefix_tokens)
+
+        self.prefix_cache_path = self._prefix_cache_path(prefix)
+
+        if os.path.exists(self.prefix_cache_path) and self._load_prefix_state():
+            logger.info(f"Loaded prompt prefix cache ({len(self.prefix_tokens)} tokens) from {self.prefix_cache_path}")
+            return
+
+        self._eval_prefix()
+        self._save_prefix_state()
+
+    def _prefix_cache_path(self, prefix: str) -> str:
+        # The KV state is only valid for the same model file, context size and prefix text
+        stat = os.stat(LLM_MODEL_PATH)
+        key = f"{os.path.basename(LLM_MODEL_PATH)}|{stat.st_size}|{int(stat.st_mtime)}|{self.llm.n_ctx()}|{N_GPU_LAYERS}|{prefix}"
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(PROMPT_CACHE_DIR, f"prefix_{digest}.bin")
+
+    def _eval_prefix(self):
+        import time
+        start_time = time.time()
+        self.llm.reset()
+        self.llm.eval(self.prefix_tokens)
+        logger.info(f"Evaluated prompt prefix ({len(self.prefix_tokens)} tokens) in {time.time() - start_time:.2f}s")
+
+    def _save_prefix_state(self):
+        save_fn = getattr(llama_cpp, "llama_state_save_file", None) or getattr(llama_cpp, "llama_save_session_file", None)
+        if save_fn is None:
+            return
+        try:
+            os.makedirs(PROMPT_CACHE_DIR, exist_ok=True)
+            n = len(self.prefix_tokens)
+            tokens = (llama_cpp.llama_token * n)(*self.prefix_tokens)
+            if save_fn(self.llm.ctx, self.prefix_cache_path.encode('utf-8'), tokens, n):
+                logger.info(f"Saved prompt prefix cache to {self.prefix_cache_path}")
+        except Exception as e:
+            logger.warning(f"Failed to save prompt prefix cache: {e}")
+
+    def _load_prefix_state(self) -> bool:
+        load_fn = getattr(llama_cpp, "llama_state_load_file", None) or getattr(llama_cpp, "llama_load_session_file", None)
+        if load_fn is None:
+            return False
+        try:
+            capacity = self.llm.n_ctx()
+            tokens = (llama_cpp.llama_token * capacity)()
+            n_loaded = ctypes.c_size_t(0)
+            if not load_fn(self.llm.ctx, self.prefix_cache_path.encode('utf-8'), tokens, capacity, ctypes.byref(n_loaded)):
+                return False
+            loaded = list(tokens[:n_loaded.value])
+            if loaded != self.prefix_tokens:
+                logger.warning("Prompt prefix cache does not match current prefix. Rebuilding.")
+                return False
+            # Tell the Python wrapper which tokens the KV cache now holds so
+            # create_completion reuses them as a matching prefix.
+            self.llm.input_ids[:len(loaded)] = loaded
+            self.llm.n_tokens = len(loaded)
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to load prompt prefix cache: {e}")
+            return False
+
+    def _ensure_prefix(self, prompt: str):
+        """
+        Make sure the KV cache starts with the warmed prefix before generating.
+        llama.cpp keeps the previous request's tokens, so this is usually a no-op;
+        it only restores when something else (e.g. a raw benchmark prompt) evicted it.
+        """
+        if not self.prefix_tokens or not prompt.startswith(self.prefix_text):
+            return
+        n = len(self.prefix_tokens)
+        if self.llm.n_tokens >= n and list(self.llm.input_ids[:n]) == self.prefix_tokens:
+            return
+        if not self._load_prefix_state():
+            self._eval_prefix()
+
+    def generate_response(self, prompt: str, stop: list = ["<|im_end|>", "<|im_start|>", "User:", "<|user|>"], prompt_tokens: Optional[int] = None, should_stop: Optional[Callable[[], bool]] = None, max_tokens: Optional[int] = None, use_small_ctx: bool = True) -> Generator[str, None, None]:
         """
         Stream response from LLM with strict parameters.
+        `should_stop` is checked between tokens; when it returns True decoding
+        is aborted and the model is free for the next request.
+        `max_tokens` is the per-request generation budget (default LLM_MAX_TOKENS);
+        requests whose prompt + budget fit the small context are decoded there.
         """
         if not self.llm:
             yield "Error: Model not loaded."
             return
 
-        # Estimate prompt tokens to ensure we don't exceed context
-        prompt_tokens = len(self.llm.tokenize(prompt.encode('utf-8')))
-        available_tokens = LLM_CONTEXT_WINDOW - prompt_tokens
+        # Prompt size: callers that packed the context with exact counts pass it in;
+        # otherwise tokenize here to ensure we don't exceed context
+        if prompt_tokens is None:
+            prompt_tokens = len(self.llm.tokenize(prompt.encode('utf-8'), special=True))
+        available_tokens = self.n_ctx - prompt_tokens
         
         if available_tokens < 100:
             logger.warning("Context limit near! Truncating response potential.")
             # In a real system, we'd truncate the prompt history here.
 
-        stream = self.llm.create_completion(
-            prompt=prompt,
-            max_tokens=min(LLM_MAX_TOKENS, available_tokens),
-            stop=stop,
-            stream=True,
-            temperature=LLM_TEMPERATURE,
-            top_p=0.9,          # Nucleus sampling
-            repeat_penalty=1.2, # Increased from 1.1 to prevent looping
-            echo=False
-        )
-
         import time
         start_time = time.time()
         token_count = 0
+        max_tokens = min(max_tokens or LLM_MAX_TOKENS, available_tokens)
+        cancelled = False
+        stream = None
+        context = "full"
+
+        if self.batcher:
+            # Joins the running batch at the next token boundary
+            pieces = self.batcher.generate(prompt, max_tokens=max_tokens, stop=stop, should_stop=should_stop)
+        elif use_small_ctx and self.small_ctx and prompt_tokens + max_tokens <= self.small_ctx.capacity:
+            context = "small"
+            pieces = self.small_ctx.generate(prompt, max_tokens=max_tokens, stop=stop, should_stop=should_stop)
+        else:
+            # Reuse the cached system prefix; only the per-request suffix gets evaluated
+            self._ensure_prefix(prompt)
+            if self.draft:
+                self.draft.begin()
+
+            stream = self.llm.create_completion(
+                prompt=prompt,
+                max_tokens=max_tokens,
+                stop=stop,
+                stream=True,
+                temperature=LLM_TEMPERATURE,
+                top_p=0.9,          # Nucleus sampling
+                repeat_penalty=1.2, # Increased from 1.1 to prevent looping
+                echo=False
+            )
+            pieces = (output['choices'][0]['text'] for output in stream)
 
-        for output in stream:
-            token = output['choices'][0]['text']
+        for token in pieces:
+            if should_stop and should_stop():
+                cancelled = True
+                break
             token_count += 1
             yield token
+        if should_stop and not cancelled and should_stop():
+            cancelled = True
+        # Closing the streams stops llama.cpp from decoding any further tokens
+        pieces.close()
+        if stream is not None:
+            stream.close()
             
         duration = time.time() - start_time
         tps = token_count / duration if duration > 0 else 0
         logger.info(f"Generation Statistics: {token_count} tokens in {duration:.2f}s ({tps:.2f} t/s)")
+        if cancelled:
+            logger.info(f"Generation cancelled after {token_count} tokens; saved up to {max_tokens - token_count} wasted tokens.")
         
         # Final yield to convey performance metadata
-        yield {"type": "meta", "tps": round(tps, 2), "duration": round(duration, 2)}
+        meta = {"type": "meta", "tps": round(tps, 2), "duration": round(duration, 2), "cached": False, "cancelled": cancelled, "max_tokens": max_tokens, "context": context}
+        if self.draft and stream is not None:
+            meta["speculative"] = self.draft.stats()
+            logger.info(f"Speculative decoding: {meta['speculative']}")
+        yield meta
@@ -1,15 +1,21 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool, iterate_in_threadpool
 import shutil
 import os
 import sys
 import logging
+from typing import Optional
 
 from src.models import ChatRequest, ChatResponse, IngestResponse
 from src.rag_engine import RAGEngine
 from src.ingestion import DocumentIngestor
-from src.config import DATA_DIR, LOG_FILE
+from src.jobs import IngestionJobManager
+from src.scheduler import GenerationScheduler, QueueFullError, DeadlineExceededError
+from src.startup import StartupManager
+from src.model_registry import get_model_registry
+from src.config import DATA_DIR, LOG_FILE, DOCUMENT_PAGE_MAX, STARTUP_WARM
 
 # Initialize Logging
 logging.basicConfig(
@@ -39,13 +45,35 @@ _rag_engine = None
 _ingestor = None
 download_progress = {"status": "idle", "progress": 0, "message": ""}
 
-def get_rag_engine():
+# Staged startup: vector DB -> embedder -> LLM, warmed in the background
+# (order from BHARATEDGE_STARTUP_ORDER) and loaded on demand if needed sooner.
+def load_vector_db():
     global _rag_engine
-    if _rag_engine is None:
-        try:
-            _rag_engine = RAGEngine()
-        except Exception as e:
-            logger.error(f"Failed to initialize RAGEngine: {e}")
+    _rag_engine = RAGEngine(load_models=False)
+
+def load_embedder():
+    return _rag_engine.load_retrieval_models()
+
+def load_llm():
+    return _rag_engine.load_llm()
+
+startup = StartupManager()
+startup.register("vector_db", load_vector_db)
+startup.register("embedder", load_embedder, requires=["vector_db"])
+startup.register("llm", load_llm, requires=["vector_db"])
+
+@app.on_event("startup")
+def warm_components():
+    if STARTUP_WARM:
+        startup.start()
+
+def get_rag_engine(component: str = "vector_db"):
+    """
+    The RAG engine once `component` (and what it needs) is loaded, else None.
+    Retrieval needs "vector_db"; generation needs "llm".
+    """
+    if not startup.ensure(component):
+        return None
     return _rag_engine
 
 def get_ingestor():
@@ -57,6 +85,16 @@ def get_ingestor():
             logger.error(f"Failed to initialize DocumentIngestor: {e}")
     return _ingestor
 
+def get_vector_db():
+    engine = get_rag_engine("embedder")
+    return engine.vector_db if engine else None
+
+# Background ingestion (parse -> chunk -> embed -> index) off the event loop
+ingestion_jobs = IngestionJobManager(get_ingestor, get_vector_db)
+
+# Serializes access to the single llama.cpp instance
+generation_scheduler = GenerationScheduler()
+
 @app.get("/setup/status")
 def get_setup_status():
     return download_progress
@@ -71,40 +109,33 @@ async def init_setup(background_tasks: BackgroundTasks):
 
 def run_setup_tasks():
     global download_progress
-    from src.config import LLM_MODEL_PATH, LLM_MODEL_FILENAME, MODELS_DIR
-    import requests
+    from src.config import LLM_MODEL_PATH, LLM_MODEL_URL, LLM_MODEL_SHA256
+    from src.downloader import RangedDownloader
     
     try:
         download_progress["status"] = "downloading"
         
         # 1. Download LLM
-        # 1. Download LLM
-        min_size = 1.5 * 1024 * 1024 * 1024 # 1.5 GB
-        
-        if os.path.exists(LLM_MODEL_PATH):
-            file_size = os.path.getsize(LLM_MODEL_PATH)
-            if file_size < min_size:
-                logger.warning(f"Model file corrupt (size {file_size} < {min_size}). Deleting...")
-                try:
-                    os.remove(LLM_MODEL_PATH)
-                except Exception as e:
-                    logger.error(f"Failed to delete corrupt model: {e}")
+        llm_info = get_model_registry().gguf(LLM_MODEL_PATH)
+        if llm_info["exists"] and not llm_info["valid"]:
+            logger.warning(f"Model file corrupt ({llm_info['error']}). Deleting...")
+            try:
+                os.remove(LLM_MODEL_PATH)
+            except Exception as e:
+                logger.error(f"Failed to delete corrupt model: {e}")
         
         if not os.path.exists(LLM_MODEL_PATH):
-            url = "https://huggingface.co/Qwen/Qwen2.5-3B-Instruct-GGUF/resolve/main/qwen2.5-3b-instruct-q4_k_m.gguf"
-            logger.info(f"Downloading LLM from {url}...")
-            response = requests.get(url, stream=True)
-            total_size = int(response.headers.get('content-length', 0))
+            logger.info(f"Downloading LLM from {LLM_MODEL_URL}...")
             download_progress["message"] = "Downloading LLM Brain (2.5GB)..."
-            
-            with open(LLM_MODEL_PATH, 'wb') as f:
-                downloaded = 0
-                for data in response.iter_content(chunk_size=1024*1024): # 1MB chunks
-                    downloaded += len(data)
-                    f.write(data)
-                    if total_size > 0:
-                        download_progress["progress"] = int((downloaded / total_size) * 80) # 80% for LLM
-        
+
+            def on_progress(p):
+                if p["total_bytes"] > 0:
+                    download_progress["progress"] = int((p["downloaded_bytes"] / p["total_bytes"]) * 80) # 80% for LLM
+                download_progress.update(p)
+
+            # Resumes from models/<file>.part if a previous attempt was interrupted
+            RangedDownloader(LLM_MODEL_URL, LLM_MODEL_PATH, sha256=LLM_MODEL_SHA256, on_progress=on_progress).download()
+
         # 2. Embedding Model
         download_progress["message"] = "Downloading Embedding Model..."
         from src.config import EMBEDDING_CACHE_DIR, EMBEDDING_MODEL_NAME
@@ -120,7 +151,9 @@ def run_setup_tasks():
 
         download_progress["message"] = "Initializing Embedding Engine..."
         download_progress["progress"] = 90
-        get_rag_engine() # This will trigger model loads
+        # Retry components that were missing before the download
+        startup.ensure("embedder", retry=True)
+        startup.ensure("llm", retry=True)
         
         download_progress["status"] = "complete"
         download_progress["progress"] = 100
@@ -135,18 +168,42 @@ def run_setup_tasks():
 def health_check():
     from src.config import LLM_MODEL_PATH, EMBEDDING_MODEL_NAME
     
-    min_size = 1.5 * 1024 * 1024 * 1024 # 1.5 GB
-    llm_exists = os.path.exists(LLM_MODEL_PATH) and os.path.getsize(LLM_MODEL_PATH) > min_size
-    embedding_exists = os.path.exists(os.path.join(EMBEDDING_MODEL_NAME, "config.json"))
+    # Structural checks are cached per (path, size, mtime): a stat per poll
+    registry = get_model_registry()
+    llm_info = registry.gguf(LLM_MODEL_PATH)
+    embedding_info = registry.sentence_transformer(EMBEDDING_MODEL_NAME)
     
-    engine = get_rag_engine()
+    # Never triggers a load: the splash screen polls this while components warm up
     return {
         "status": "ok", 
-        "llm_loaded": engine.llm_engine.llm is not None if engine and engine.llm_engine else False,
-        "model_exists": llm_exists and embedding_exists,
-        "engine_ready": engine is not None
+        "llm_loaded": startup.is_ready("llm"),
+        "model_exists": llm_info["valid"] and embedding_info["valid"],
+        "models": {
+            "llm": {k: llm_info.get(k) for k in ("valid", "error", "architecture", "quantization", "context_length", "n_params")},
+            "embedding": {k: embedding_info.get(k) for k in ("valid", "error")}
+        },
+        "engine_ready": startup.is_ready("vector_db"),
+        "components": startup.summary()
     }
 
+@app.get("/scheduler/stats")
+def scheduler_stats():
+    """Queue depth plus queue wait, TTFT and tokens/sec percentiles."""
+    return generation_scheduler.stats()
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Hit/miss ratios and memory use of the query caches."""
+    engine = get_rag_engine()
+    if not engine:
+        raise HTTPException(status_code=503, detail="AI Engine not ready. Check model files.")
+    stats = engine.vector_db.cache_stats()
+    if engine.answer_cache:
+        stats["answers"] = engine.answer_cache.stats()
+    if engine.reranker:
+        stats["reranker"] = engine.reranker.stats()
+    return stats
+
 @app.post("/documents/upload", response_model=IngestResponse)
 async def upload_document(file: UploadFile = File(...)):
     ingestor = get_ingestor()
@@ -154,37 +211,57 @@ async def upload_document(file: UploadFile = File(...)):
         raise HTTPException(status_code=503, detail="Ingestion engine not ready. Check model files.")
     
     try:
-        # 1. Save File
+        # 1. Save File (off the event loop; large uploads take a while to write)
         filename = file.filename
-        file_path = ingestor.save_upload(file.file, filename)
+        file_path = await run_in_threadpool(ingestor.save_upload, file.file, filename)
         logger.info(f"File saved to {file_path}")
 
-        # 2. Process (Parse & Chunk)
-        chunks, metadatas = ingestor.process_document(file_path)
-        
-        # 3. Index (Vector DB)
-        if chunks:
-            engine = get_rag_engine()
-            if engine:
-                engine.vector_db.add_documents(chunks, metadatas)
+        # 2. Queue Parse, Chunk & Index as a background job
+        job = ingestion_jobs.submit(file_path)
         
         return IngestResponse(
             filename=filename,
-            chunks_count=len(chunks),
-            status="indexed"
+            chunks_count=0,
+            status=job["status"],
+            job_id=job["job_id"]
         )
     except Exception as e:
         logger.error(f"Upload failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/documents/jobs")
+def list_ingestion_jobs():
+    """List recent ingestion jobs, newest first."""
+    return ingestion_jobs.list_jobs()
+
+@app.get("/documents/jobs/{job_id}")
+def get_ingestion_job(job_id: str):
+    """Progress of one ingestion job (stage, pages/sec, chunks/sec)."""
+    job = ingestion_jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 @app.get("/documents")
-def list_documents():
-    """List uploaded documents."""
-    try:
-        files = os.listdir(DATA_DIR)
-        return [{"filename": f} for f in files if os.path.isfile(os.path.join(DATA_DIR, f))]
-    except Exception as e:
-        return []
+def list_documents(response: Response, offset: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1, le=DOCUMENT_PAGE_MAX), q: str = None):
+    """
+    List indexed documents from the registry. Without `limit` every document
+    is returned (as before paging existed); with it, one page at a time.
+    The total number of matches is returned in the X-Total-Count header.
+    """
+    engine = get_rag_engine()
+    vector_db = engine.vector_db if engine else None
+    if not vector_db:
+        # Engine not ready yet: fall back to the upload folder
+        try:
+            files = sorted(f for f in os.listdir(DATA_DIR) if os.path.isfile(os.path.join(DATA_DIR, f)))
+            response.headers["X-Total-Count"] = str(len(files))
+            return [{"filename": f} for f in (files[offset:offset + limit] if limit else files[offset:])]
+        except Exception as e:
+            return []
+    documents, total = vector_db.registry.page(offset=offset, limit=limit, query=q)
+    response.headers["X-Total-Count"] = str(total)
+    return [{"filename": d["source"], **d} for d in documents]
 
 @app.delete("/documents/{filename}")
 async def delete_document_endpoint(filename: str):
@@ -192,12 +269,12 @@ async def delete_document_endpoint(filename: str):
         # 1. Delete from Disk
         file_path = os.path.join(DATA_DIR, filename)
         if os.path.exists(file_path):
-            os.remove(file_path)
+            await run_in_threadpool(os.remove, file_path)
             
-        # 2. Delete from Vector DB
-        engine = get_rag_engine()
+        # 2. Delete from Vector DB (may wait for the database to finish loading)
+        engine = await run_in_threadpool(get_rag_engine)
         if engine:
-            engine.vector_db.delete_document(filename)
+            await run_in_threadpool(engine.vector_db.delete_document, filename)
         
         return {"status": "deleted", "filename": filename}
     except Exception as e:
@@ -205,22 +282,39 @@ async def delete_document_endpoint(filename: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 import json
+import time
 
 @app.post("/chat")
 async def chat_endpoint(request: ChatRequest):
     """
     Streaming chat endpoint providing JSON Events.
     """
-    engine = get_rag_engine()
+    # Waits for the LLM if it is still warming up
+    engine = await run_in_threadpool(get_rag_engine, "llm")
     if not engine:
         raise HTTPException(status_code=503, detail="AI Engine not ready. Check model files.")
 
-    # Get citations first
-    citations = engine.get_citations(request.message, sources=request.sources)
-    logger.info(f"Query: {request.message} | Filters: {request.sources} | Chunks: {len(citations)}")
+    # Retrieve once; the same chunks feed both the citation event and the prompt
+    retrieval_start = time.time()
+    # Embedding, search and re-ranking block, so they run off the event loop
+    chunks = await run_in_threadpool(engine.retrieve_context, request.message, sources=request.sources, history=request.history)
+    retrieval_ms = (time.time() - retrieval_start) * 1000
+    citations = engine.get_citations(request.message, sources=request.sources, chunks=chunks)
+    logger.info(f"Query: {request.message} | Filters: {request.sources} | Chunks: {len(chunks)} | Retrieval: {retrieval_ms:.1f}ms")
+
+    # Admission control: one generation at a time, bounded wait queue
+    try:
+        ticket = generation_scheduler.submit(priority=request.priority or 0, deadline_seconds=request.deadline_seconds)
+    except QueueFullError as e:
+        logger.warning(f"Rejected chat request: {e}")
+        raise HTTPException(status_code=429, detail=str(e))
 
     def response_generator():
+        token_count = 0
         try:
+            # 0. Request ID, so the client can POST /chat/{request_id}/cancel
+            yield json.dumps({"type": "start", "request_id": ticket.request_id}) + "\n"
+
             # 1. Yield Citations
             citation_data = [{
                 "source": c.source, 
@@ -229,23 +323,72 @@ async def chat_endpoint(request: ChatRequest):
             } for c in citations]
             
             yield json.dumps({"type": "citation", "data": citation_data}) + "\n"
+
+            # 2. Wait for the model, reporting queue position
+            for position in generation_scheduler.wait(ticket):
+                yield json.dumps({"type": "queue", "position": position, "request_id": ticket.request_id}) + "\n"
             
-            # 2. Yield Tokens
-            for piece in engine.query(request.message, request.history, sources=request.sources):
+            # 3. Yield Tokens (generation checks the ticket between tokens)
+            for piece in engine.query(request.message, request.history, sources=request.sources, chunks=chunks, should_stop=ticket.should_stop):
                 if isinstance(piece, dict) and piece.get("type") == "meta":
+                     piece["queue_wait_ms"] = round((ticket.started_at - ticket.enqueued_at) * 1000, 1)
+                     piece["ttft_ms"] = round((ticket.first_token_at - ticket.started_at) * 1000, 1) if ticket.first_token_at else None
                      yield json.dumps(piece) + "\n"
                 else:
+                     generation_scheduler.mark_first_token(ticket)
+                     token_count += 1
                      yield json.dumps({"type": "token", "data": piece}) + "\n"
+
+            if ticket.should_stop():
+                raise DeadlineExceededError("Request cancelled" if ticket.cancelled else "Request deadline exceeded during generation")
                 
             yield json.dumps({"type": "done"}) + "\n"
         except Exception as e:
             logger.error(f"Chat streaming error: {e}")
             yield json.dumps({"type": "error", "message": str(e)}) + "\n"
+        finally:
+            generation_scheduler.release(ticket, token_count)
+
+    async def stream_events():
+        finished = False
+        try:
+            async for line in iterate_in_threadpool(response_generator()):
+                yield line
+            finished = True
+        finally:
+            # Starlette cancels this stream when the client disconnects (window
+            # closed, new question). Flag the ticket so decoding stops at the
+            # next token and the model goes to the next queued request.
+            if not finished:
+                logger.info(f"Client disconnected from request {ticket.request_id}. Cancelling generation.")
+                generation_scheduler.cancel(ticket)
+
+    return StreamingResponse(stream_events(), media_type="application/x-ndjson")
+
+@app.post("/search")
+def search_documents(request: ChatRequest):
+    """
+    Retrieval only (no generation). Available as soon as the vector DB is up;
+    until the embedder has loaded it answers from the BM25 index.
+    """
+    engine = get_rag_engine()
+    if not engine:
+        raise HTTPException(status_code=503, detail="Vector DB not ready.")
+    chunks = engine.retrieve_candidates(request.message, sources=request.sources)
+    return [{"source": c.source, "page": c.page, "text": c.text, "score": c.score} for c in chunks]
 
-    return StreamingResponse(response_generator(), media_type="application/x-ndjson")
+@app.post("/chat/{request_id}/cancel")
+def cancel_chat(request_id: str):
+    """Abort a queued or running generation."""
+    if not generation_scheduler.cancel_request(request_id):
+        raise HTTPException(status_code=404, detail="Request not found or already finished")
+    return {"status": "cancelled", "request_id": request_id}
 
 
 if __name__ == "__main__":
+    import multiprocessing
+    # Required for the PDF parsing process pool in the frozen (PyInstaller) build
+    multiprocessing.freeze_support()
     import uvicorn
     # Use the app object directly instead of a string for sidecar reliability
     uvicorn.run(app, host="127.0.0.1", port=8000)
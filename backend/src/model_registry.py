@@ -0,0 +1,271 @@
+import os
+import json
+import mmap
+import struct
+import logging
+import threading
+from typing import Dict
+from src.config import MODEL_REGISTRY_PATH
+
+logger = logging.getLogger(__name__)
+
+# GGUF metadata value types -> struct format (strings and arrays handled separately)
+_GGUF_SCALARS = {0: "<B", 1: "<b", 2: "<H", 3: "<h", 4: "<I", 5: "<i", 6: "<f", 7: "<?", 10: "<Q", 11: "<q", 12: "<d"}
+_GGUF_STRING, _GGUF_ARRAY = 8, 9
+
+# ggml tensor type -> (elements per block, bytes per block)
+_GGML_BLOCKS = {
+    0: (1, 4), 1: (1, 2), 2: (32, 18), 3: (32, 20), 6: (32, 22), 7: (32, 24), 8: (32, 34), 9: (32, 36),
+    10: (256, 84), 11: (256, 110), 12: (256, 144), 13: (256, 176), 14: (256, 210), 15: (256, 292),
+    16: (256, 66), 17: (256, 74), 18: (256, 98), 19: (256, 50), 20: (32, 18), 21: (256, 110),
+    22: (256, 82), 23: (256, 136), 24: (1, 1), 25: (1, 2), 26: (1, 4), 27: (1, 8), 28: (1, 8),
+    29: (256, 56), 30: (1, 2)
+}
+
+# general.file_type -> quantization name
+_FILE_TYPES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 7: "Q8_0", 8: "Q5_0", 9: "Q5_1", 10: "Q2_K",
+    11: "Q3_K_S", 12: "Q3_K_M", 13: "Q3_K_L", 14: "Q4_K_S", 15: "Q4_K_M", 16: "Q5_K_S",
+    17: "Q5_K_M", 18: "Q6_K", 19: "IQ2_XXS", 20: "IQ2_XS", 21: "Q2_K_S", 22: "IQ3_XS",
+    23: "IQ3_XXS", 24: "IQ1_S", 25: "IQ4_NL", 26: "IQ3_S", 27: "IQ3_M", 28: "IQ2_S",
+    29: "IQ2_M", 30: "IQ4_XS", 31: "IQ1_M", 32: "BF16"
+}
+
+class ModelValidationError(Exception):
+    """Raised when a model file is truncated or structurally invalid."""
+
+class _Reader:
+    """
+    Sequential little-endian reader over an mmap. Bounds-checked, so a
+    truncated header raises instead of reading past the end.
+    """
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+
+    def unpack(self, fmt: str):
+        size = struct.calcsize(fmt)
+        if self.pos + size > len(self.buf):
+            raise ModelValidationError(f"Header truncated at byte {self.pos}")
+        value = struct.unpack_from(fmt, self.buf, self.pos)[0]
+        self.pos += size
+        return value
+
+    def string(self) -> str:
+        length = self.unpack("<Q")
+        if self.pos + length > len(self.buf):
+            raise ModelValidationError(f"String truncated at byte {self.pos}")
+        value = bytes(self.buf[self.pos:self.pos + length]).decode("utf-8", errors="replace")
+        self.pos += length
+        return value
+
+    def skip_strings(self, count: int):
+        for _ in range(count):
+            length = self.unpack("<Q")
+            self.pos += length
+        if self.pos > len(self.buf):
+            raise ModelValidationError("String array truncated")
+
+    def value(self, value_type: int):
+        """
+        Scalars and strings are returned; arrays are skipped and summarized
+        by their length (the tokenizer vocabulary alone is ~150k strings).
+        """
+        if value_type in _GGUF_SCALARS:
+            return self.unpack(_GGUF_SCALARS[value_type])
+        if value_type == _GGUF_STRING:
+            return self.string()
+        if value_type == _GGUF_ARRAY:
+            item_type = self.unpack("<I")
+            count = self.unpack("<Q")
+            if item_type == _GGUF_STRING:
+                self.skip_strings(count)
+            elif item_type in _GGUF_SCALARS:
+                self.pos += struct.calcsize(_GGUF_SCALARS[item_type]) * count
+                if self.pos > len(self.buf):
+                    raise ModelValidationError("Array truncated")
+            else:
+                for _ in range(count):
+                    self.value(item_type)
+            return {"array_length": count}
+        raise ModelValidationError(f"Unknown metadata type {value_type} at byte {self.pos}")
+
+def inspect_gguf(path: str) -> Dict:
+    """
+    Read a GGUF file's header, metadata and tensor index through mmap and check
+    every tensor's data lies inside the file. Only the header pages are touched,
+    so this is fast even for multi-GB models.
+    """
+    size = os.path.getsize(path)
+    if size < 24:
+        raise ModelValidationError(f"File too small to be GGUF ({size} bytes)")
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        r = _Reader(buf)
+        if bytes(buf[:4]) != b"GGUF":
+            raise ModelValidationError("Not a GGUF file (bad magic)")
+        r.pos = 4
+        version = r.unpack("<I")
+        if version < 2:
+            raise ModelValidationError(f"Unsupported GGUF version {version}")
+        n_tensors = r.unpack("<Q")
+        n_kv = r.unpack("<Q")
+
+        metadata = {}
+        for _ in range(n_kv):
+            key = r.string()
+            metadata[key] = r.value(r.unpack("<I"))
+
+        n_params = 0
+        data_end = 0
+        unknown_types = set()
+        for _ in range(n_tensors):
+            r.string()  # tensor name
+            n_dims = r.unpack("<I")
+            n_elements = 1
+            for _ in range(n_dims):
+                n_elements *= r.unpack("<Q")
+            tensor_type = r.unpack("<I")
+            offset = r.unpack("<Q")
+            n_params += n_elements
+            if tensor_type in _GGML_BLOCKS:
+                block_elements, block_bytes = _GGML_BLOCKS[tensor_type]
+                data_end = max(data_end, offset + n_elements // block_elements * block_bytes)
+            else:
+                unknown_types.add(tensor_type)
+                data_end = max(data_end, offset)
+
+        alignment = metadata.get("general.alignment", 32)
+        data_start = -(-r.pos // alignment) * alignment
+        if data_start + data_end > size:
+            raise ModelValidationError(f"Truncated: tensor data needs {data_start + data_end} bytes, file has {size}")
+        if unknown_types:
+            logger.warning(f"{os.path.basename(path)}: unknown tensor types {sorted(unknown_types)}; size check is partial.")
+
+    arch = metadata.get("general.architecture", "unknown")
+    file_type = metadata.get("general.file_type")
+    return {
+        "format": "gguf",
+        "version": version,
+        "name": metadata.get("general.name"),
+        "architecture": arch,
+        "quantization": _FILE_TYPES.get(file_type, str(file_type) if file_type is not None else None),
+        "context_length": metadata.get(f"{arch}.context_length"),
+        "block_count": metadata.get(f"{arch}.block_count"),
+        "embedding_length": metadata.get(f"{arch}.embedding_length"),
+        "head_count": metadata.get(f"{arch}.attention.head_count"),
+        "head_count_kv": metadata.get(f"{arch}.attention.head_count_kv"),
+        "n_tensors": n_tensors,
+        "n_params": n_params
+    }
+
+def inspect_safetensors(path: str) -> Dict:
+    """
+    Check a safetensors file's JSON header and that every tensor's byte range
+    lies inside the file.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        raw = f.read(8)
+        if len(raw) < 8:
+            raise ModelValidationError("File too small to be safetensors")
+        header_len = struct.unpack("<Q", raw)[0]
+        if 8 + header_len > size:
+            raise ModelValidationError("Truncated safetensors header")
+        try:
+            header = json.loads(f.read(header_len))
+        except ValueError as e:
+            raise ModelValidationError(f"Corrupt safetensors header: {e}")
+    tensors = {k: v for k, v in header.items() if k != "__metadata__"}
+    data_end = max((v["data_offsets"][1] for v in tensors.values()), default=0)
+    if 8 + header_len + data_end > size:
+        raise ModelValidationError(f"Truncated: tensor data needs {8 + header_len + data_end} bytes, file has {size}")
+    return {"format": "safetensors", "n_tensors": len(tensors)}
+
+def inspect_sentence_transformer(model_dir: str) -> Dict:
+    """
+    A saved SentenceTransformer folder: config plus a complete weights file.
+    """
+    if not os.path.exists(os.path.join(model_dir, "config.json")):
+        raise ModelValidationError("config.json missing")
+    weights = os.path.join(model_dir, "model.safetensors")
+    if os.path.exists(weights):
+        return inspect_safetensors(weights)
+    if os.path.exists(os.path.join(model_dir, "pytorch_model.bin")):
+        return {"format": "pytorch"}
+    raise ModelValidationError("No model weights found")
+
+class ModelRegistry:
+    """
+    Validation results for model files, cached by (path, size, mtime) in
+    memory and in MODEL_REGISTRY_PATH. A file is parsed once after it
+    changes; every later check (e.g. each /health poll) is a stat and a
+    dict lookup.
+    """
+
+    def __init__(self, path: str = MODEL_REGISTRY_PATH):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except Exception as e:
+                logger.warning(f"Corrupt model registry, revalidating models: {e}")
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not persist model registry: {e}")
+
+    def _check(self, path: str, stat_path: str, inspect) -> Dict:
+        try:
+            stat = os.stat(stat_path)
+        except FileNotFoundError:
+            return {"path": path, "valid": False, "exists": False, "error": "File not found"}
+        signature = [stat.st_size, stat.st_mtime_ns]
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry and entry["signature"] == signature:
+                return entry
+
+            try:
+                info = inspect(path)
+                entry = {"path": path, "valid": True, "exists": True, "error": None, **info}
+                logger.info(f"Validated model {os.path.basename(path)}: {info}")
+            except (ModelValidationError, OSError, ValueError, KeyError) as e:
+                entry = {"path": path, "valid": False, "exists": True, "error": str(e)}
+                logger.warning(f"Model {path} failed validation: {e}")
+            entry["size_bytes"] = stat.st_size
+            entry["signature"] = signature
+            self.entries[path] = entry
+            self._save()
+            return entry
+
+    def gguf(self, path: str) -> Dict:
+        return self._check(path, path, inspect_gguf)
+
+    def sentence_transformer(self, model_dir: str) -> Dict:
+        # Keyed on the weights file, which is the part that gets truncated
+        weights = os.path.join(model_dir, "model.safetensors")
+        stat_path = weights if os.path.exists(weights) else os.path.join(model_dir, "config.json")
+        return self._check(model_dir, stat_path, inspect_sentence_transformer)
+
+_model_registry = None
+_model_registry_lock = threading.Lock()
+
+def get_model_registry() -> ModelRegistry:
+    """
+    Shared ModelRegistry, created on first use.
+    """
+    global _model_registry
+    with _model_registry_lock:
+        if _model_registry is None:
+            _model_registry = ModelRegistry()
+        return _model_registry
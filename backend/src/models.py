@@ -1,16 +1,20 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 
 class ChatRequest(BaseModel):
     message: str
     history: Optional[List[dict]] = [] # List of {"role": "user/assistant", "content": "..."}
     sources: Optional[List[str]] = None # Optional list of specific filenames to filter by
+    priority: Optional[int] = Field(0, ge=0, le=9) # Lower runs first when requests queue; 0 (the default) is the highest a client can ask for
+    deadline_seconds: Optional[float] = None # Give up if not finished in time (defaults to GEN_DEADLINE_SECONDS)
 
 class DocumentChunk(BaseModel):
     text: str
     source: str
     page: int
     score: Optional[float] = None
+    id: Optional[str] = None # Chroma chunk ID
+    tokens: Optional[int] = None # Exact LLM token count, stored at ingestion (None if it must be counted)
 
 class ChatResponse(BaseModel):
     answer: str
@@ -20,3 +24,4 @@ class IngestResponse(BaseModel):
     filename: str
     chunks_count: int
     status: str
+    job_id: Optional[str] = None # Poll /documents/jobs/{job_id} for progress
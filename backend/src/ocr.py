@@ -0,0 +1,281 @@
+import os
+import time
+import heapq
+import hashlib
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import fitz  # PyMuPDF
+import psutil
+import numpy as np
+from src.config import (
+    OCR_DPI,
+    OCR_LANGUAGES,
+    OCR_WORKERS,
+    OCR_WORKER_MEMORY_MB,
+    OCR_BATCH_PAGES,
+    OCR_REORDER_PAGES,
+    OCR_CACHE_DIR,
+    OCR_MODEL_DIR,
+    OCR_IDLE_SECONDS,
+    USE_GPU
+)
+
+logger = logging.getLogger(__name__)
+
+class OcrCache:
+    """
+    OCR text keyed by a hash of the rendered page image (plus DPI and
+    languages), one small file per page. Re-ingesting a scanned PDF, or a
+    different file containing the same scanned pages, never repeats OCR.
+    """
+
+    def __init__(self, cache_dir: str = OCR_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def page_hash(samples: bytes) -> str:
+        digest = hashlib.sha256(samples)
+        digest.update(f"|{OCR_DPI}|{','.join(OCR_LANGUAGES)}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}.txt")
+
+    def get(self, digest: str) -> Optional[str]:
+        path = self._path(digest)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def put(self, digest: str, text: str):
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+# --- Worker process state: one easyocr Reader per process, loaded on first cache miss ---
+
+_reader = None
+
+def _get_reader():
+    global _reader
+    if _reader is None:
+        import easyocr
+        os.makedirs(OCR_MODEL_DIR, exist_ok=True)
+        _reader = easyocr.Reader(OCR_LANGUAGES, gpu=USE_GPU, model_storage_directory=OCR_MODEL_DIR, verbose=False)
+    return _reader
+
+def _ocr_page_batch(file_path: str, page_nums: List[int]) -> Tuple[List[Tuple[str, int]], int, float]:
+    """
+    Worker: render pages (1-indexed) at OCR_DPI and OCR the ones not cached.
+    Module-level so it can be pickled into a process pool.
+    Returns: ([(text, page_number)], cache hits, worker RSS in MB)
+    """
+    cache = OcrCache()
+    texts = {}
+    misses = []  # (page_num, digest, grayscale image)
+    with fitz.open(file_path) as doc:
+        for page_num in page_nums:
+            pix = doc[page_num - 1].get_pixmap(dpi=OCR_DPI, colorspace=fitz.csGRAY)
+            digest = OcrCache.page_hash(pix.samples)
+            text = cache.get(digest)
+            if text is None:
+                misses.append((page_num, digest, np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width).copy()))
+            else:
+                texts[page_num] = text
+
+    if misses:
+        reader = _get_reader()
+        images = [image for _, _, image in misses]
+        if len(images) > 1 and len({image.shape for image in images}) == 1:
+            # Same-size pages (the usual scanned PDF) go through the recognizer together
+            height, width = images[0].shape
+            outputs = reader.readtext_batched(images, n_width=width, n_height=height, detail=0, paragraph=True)
+        else:
+            outputs = [reader.readtext(image, detail=0, paragraph=True) for image in images]
+        for (page_num, digest, _), lines in zip(misses, outputs):
+            text = " ".join(" ".join(lines).split())
+            cache.put(digest, text)
+            texts[page_num] = text
+
+    results = [(texts[n], n) for n in page_nums if texts.get(n)]
+    rss_mb = psutil.Process(os.getpid()).memory_info().rss / 1024 / 1024
+    return results, len(page_nums) - len(misses), rss_mb
+
+class OcrPool:
+    """
+    Long-lived process pool for OCR, so each worker loads the easyocr models
+    once and reuses them across batches and documents. The worker count is
+    sized from available RAM at OCR_WORKER_MEMORY_MB each, and that cap is
+    enforced from the RSS each batch reports: a worker over it gets the pool
+    replaced (batches already running finish on the old one). The pool also
+    shuts down after OCR_IDLE_SECONDS without work to give its memory back.
+    """
+
+    def __init__(self, max_workers: int = OCR_WORKERS, worker_memory_mb: int = OCR_WORKER_MEMORY_MB, idle_seconds: float = OCR_IDLE_SECONDS):
+        self.max_workers = max_workers
+        self.worker_memory_mb = worker_memory_mb
+        self.idle_seconds = idle_seconds
+        self.pool = None
+        self.workers = 0
+        self.users = 0
+        self.idle_timer = None
+        self.lock = threading.Lock()
+
+    def _worker_count(self) -> int:
+        # Sizing only; the per-worker cap is enforced in _check_worker_memory
+        available_mb = psutil.virtual_memory().available / 1024 / 1024
+        return max(1, min(self.max_workers, int(available_mb // self.worker_memory_mb)))
+
+    def _acquire(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.idle_timer:
+                self.idle_timer.cancel()
+                self.idle_timer = None
+            if self.pool is None:
+                self.workers = self._worker_count()
+                self.pool = ProcessPoolExecutor(max_workers=self.workers)
+                logger.info(f"Started OCR pool with {self.workers} workers ({self.worker_memory_mb}MB cap each).")
+            self.users += 1
+            return self.pool
+
+    def _submit(self, *args) -> Tuple[Future, ProcessPoolExecutor]:
+        with self.lock:
+            return self.pool.submit(*args), self.pool
+
+    def _check_worker_memory(self, rss_mb: float, pool: ProcessPoolExecutor):
+        """
+        Replace `pool` if one of its workers grew past the memory cap. A
+        worker cannot be stopped mid-task, so the cap is checked per batch.
+        """
+        if rss_mb <= self.worker_memory_mb:
+            return
+        with self.lock:
+            if self.pool is not pool:
+                return  # Already replaced
+            logger.warning(f"OCR worker at {rss_mb:.0f}MB is over its {self.worker_memory_mb}MB cap. Restarting the OCR pool.")
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        pool.shutdown(wait=False)
+
+    def _release(self):
+        with self.lock:
+            self.users -= 1
+            if self.users == 0 and self.pool is not None:
+                self.idle_timer = threading.Timer(self.idle_seconds, self.shutdown)
+                self.idle_timer.daemon = True
+                self.idle_timer.start()
+
+    def shutdown(self):
+        with self.lock:
+            if self.users == 0 and self.pool is not None:
+                self.pool.shutdown(wait=False)
+                self.pool = None
+                logger.info("OCR pool idle. Shut down to free memory.")
+
+    def ocr_pages(
+        self,
+        file_path: str,
+        pages: Iterable[Tuple[str, int]],
+        needs_ocr: Callable[[str], bool],
+        stats: Optional[Dict] = None
+    ) -> Iterator[Tuple[str, int]]:
+        """
+        Merge a document's text-layer pages with OCR of its scanned ones,
+        yielding (text, page_number) in page order. Pages for which
+        `needs_ocr(text)` holds are batched across the pool as they are found,
+        with at most two batches per worker in flight. Text pages after a page
+        still being OCR'd wait in a buffer of OCR_REORDER_PAGES; past that,
+        reading stops until OCR catches up. The pool is only started once a
+        scanned page turns up.
+        `stats`, if given, is updated with pages, cache hits, pages/sec and peak worker RSS.
+        """
+        ready = []          # heap of (page_number, text), final once no earlier page awaits OCR
+        batch = []          # scanned pages not submitted yet
+        pending = deque()   # (future, page_nums, pool), in page order
+        acquired = False
+        failed = False
+        start = time.time()
+        if stats is not None:
+            stats.update({"ocr_pages": 0, "ocr_cache_hits": 0, "ocr_pages_per_sec": 0.0, "ocr_peak_rss_mb": 0.0})
+
+        def submit():
+            nonlocal acquired
+            if not batch:
+                return
+            if not acquired:
+                logger.info(f"{os.path.basename(file_path)}: pages without a text layer. Running OCR.")
+                self._acquire()
+                acquired = True
+            future, pool = self._submit(_ocr_page_batch, file_path, list(batch))
+            pending.append((future, list(batch), pool))
+            batch.clear()
+
+        def collect():
+            nonlocal failed
+            future, page_nums, pool = pending.popleft()
+            try:
+                results, hits, rss_mb = future.result()
+            except Exception as e:
+                # Later scanned pages are skipped too; text pages still stream
+                failed = True
+                logger.error(f"OCR failed for {file_path} (pages {page_nums[0]}-{page_nums[-1]}), scanned pages skipped: {e}")
+                return
+            self._check_worker_memory(rss_mb, pool)
+            if stats is not None:
+                stats["ocr_pages"] += len(page_nums)
+                stats["ocr_cache_hits"] += hits
+                elapsed = time.time() - start
+                stats["ocr_pages_per_sec"] = round(stats["ocr_pages"] / elapsed, 2) if elapsed > 0 else 0.0
+                stats["ocr_peak_rss_mb"] = round(max(stats["ocr_peak_rss_mb"], rss_mb), 1)
+            for text, page_num in results:
+                heapq.heappush(ready, (page_num, text))
+
+        def release() -> Iterator[Tuple[str, int]]:
+            waiting = pending[0][1][0] if pending else (batch[0] if batch else None)
+            while ready and (waiting is None or ready[0][0] < waiting):
+                page_num, text = heapq.heappop(ready)
+                yield text, page_num
+
+        try:
+            for text, page_num in pages:
+                if needs_ocr(text):
+                    if not failed:
+                        batch.append(page_num)
+                        if len(batch) >= OCR_BATCH_PAGES:
+                            submit()
+                elif text:
+                    heapq.heappush(ready, (page_num, text))
+                while pending and (pending[0][0].done() or len(pending) > self.workers * 2):
+                    collect()
+                while len(ready) > OCR_REORDER_PAGES and (pending or batch):
+                    submit()
+                    collect()
+                yield from release()
+            submit()
+            while pending:
+                collect()
+                yield from release()
+            yield from release()
+        finally:
+            if acquired:
+                self._release()
+
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+
+def get_ocr_pool() -> OcrPool:
+    """
+    Shared OcrPool, created on first use.
+    """
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            _ocr_pool = OcrPool()
+        return _ocr_pool
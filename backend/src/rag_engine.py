@@ -1,53 +1,242 @@
-from typing import List, Generator
+import re
+import time
+from typing import Callable, List, Generator, Optional
 from src.vector_db import VectorDBClient
 from src.llm_engine import LLMEngine
+from src.answer_cache import SemanticAnswerCache
+from src.reranker import get_reranker
+from src.tokenizer import get_token_counter
 from src.models import DocumentChunk
-from src.config import TOP_K_RETRIEVAL, MAX_RETRIEVAL_TOKENS
+from src.config import TOP_K_RETRIEVAL, MAX_RETRIEVAL_TOKENS, ANSWER_CACHE_ENABLED, LLM_CONTEXT_WINDOW, LLM_MAX_TOKENS, RETRIEVAL_MODE, RRF_K, RERANKER_ENABLED, RERANK_TOP_N
+from src.config import DYNAMIC_BUDGET_ENABLED, GENERATION_BUDGETS, LONG_CONTEXT_TOKENS
 import logging
 
 logger = logging.getLogger(__name__)
 
 class RAGEngine:
-    def __init__(self):
+    def __init__(self, load_models: bool = True):
+        """
+        With load_models=False only the vector DB is opened; the retrieval
+        models and the LLM are loaded later by the startup phases
+        (load_retrieval_models / load_llm).
+        """
         self.vector_db = VectorDBClient()
-        self.llm_engine = LLMEngine()
+        self.llm_engine = None
+        self.answer_cache = SemanticAnswerCache(self.vector_db.source_generation) if ANSWER_CACHE_ENABLED else None
+        self.reranker = None
+        if load_models:
+            self.load_retrieval_models()
+            self.load_llm()
+
+    def load_retrieval_models(self) -> bool:
+        """
+        Embedding model (and re-ranker, if exported).
+        """
+        self.vector_db.attach_embedder()
+        self.reranker = get_reranker() if RERANKER_ENABLED else None
+        return True
+
+    def load_llm(self) -> bool:
+        """
+        Load the GGUF model and warm the prompt prefix. False if the model file is missing.
+        """
+        llm_engine = LLMEngine()
+        llm_engine.warm_prefix(self.build_prompt_prefix())
+        self.llm_engine = llm_engine
+        return llm_engine.llm is not None
 
-    def retrieve_context(self, query: str, sources: List[str] = None) -> List[DocumentChunk]:
+    @property
+    def llm_ready(self) -> bool:
+        return self.llm_engine is not None and self.llm_engine.llm is not None
+
+    def retrieve_candidates(self, query: str, sources: List[str] = None, mode: str = RETRIEVAL_MODE, k: int = TOP_K_RETRIEVAL) -> List[DocumentChunk]:
+        """
+        Ranked candidates before budget packing. In hybrid mode the vector and
+        BM25 rankings are merged with reciprocal rank fusion.
+        """
+        if not self.vector_db.embedding_ready:
+            # Still starting up: BM25 alone keeps retrieval available
+            return self.vector_db.lexical_search(query, k=k, sources=sources)
+        vector_chunks = self.vector_db.search(query, k=k, sources=sources)
+        if mode != "hybrid":
+            return vector_chunks
+        lexical_chunks = self.vector_db.lexical_search(query, k=k, sources=sources)
+        return self.fuse_rankings([vector_chunks, lexical_chunks])
+
+    @staticmethod
+    def fuse_rankings(rankings: List[List[DocumentChunk]], rrf_k: int = RRF_K) -> List[DocumentChunk]:
+        """
+        Reciprocal rank fusion: score(chunk) = sum over rankings of 1 / (rrf_k + rank).
+        Rank-based, so cosine distances and BM25 scores need no normalization.
+        """
+        scores = {}
+        chunks = {}
+        for ranking in rankings:
+            for rank, chunk in enumerate(ranking, start=1):
+                key = chunk.id or f"{chunk.source}:{chunk.page}:{chunk.text}"
+                scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+                chunks.setdefault(key, chunk)
+        ordered = sorted(scores, key=scores.get, reverse=True)
+        return [chunks[key].model_copy(update={"score": scores[key]}) for key in ordered]
+
+    def retrieve_context(self, query: str, sources: List[str] = None, history: List[dict] = None) -> List[DocumentChunk]:
         """
         Retrieve and rank snippets, enforcing context window budget.
         """
-        # 1. Fetch raw top-k from VectorDB
-        raw_chunks = self.vector_db.search(query, k=TOP_K_RETRIEVAL, sources=sources)
+        # 1. Fetch ranked candidates (vector, or vector + BM25 fused)
+        raw_chunks = self.retrieve_candidates(query, sources=sources)
         
         if not raw_chunks:
             return []
 
-        # 2. Re-ranking (optional) - For now, trust cosine similarity from Chroma
-        # 3. Budget enforcement
-        selected_chunks = []
-        current_tokens = 0
-        # Estimation: 1 char ~= 0.25 - 0.3 tokens. Let's be conservative: 1 token = 3 chars.
-        
-        for chunk in raw_chunks:
-            # Estimate token count (naive) or use tiktoken if needed (avoid dependency if simple)
-            est_tokens = len(chunk.text) / 3.0
-            
-            if current_tokens + est_tokens > MAX_RETRIEVAL_TOKENS:
-                # If adding this chunk exceeds budget, stop adding (or try next smaller one)
-                # Simple greedy approach: just stop to fit what matches best.
-                continue
-                
-            selected_chunks.append(chunk)
-            current_tokens += est_tokens
+        # 2. Re-rank with the cross-encoder and keep only the best few, so the
+        # LLM does not spend prefill on marginal chunks. On timeout or without
+        # the model, retrieval order stands.
+        if self.reranker and len(raw_chunks) > 1:
+            reranked = self.reranker.rerank(query, raw_chunks)
+            if reranked is not None:
+                raw_chunks = reranked[:RERANK_TOP_N]
+
+        # 3. Budget enforcement: whatever the window has left after the real
+        # prompt overhead and the generation reserve, capped by MAX_RETRIEVAL_TOKENS
+        overhead = self.prompt_overhead_tokens(query, history or [], sources)
+        context_window = self.llm_engine.n_ctx if self.llm_ready else LLM_CONTEXT_WINDOW
+        budget = min(MAX_RETRIEVAL_TOKENS, context_window - LLM_MAX_TOKENS - overhead)
+        selected_chunks, used_tokens = self.pack_context(raw_chunks, budget)
             
-        logger.info(f"Selected {len(selected_chunks)} chunks (~{int(current_tokens)} tokens) for context.")
+        logger.info(f"Selected {len(selected_chunks)} chunks ({used_tokens}/{budget} tokens) for context.")
         return selected_chunks
 
-    def build_prompt(self, query: str, context_chunks: List[DocumentChunk], history: List[dict] = [], sources: List[str] = None) -> str:
+    def chunk_prompt_tokens(self, chunk: DocumentChunk, index: int) -> int:
+        """
+        Tokens a chunk adds to the prompt at citation `index`: its text
+        (counted at ingestion, or now if no exact count was stored), the
+        citation header and the separator.
+        """
+        token_counter = get_token_counter()
+        text_tokens = chunk.tokens
+        if text_tokens is None:
+            text_tokens = token_counter.count(chunk.text)
+            if token_counter.exact:
+                chunk.tokens = text_tokens  # Keep exact counts only
+        return text_tokens + token_counter.count(self.format_citation(index, chunk)) + 1
+
+    def context_tokens(self, chunks: List[DocumentChunk]) -> int:
+        """
+        Tokens the context block adds to the prompt, with each chunk's header
+        at the citation index format_context gives it.
+        """
+        return sum(self.chunk_prompt_tokens(c, i + 1) for i, c in enumerate(chunks))
+
+    def prompt_overhead_tokens(self, query: str, history: List[dict], sources: List[str] = None) -> int:
+        """
+        Exact token cost of everything in the prompt except the context chunks.
+        """
+        token_counter = get_token_counter()
+        prefix_tokens = (self.llm_engine and len(self.llm_engine.prefix_tokens)) or token_counter.count(self.build_prompt_prefix())
+        return prefix_tokens + token_counter.count(self.render_prompt_suffix("", query, history, sources))
+
+    def pack_context(self, chunks: List[DocumentChunk], budget: int):
         """
-        Constructs the strict RAG prompt.
+        0/1 knapsack over the ranked chunks: pick the set with the highest total
+        relevance (1 / rank) whose token cost fits the budget. The top-ranked
+        chunk is always kept when it fits (several cheap lower-ranked chunks
+        can outscore it); the knapsack fills the rest.
+        Costs are rounded up to 4-token units to keep the table small; the
+        result never exceeds the budget.
+        Returns: (selected chunks in rank order, tokens used)
+        """
+        if budget <= 0:
+            return [], 0
+        unit = 4
+        # Priced at the chunk's rank position, which is never less than the index it
+        # ends up with, so these costs bound the real ones; the total is recounted
+        costs = [self.chunk_prompt_tokens(c, i + 1) for i, c in enumerate(chunks)]
+        weights = [-(-cost // unit) for cost in costs]
+        capacity = budget // unit
+        keep = (0,) if chunks and weights[0] <= capacity else ()
+        if keep:
+            capacity -= weights[0]
+
+        # best[c] = (value, chosen indices) using at most c units
+        best = [(0.0, keep)] * (capacity + 1)
+        for i, weight in enumerate(weights[1:], start=1):
+            value = 1.0 / (i + 1)
+            for c in range(capacity, weight - 1, -1):
+                candidate = best[c - weight][0] + value
+                if candidate > best[c][0]:
+                    best[c] = (candidate, best[c - weight][1] + (i,))
+
+        selected = [chunks[i] for i in sorted(best[capacity][1])]
+        return selected, self.context_tokens(selected)
+
+    # Question shapes that need a long answer / a one-line fact (English and common Hindi forms)
+    LONG_INTENT = re.compile(
+        r"\b(summari[sz]e|summary|explain|describe|compare|comparison|difference|list|steps|procedure|"
+        r"overview|elaborate|in detail|detailed|how (to|do|does|can|should)|why|pros and cons|write|draft)\b|"
+        r"समझाइए|समझाओ|विस्तार|सारांश|तुलना|कैसे|क्यों",
+        re.IGNORECASE
+    )
+    SHORT_INTENT = re.compile(
+        r"^\s*(who|when|where|which|what is|what's|what are|how (many|much|old|long)|is|are|does|do|did|can|define|name)\b|"
+        r"कब|कौन|कहाँ|कहां|कितन",
+        re.IGNORECASE
+    )
+
+    @classmethod
+    def classify_intent(cls, query: str) -> str:
+        """
+        "short" (one fact), "long" (explanations, lists, summaries) or "normal".
+        """
+        if cls.LONG_INTENT.search(query):
+            return "long"
+        if len(query.split()) <= 12 and cls.SHORT_INTENT.search(query):
+            return "short"
+        return "normal"
+
+    def generation_budget(self, query: str, context_tokens: int, has_context: bool = True) -> int:
+        """
+        Max new tokens for this request, from the question's intent and how much
+        context was retrieved. With nothing retrieved the answer is a short
+        refusal whatever was asked.
+        """
+        if not DYNAMIC_BUDGET_ENABLED:
+            return LLM_MAX_TOKENS
+        intent = self.classify_intent(query)
+        if not has_context:
+            intent = "short"
+        elif intent == "normal" and context_tokens > LONG_CONTEXT_TOKENS:
+            intent = "long"
+        return GENERATION_BUDGETS[intent]
+
+    # Static system block. It never changes between requests, so LLMEngine can
+    # evaluate it once and reuse the KV cache (see LLMEngine.warm_prefix).
+    SYSTEM_PROMPT = (
+        "You are BharatEdge, an intelligent offline AI assistant.\n"
+        "1. GROUNDING: Use ONLY the provided context. If the context is empty or labeled WARNING, explain that you have no data to answer from.\n"
+        "2. CITATIONS: Use [doc_id] for every fact mentioned. You MUST use the provided context.\n"
+        "3. LANGUAGE: Answer in the EXACT same language as the user's question. (e.g., English -> English, Bengali -> Bengali). Do not switch languages unless asked.\n"
+        "4. FORMATTING: Use Markdown. Use bolding for key terms, bullet points for lists, and headers for structure. Make the response visually appealing.\n"
+        "5. SOURCE PICKER: If specific documents are filtered, prioritize them above all else.\n"
+    )
+
+    def build_prompt_prefix(self) -> str:
+        """
+        The cacheable part of every prompt. Ends on a special token boundary so
+        tokenizing prefix + suffix yields the prefix tokens unchanged.
+        """
+        return f"<|im_start|>system\n{self.SYSTEM_PROMPT}<|im_end|>\n"
+
+    @staticmethod
+    def format_citation(index: int, chunk: DocumentChunk) -> str:
+        # Text and DOCX files are numbered by logical section, not page
+        unit = "Page" if chunk.source.lower().endswith(".pdf") else "Section"
+        return f"[{index}] Source: {chunk.source} ({unit} {chunk.page})\n"
+
+    def format_context(self, context_chunks: List[DocumentChunk], sources: List[str] = None) -> str:
+        """
+        Format context with citations.
         """
-        # Format Context with Citations
         context_str = ""
         if not context_chunks:
             if sources:
@@ -56,19 +245,10 @@ class RAGEngine:
                 context_str = "No relevant context found in any indexed documents."
         else:
             for i, chunk in enumerate(context_chunks):
-                citation_ref = f"[{i+1}] Source: {chunk.source} (Page {chunk.page})"
-                context_str += f"{citation_ref}\n{chunk.text}\n\n"
-
-        # System Prompt
-        system_prompt = (
-            "You are BharatEdge, an intelligent offline AI assistant.\n"
-            "1. GROUNDING: Use ONLY the provided context. If the context is empty or labeled WARNING, explain that you have no data to answer from.\n"
-            "2. CITATIONS: Use [doc_id] for every fact mentioned. You MUST use the provided context.\n"
-            "3. LANGUAGE: Answer in the EXACT same language as the user's question. (e.g., English -> English, Bengali -> Bengali). Do not switch languages unless asked.\n"
-            "4. FORMATTING: Use Markdown. Use bolding for key terms, bullet points for lists, and headers for structure. Make the response visually appealing.\n"
-            "5. SOURCE PICKER: If specific documents are filtered, prioritize them above all else.\n"
-        )
-        
+                context_str += f"{self.format_citation(i+1, chunk)}{chunk.text}\n\n"
+        return context_str
+
+    def render_prompt_suffix(self, context_str: str, query: str, history: List[dict] = [], sources: List[str] = None) -> str:
         history_str = ""
         for turn in history[-1:]: 
             role = "User" if turn['role'] == 'user' else "Assistant"
@@ -76,38 +256,93 @@ class RAGEngine:
 
         source_hint = f"Note: User has filtered for: {', '.join(sources)}" if sources else "Analyzing all documents."
 
-        full_prompt = f"""<|im_start|>system
-{system_prompt}
-
+        return f"""<|im_start|>user
 {source_hint}
 
 Relevant Context:
-{context_str}<|im_end|>
-<|im_start|>user
+{context_str}
 {history_str}Question: {query}<|im_end|>
 <|im_start|>assistant
 """
-        return full_prompt
 
-    def query(self, message: str, history: List[dict] = [], sources: List[str] = None) -> Generator[str, None, None]:
+    def build_prompt_suffix(self, query: str, context_chunks: List[DocumentChunk], history: List[dict] = [], sources: List[str] = None) -> str:
+        """
+        The per-request part of the prompt: source hint, context, history and question.
+        """
+        return self.render_prompt_suffix(self.format_context(context_chunks, sources), query, history, sources)
+
+    def build_prompt(self, query: str, context_chunks: List[DocumentChunk], history: List[dict] = [], sources: List[str] = None) -> str:
+        """
+        Constructs the strict RAG prompt (static prefix + per-request suffix).
+        """
+        return self.build_prompt_prefix() + self.build_prompt_suffix(query, context_chunks, history, sources=sources)
+
+    def query(self, message: str, history: List[dict] = [], sources: List[str] = None, chunks: Optional[List[DocumentChunk]] = None, should_stop: Optional[Callable[[], bool]] = None) -> Generator[str, None, None]:
         """
         Main RAG pipeline execution.
+        Pass `chunks` from an earlier `retrieve_context` call to skip retrieval
+        (the /chat endpoint retrieves once and shares the result with citations).
+        `should_stop` lets the caller abort generation between tokens.
         """
-        # 1. Retrieve
-        chunks = self.retrieve_context(message, sources=sources)
+        if not self.llm_ready:
+            raise RuntimeError("LLM is not loaded. Check model files.")
+
+        # 1. Retrieve (only if the caller did not already do it)
+        if chunks is None:
+            chunks = self.retrieve_context(message, sources=sources, history=history)
         
         if not chunks:
              logger.warning(f"No context found for {sources or 'all documents'}. Prompt will be grounded but limited.")
 
-        # 2. Build Prompt
+        # 2. Semantic answer cache (opt-in): replay instead of generating
+        query_embedding = None
+        if self.answer_cache and self.vector_db.embedding_ready:
+            query_embedding = self.vector_db.embed_query(message)
+            cached_answer = self.answer_cache.lookup(query_embedding, chunks, sources, history)
+            if cached_answer is not None:
+                logger.info("Answer cache hit. Skipping generation.")
+                yield from self.replay_answer(cached_answer)
+                return
+
+        # 3. Build Prompt. With exact per-chunk counts its size is already known,
+        # so the LLM engine does not have to tokenize the full prompt a second time.
         prompt = self.build_prompt(message, chunks, history, sources=sources)
+        context_tokens = self.context_tokens(chunks)
+        if chunks and get_token_counter().exact:
+            prompt_tokens = self.prompt_overhead_tokens(message, history, sources) + context_tokens
+        else:
+            prompt_tokens = None
+        max_tokens = self.generation_budget(message, context_tokens, has_context=bool(chunks))
         
-        # 3. Generate
-        # 3. Generate with ChatML stop tokens
+        # 4. Generate with ChatML stop tokens
         stop_tokens = ["<|im_end|>", "<|im_start|>", "Question:", "User:"]
-        for piece in self.llm_engine.generate_response(prompt, stop=stop_tokens):
+        answer_parts = []
+        completed = False
+        for piece in self.llm_engine.generate_response(prompt, stop=stop_tokens, prompt_tokens=prompt_tokens, should_stop=should_stop, max_tokens=max_tokens):
+            if isinstance(piece, dict):
+                completed = piece.get("type") == "meta" and not piece.get("cancelled")
+            else:
+                answer_parts.append(piece)
             yield piece
 
+        # Only cache answers that finished normally (meta is the final event)
+        if self.answer_cache and completed and query_embedding is not None:
+            self.answer_cache.store(query_embedding, chunks, sources, history, "".join(answer_parts))
+
+    def replay_answer(self, answer: str) -> Generator[str, None, None]:
+        """
+        Stream a cached answer word by word, followed by a meta event marked cached.
+        """
+        start_time = time.time()
+        token_count = 0
+        for piece in re.findall(r"\S*\s*", answer):
+            if piece:
+                token_count += 1
+                yield piece
+        duration = time.time() - start_time
+        tps = token_count / duration if duration > 0 else 0
+        yield {"type": "meta", "tps": round(tps, 2), "duration": round(duration, 2), "cached": True}
+
     def validate_response(self, response_text: str, context_chunks: List[DocumentChunk]) -> dict:
         """
         Post-generation check:
@@ -153,11 +388,12 @@ Relevant Context:
              
         return result
 
-    def get_citations(self, message: str, sources: List[str] = None) -> List[DocumentChunk]:
+    def get_citations(self, message: str, sources: List[str] = None, chunks: Optional[List[DocumentChunk]] = None) -> List[DocumentChunk]:
         """
         Public expose for citations. Deduplicated by (source, page).
+        Reuses `chunks` when given instead of running retrieval again.
         """
-        raw_chunks = self.retrieve_context(message, sources=sources)
+        raw_chunks = chunks if chunks is not None else self.retrieve_context(message, sources=sources)
         
         seen = set()
         deduped = []
@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import List, Optional, Tuple
+from src.config import REGISTRY_PATH
+
+logger = logging.getLogger(__name__)
+
+class DocumentRegistry:
+    """
+    First-class record of every indexed document: ID, file hash, size, page and
+    chunk counts, ingest/update times. Held in memory (sorted by name for
+    paging) and persisted as one JSON file.
+    A document's chunk IDs live in its manifest (see VectorDBClient.load_manifest).
+    """
+
+    def __init__(self, path: str = REGISTRY_PATH):
+        self.path = path
+        self.documents = {}
+        self.lock = threading.Lock()
+        self.sorted_names = None  # rebuilt lazily after changes
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.documents = {d["source"]: d for d in json.load(f)["documents"]}
+            except Exception as e:
+                logger.warning(f"Corrupt document registry, starting empty: {e}")
+        logger.info(f"Document registry: {len(self.documents)} documents.")
+
+    @staticmethod
+    def document_id(source: str) -> str:
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def file_hash(file_path: str) -> str:
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"documents": list(self.documents.values())}, f)
+        os.replace(tmp_path, self.path)
+
+    def update(self, source: str, **fields) -> dict:
+        """
+        Create or update a document's record and persist the registry.
+        """
+        now = time.time()
+        with self.lock:
+            doc = self.documents.get(source)
+            if doc is None:
+                doc = {
+                    "doc_id": self.document_id(source),
+                    "source": source,
+                    "file_hash": None,
+                    "size_bytes": None,
+                    "pages": None,
+                    "chunks": 0,
+                    "ingested_at": now,
+                    "updated_at": now
+                }
+                self.documents[source] = doc
+                self.sorted_names = None
+            doc.update(fields)
+            doc["updated_at"] = now
+            self._save()
+            return dict(doc)
+
+    def remove(self, source: str):
+        with self.lock:
+            if self.documents.pop(source, None) is not None:
+                self.sorted_names = None
+                self._save()
+
+    def get(self, source: str) -> Optional[dict]:
+        with self.lock:
+            doc = self.documents.get(source)
+            return dict(doc) if doc else None
+
+    def __contains__(self, source: str) -> bool:
+        return source in self.documents
+
+    def chunk_count(self, sources: List[str]) -> int:
+        with self.lock:
+            return sum(self.documents[s]["chunks"] for s in sources if s in self.documents)
+
+    def page(self, offset: int = 0, limit: Optional[int] = 100, query: Optional[str] = None) -> Tuple[List[dict], int]:
+        """
+        One page of documents sorted by name, optionally filtered by a
+        case-insensitive substring (limit=None for everything from `offset`).
+        Returns (page, total matching).
+        """
+        with self.lock:
+            if self.sorted_names is None:
+                self.sorted_names = sorted(self.documents, key=str.lower)
+            names = self.sorted_names
+            if query:
+                needle = query.lower()
+                names = [n for n in names if needle in n.lower()]
+            names_page = names[offset:offset + limit] if limit else names[offset:]
+            return [dict(self.documents[n]) for n in names_page], len(names)
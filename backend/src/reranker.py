@@ -0,0 +1,139 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Optional
+import numpy as np
+from src.models import DocumentChunk
+from src.config import (
+    RERANKER_ONNX_PATH,
+    RERANKER_MODEL_DIR,
+    RERANKER_MAX_SEQ_LENGTH,
+    RERANKER_TIMEOUT_MS,
+    EMBEDDING_THREADS
+)
+
+logger = logging.getLogger(__name__)
+
+class CrossEncoderReranker:
+    """
+    int8 ONNX cross-encoder (ms-marco-MiniLM-L-6-v2) that re-scores retrieval
+    candidates against the query in a single batch.
+
+    Scoring has a hard latency cap: when it runs over, ONNX Runtime is told to
+    terminate the run and the caller keeps the retrieval order.
+    Export the model once with scripts/export_onnx_reranker.py.
+    """
+
+    def __init__(
+        self,
+        onnx_path: str = RERANKER_ONNX_PATH,
+        model_dir: str = RERANKER_MODEL_DIR,
+        max_seq_length: int = RERANKER_MAX_SEQ_LENGTH,
+        threads: int = EMBEDDING_THREADS
+    ):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.ort = ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        # Truncate the chunk, never the query
+        self.tokenizer.enable_truncation(max_length=max_seq_length, strategy="only_second")
+        self.tokenizer.enable_padding()
+
+        # One scoring run at a time; a timed-out run is terminated, not abandoned
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker")
+        self.run_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.runs = 0
+        self.timeouts = 0
+        self.total_ms = 0.0
+
+    def score(self, query: str, texts: List[str], run_options=None) -> np.ndarray:
+        encoded = self.tokenizer.encode_batch([(query, t) for t in texts])
+        feeds = {
+            "input_ids": np.array([e.ids for e in encoded], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encoded], dtype=np.int64)
+        }
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encoded], dtype=np.int64)
+        logits = self.session.run(None, feeds, run_options)[0]
+        return logits.reshape(len(texts), -1)[:, 0]
+
+    def rerank(self, query: str, chunks: List[DocumentChunk], timeout_ms: float = RERANKER_TIMEOUT_MS) -> Optional[List[DocumentChunk]]:
+        """
+        Chunks sorted by cross-encoder relevance (score = logit), or None when
+        scoring failed or exceeded `timeout_ms`.
+        """
+        if not chunks:
+            return chunks
+        run_options = self.ort.RunOptions()
+        start = time.time()
+        # Waiting behind another query's run counts against the cap too
+        if not self.run_lock.acquire(timeout=timeout_ms / 1000):
+            self._record(start, timed_out=True)
+            return None
+        try:
+            future = self.executor.submit(self.score, query, [c.text for c in chunks], run_options)
+            remaining = max(0.0, timeout_ms / 1000 - (time.time() - start))
+            try:
+                scores = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                run_options.terminate = True
+                logger.warning(f"Re-ranking exceeded {timeout_ms:.0f}ms for {len(chunks)} chunks. Keeping retrieval order.")
+                try:
+                    future.result()  # Returns promptly once terminated
+                except Exception:
+                    pass
+                self._record(start, timed_out=True)
+                return None
+            except Exception as e:
+                logger.error(f"Re-ranking failed, keeping retrieval order: {e}")
+                self._record(start)
+                return None
+        finally:
+            self.run_lock.release()
+
+        elapsed_ms = self._record(start)
+        order = np.argsort(-scores, kind="stable")
+        logger.info(f"Re-ranked {len(chunks)} chunks in {elapsed_ms:.0f}ms.")
+        return [chunks[i].model_copy(update={"score": float(scores[i])}) for i in order]
+
+    def _record(self, start: float, timed_out: bool = False) -> float:
+        elapsed_ms = (time.time() - start) * 1000
+        with self.lock:
+            self.runs += 1
+            self.timeouts += int(timed_out)
+            self.total_ms += elapsed_ms
+        return elapsed_ms
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "runs": self.runs,
+                "timeouts": self.timeouts,
+                "avg_ms": round(self.total_ms / self.runs, 1) if self.runs else None
+            }
+
+def get_reranker() -> Optional[CrossEncoderReranker]:
+    """
+    Build the re-ranker if the exported model is present; None disables re-ranking.
+    """
+    if not os.path.exists(RERANKER_ONNX_PATH):
+        logger.info(f"Re-ranker model not found at {RERANKER_ONNX_PATH}. Run scripts/export_onnx_reranker.py to enable re-ranking.")
+        return None
+    try:
+        reranker = CrossEncoderReranker()
+        logger.info(f"Re-ranker: onnx ({RERANKER_ONNX_PATH})")
+        return reranker
+    except Exception as e:
+        logger.warning(f"Re-ranker unavailable, using retrieval order: {e}")
+        return None
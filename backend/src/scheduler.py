@@ -0,0 +1,188 @@
+import time
+import uuid
+import heapq
+import logging
+import threading
+from collections import deque
+from typing import Generator, Optional
+from src.config import GEN_QUEUE_SIZE, GEN_DEADLINE_SECONDS, GEN_METRICS_WINDOW, BATCH_MAX_SEQUENCES
+
+logger = logging.getLogger(__name__)
+
+class QueueFullError(Exception):
+    """Raised when the generation queue cannot admit another request."""
+
+class DeadlineExceededError(Exception):
+    """Raised when a request's deadline passes before it gets the model."""
+
+class GenerationTicket:
+    """
+    One /chat request's place in the generation queue.
+    """
+
+    def __init__(self, priority: int, deadline: float, seq: int):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.priority = priority
+        self.deadline = deadline
+        self.seq = seq
+        self.enqueued_at = time.time()
+        self.started_at = None
+        self.first_token_at = None
+        self.cancelled = False
+
+    def __lt__(self, other):
+        # Lower priority value first, FIFO within the same priority
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    def should_stop(self) -> bool:
+        return self.cancelled or time.time() > self.deadline
+
+class GenerationScheduler:
+    """
+    Admission control in front of the single llama.cpp instance.
+    Requests wait in a bounded priority queue and get the model one at a time
+    (or up to `max_active` at once when continuous batching is on), so
+    concurrent chats never share a llama context unsafely. Queue wait,
+    time-to-first-token and tokens/sec are recorded for every request.
+    """
+
+    def __init__(self, max_queue: int = GEN_QUEUE_SIZE, max_active: int = max(1, BATCH_MAX_SEQUENCES)):
+        self.max_queue = max_queue
+        self.max_active = max_active
+        self.queue = []
+        self.active = set()
+        self.tickets = {}  # request_id -> ticket, for explicit cancellation
+        self.seq = 0
+        self.cond = threading.Condition()
+        self.metrics = deque(maxlen=GEN_METRICS_WINDOW)
+        self.rejected = 0
+
+    def submit(self, priority: int = 0, deadline_seconds: Optional[float] = None) -> GenerationTicket:
+        """
+        Admit a request or raise QueueFullError.
+        """
+        with self.cond:
+            if len(self.queue) >= self.max_queue:
+                self.rejected += 1
+                raise QueueFullError(f"Generation queue is full ({self.max_queue} waiting). Please retry shortly.")
+            self.seq += 1
+            ticket = GenerationTicket(priority, time.time() + (deadline_seconds or GEN_DEADLINE_SECONDS), self.seq)
+            heapq.heappush(self.queue, ticket)
+            self.tickets[ticket.request_id] = ticket
+            return ticket
+
+    def position(self, ticket: GenerationTicket) -> int:
+        """
+        1-based queue position; 0 once the ticket holds the model.
+        """
+        with self.cond:
+            if ticket in self.active:
+                return 0
+            return sorted(self.queue).index(ticket) + 1 if ticket in self.queue else 0
+
+    def wait(self, ticket: GenerationTicket, poll_seconds: float = 0.5) -> Generator[int, None, None]:
+        """
+        Block until the ticket gets the model, yielding its queue position
+        whenever it changes (including the first). Raises DeadlineExceededError
+        if the deadline passes or the ticket is cancelled while queued.
+        """
+        last_position = None
+        with self.cond:
+            while True:
+                if ticket.should_stop():
+                    self._remove(ticket)
+                    raise DeadlineExceededError("Request cancelled" if ticket.cancelled else "Request deadline exceeded while queued")
+                if len(self.active) < self.max_active and self.queue and self.queue[0] is ticket:
+                    heapq.heappop(self.queue)
+                    self.active.add(ticket)
+                    ticket.started_at = time.time()
+                    return
+                position = sorted(self.queue).index(ticket) + 1
+                if position != last_position:
+                    last_position = position
+                    # Report outside the lock so other requests can progress
+                    self.cond.release()
+                    try:
+                        yield position
+                    finally:
+                        self.cond.acquire()
+                    continue
+                self.cond.wait(timeout=poll_seconds)
+
+    def mark_first_token(self, ticket: GenerationTicket):
+        if ticket.first_token_at is None:
+            ticket.first_token_at = time.time()
+
+    def cancel(self, ticket: GenerationTicket):
+        with self.cond:
+            ticket.cancelled = True
+            self.cond.notify_all()
+
+    def cancel_request(self, request_id: str) -> bool:
+        """
+        Cancel by request ID (queued or running). False if unknown or finished.
+        """
+        with self.cond:
+            ticket = self.tickets.get(request_id)
+        if ticket is None:
+            return False
+        self.cancel(ticket)
+        return True
+
+    def release(self, ticket: GenerationTicket, token_count: int = 0) -> dict:
+        """
+        Free the model (or drop a queued ticket) and record the request's metrics.
+        """
+        now = time.time()
+        with self.cond:
+            if ticket in self.active:
+                self.active.discard(ticket)
+            else:
+                self._remove(ticket)
+            self.tickets.pop(ticket.request_id, None)
+            self.cond.notify_all()
+
+        started = ticket.started_at or now
+        metric = {
+            "request_id": ticket.request_id,
+            "queue_wait_ms": round((started - ticket.enqueued_at) * 1000, 1),
+            "ttft_ms": round((ticket.first_token_at - started) * 1000, 1) if ticket.first_token_at else None,
+            "tps": round(token_count / (now - ticket.first_token_at), 2) if ticket.first_token_at and now > ticket.first_token_at else None,
+            "tokens": token_count,
+            "cancelled": ticket.cancelled
+        }
+        if ticket.started_at:
+            self.metrics.append(metric)
+        logger.info(f"Request {ticket.request_id}: wait {metric['queue_wait_ms']}ms, TTFT {metric['ttft_ms']}ms, {metric['tps']} t/s")
+        return metric
+
+    def _remove(self, ticket: GenerationTicket):
+        if ticket in self.queue:
+            self.queue.remove(ticket)
+            heapq.heapify(self.queue)
+            self.cond.notify_all()
+
+    @staticmethod
+    def _percentiles(values: list) -> dict:
+        if not values:
+            return {"p50": None, "p90": None, "p99": None}
+        values = sorted(values)
+        pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+        return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99)}
+
+    def stats(self) -> dict:
+        with self.cond:
+            metrics = list(self.metrics)
+            queued = len(self.queue)
+            active = len(self.active)
+        return {
+            "queued": queued,
+            "active": active,
+            "max_active": self.max_active,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "completed": len(metrics),
+            "queue_wait_ms": self._percentiles([m["queue_wait_ms"] for m in metrics]),
+            "ttft_ms": self._percentiles([m["ttft_ms"] for m in metrics if m["ttft_ms"] is not None]),
+            "tps": self._percentiles([m["tps"] for m in metrics if m["tps"] is not None])
+        }
@@ -0,0 +1,114 @@
+import os
+import logging
+from typing import Optional
+import numpy as np
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+from src.config import SPECULATIVE_MODE, SPECULATIVE_DRAFT_TOKENS, PROMPT_LOOKUP_NGRAM, DRAFT_MODEL_PATH, N_GPU_LAYERS
+
+logger = logging.getLogger(__name__)
+
+class GGUFDraftModel(LlamaDraftModel):
+    """
+    Greedy drafts from a small GGUF model that shares the main model's
+    vocabulary (e.g. Qwen2.5-0.5B for Qwen2.5-3B). Its KV cache follows the
+    main sequence: only tokens it has not seen yet are evaluated each call.
+    """
+
+    def __init__(self, model_path: str, n_ctx: int, n_threads: int, num_pred_tokens: int = SPECULATIVE_DRAFT_TOKENS):
+        self.num_pred_tokens = num_pred_tokens
+        self.llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, n_batch=512,
+                         n_gpu_layers=N_GPU_LAYERS, verbose=False)
+
+    def _sync(self, input_ids: np.ndarray):
+        # Reuse the longest common prefix and drop the rest of the draft KV cache
+        cached = self.llm.input_ids[:self.llm.n_tokens]
+        n = min(len(cached), len(input_ids))
+        mismatch = np.nonzero(cached[:n] != input_ids[:n])[0]
+        keep = int(mismatch[0]) if len(mismatch) else n
+        keep = min(keep, len(input_ids) - 1)  # Re-evaluate at least one token to get fresh logits
+        self.llm._ctx.kv_cache_seq_rm(-1, keep, -1)
+        self.llm.n_tokens = keep
+        self.llm.eval(input_ids[keep:].tolist())
+
+    def __call__(self, input_ids: np.ndarray, /, **kwargs) -> np.ndarray:
+        room = self.llm.n_ctx() - len(input_ids) - 1
+        if room <= 0:
+            return np.array([], dtype=np.intc)
+        self._sync(input_ids)
+        draft = []
+        for _ in range(min(self.num_pred_tokens, room)):
+            token = int(np.argmax(self.llm.scores[self.llm.n_tokens - 1]))
+            if token == self.llm.token_eos():
+                break
+            draft.append(token)
+            self.llm.eval([token])
+        return np.array(draft, dtype=np.intc)
+
+class TrackedDraft(LlamaDraftModel):
+    """
+    Wraps a draft model and measures its acceptance rate. llama-cpp-python
+    calls the draft model with the sequence so far; the tokens appended since
+    the previous call start with the accepted part of the previous draft.
+    """
+
+    def __init__(self, inner: LlamaDraftModel, mode: str):
+        self.inner = inner
+        self.mode = mode
+        self.begin()
+
+    @property
+    def n_vocab(self) -> Optional[int]:
+        """
+        Vocabulary size of a GGUF draft (it must match the main model's); None for prompt lookup.
+        """
+        return self.inner.llm.n_vocab() if isinstance(self.inner, GGUFDraftModel) else None
+
+    def begin(self):
+        """
+        Reset per-request counters (call before each generation).
+        """
+        self.proposed = 0
+        self.accepted = 0
+        self.last_len = None
+        self.last_draft = None
+
+    def __call__(self, input_ids: np.ndarray, /, **kwargs) -> np.ndarray:
+        if self.last_draft is not None and len(self.last_draft) and len(input_ids) > self.last_len:
+            appended = input_ids[self.last_len:self.last_len + len(self.last_draft)]
+            matches = appended == self.last_draft[:len(appended)]
+            self.proposed += len(self.last_draft)
+            self.accepted += int(np.argmin(matches)) if not matches.all() else len(appended)
+        draft = self.inner(input_ids, **kwargs)
+        self.last_len = len(input_ids)
+        self.last_draft = draft
+        return draft
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "proposed": self.proposed,
+            "accepted": self.accepted,
+            "acceptance_rate": round(self.accepted / self.proposed, 3) if self.proposed else None
+        }
+
+def build_draft_model(n_ctx: int, n_threads: int, mode: str = SPECULATIVE_MODE) -> Optional[TrackedDraft]:
+    """
+    Draft model for SPECULATIVE_MODE: "prompt_lookup" (n-grams from the prompt,
+    free, strong for RAG answers that quote the context) or "draft" (a small
+    GGUF). None when disabled or unavailable. Built before the main model,
+    which takes it as draft_model; the caller checks a GGUF draft's n_vocab
+    against the main model once that is loaded.
+    """
+    if mode == "prompt_lookup":
+        inner = LlamaPromptLookupDecoding(max_ngram_size=PROMPT_LOOKUP_NGRAM, num_pred_tokens=SPECULATIVE_DRAFT_TOKENS)
+    elif mode == "draft":
+        if not os.path.exists(DRAFT_MODEL_PATH):
+            logger.warning(f"Draft model not found at {DRAFT_MODEL_PATH}. Speculative decoding disabled.")
+            return None
+        # Drafting and verification alternate, so the draft can use the same threads
+        inner = GGUFDraftModel(DRAFT_MODEL_PATH, n_ctx=n_ctx, n_threads=n_threads)
+    else:
+        return None
+    logger.info(f"Speculative decoding enabled: {mode}, {SPECULATIVE_DRAFT_TOKENS} draft tokens per step.")
+    return TrackedDraft(inner, mode)
@@ -0,0 +1,94 @@
+import time
+import logging
+import threading
+from typing import Callable, Dict, List
+from src.config import STARTUP_ORDER
+
+logger = logging.getLogger(__name__)
+
+class StartupComponent:
+    """
+    One independently loadable part of the backend (vector DB, embedder, LLM).
+    """
+
+    def __init__(self, name: str, loader: Callable[[], bool], requires: List[str]):
+        self.name = name
+        self.loader = loader
+        self.requires = requires
+        self.status = "pending"   # pending -> loading -> ready | missing | error
+        self.load_seconds = None
+        self.error = None
+        self.lock = threading.Lock()
+
+class StartupManager:
+    """
+    Staged startup: the HTTP server comes up immediately and components are
+    warmed in the background in STARTUP_ORDER. A request that needs a component
+    before the warm-up reaches it loads it on demand (`ensure`); concurrent
+    callers wait for the same load instead of starting another.
+    Loaders return False when their model files are missing.
+    """
+
+    def __init__(self, order: List[str] = STARTUP_ORDER):
+        self.order = order
+        self.components: Dict[str, StartupComponent] = {}
+        self.thread = None
+
+    def register(self, name: str, loader: Callable[[], bool], requires: List[str] = ()):
+        self.components[name] = StartupComponent(name, loader, list(requires))
+
+    def start(self):
+        """
+        Warm all components in a background thread.
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._warm, name="startup", daemon=True)
+            self.thread.start()
+
+    def _warm(self):
+        started = time.time()
+        order = [name for name in self.order if name in self.components]
+        order += [name for name in self.components if name not in order]
+        for name in order:
+            self.ensure(name)
+        logger.info(f"Startup warm-up finished in {time.time() - started:.2f}s: {self.summary()}")
+
+    def ensure(self, name: str, retry: bool = False) -> bool:
+        """
+        Load a component (and its requirements) if needed. Blocks until it is
+        loaded. Failed or missing components are only retried with retry=True
+        (e.g. after /setup/init downloaded the models).
+        """
+        component = self.components[name]
+        if component.status == "ready":
+            return True
+        for requirement in component.requires:
+            if not self.ensure(requirement, retry=retry):
+                return False
+
+        with component.lock:
+            if component.status == "ready":
+                return True
+            if component.status in ("missing", "error") and not retry:
+                return False
+            component.status = "loading"
+            component.error = None
+            start = time.time()
+            try:
+                component.status = "ready" if component.loader() is not False else "missing"
+            except Exception as e:
+                logger.error(f"Failed to load {name}: {e}")
+                component.status = "error"
+                component.error = str(e)
+            component.load_seconds = round(time.time() - start, 3)
+            logger.info(f"Startup: {name} {component.status} in {component.load_seconds}s")
+            return component.status == "ready"
+
+    def is_ready(self, name: str) -> bool:
+        return self.components[name].status == "ready"
+
+    def summary(self) -> dict:
+        return {
+            name: {"status": c.status, "load_seconds": c.load_seconds, "error": c.error}
+            for name, c in self.components.items()
+        }
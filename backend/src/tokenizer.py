@@ -0,0 +1,52 @@
+import os
+import logging
+import threading
+from src.config import LLM_MODEL_PATH
+
+logger = logging.getLogger(__name__)
+
+class TokenCounter:
+    """
+    Exact token counts using the GGUF model's own tokenizer, loaded vocab-only
+    (no weights, no KV cache) so ingestion can count tokens cheaply.
+    Falls back to a conservative UTF-8 byte estimate when the model is missing;
+    Indic scripts take 3 bytes per character, which matches Qwen's denser
+    tokenization far better than a characters/3 rule.
+    """
+
+    def __init__(self, model_path: str = LLM_MODEL_PATH):
+        self.vocab = None
+        self.name = None  # set when counts are exact; stored next to persisted counts
+        self.model_missing = not os.path.exists(model_path)
+        if self.model_missing:
+            logger.warning(f"Model not found at {model_path}. Token counts will be estimated.")
+            return
+        try:
+            from llama_cpp import Llama
+            self.vocab = Llama(model_path=model_path, vocab_only=True, verbose=False)
+            self.name = os.path.basename(model_path)
+        except Exception as e:
+            logger.warning(f"Failed to load tokenizer vocabulary, estimating token counts: {e}")
+
+    @property
+    def exact(self) -> bool:
+        return self.vocab is not None
+
+    def count(self, text: str) -> int:
+        if self.vocab is not None:
+            return len(self.vocab.tokenize(text.encode('utf-8'), add_bos=False, special=True))
+        return -(-len(text.encode('utf-8')) // 3)
+
+_token_counter = None
+_token_counter_lock = threading.Lock()
+
+def get_token_counter() -> TokenCounter:
+    """
+    Shared TokenCounter, created on first use.
+    """
+    global _token_counter
+    with _token_counter_lock:
+        # Retry once the model has been downloaded (e.g. after /setup/init)
+        if _token_counter is None or (_token_counter.model_missing and os.path.exists(LLM_MODEL_PATH)):
+            _token_counter = TokenCounter()
+        return _token_counter
@@ -1,53 +1,363 @@
 import chromadb
 from chromadb.config import Settings
+import os
+import json
+import time
+import hashlib
 import logging
-from typing import List
-from src.config import DB_DIR, EMBEDDING_CACHE_DIR, EMBEDDING_MODEL_NAME
+import threading
+from typing import List, Dict, Tuple, Iterable, Iterator, Callable, Optional
+import numpy as np
+from src.config import DB_DIR, EMBEDDING_CACHE_DIR, EMBEDDING_MODEL_NAME, MANIFEST_DIR, INGEST_BATCH_SIZE, QUERY_EMBEDDING_CACHE_SIZE, RETRIEVAL_CACHE_SIZE, FILTERED_SEARCH_MAX_CHUNKS, DOCUMENT_EMBEDDING_CACHE_DOCS, INDEX_BACKFILL_MARKER, BACKFILL_PAGE_SIZE
 from src.models import DocumentChunk
+from src.embeddings import EmbeddingEngine, get_embedding_engine
+from src.cache import LRUCache
+from src.lexical_index import LexicalIndex
+from src.registry import DocumentRegistry
+from src.tokenizer import get_token_counter
 
 # Initialize Logger
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class VectorDBClient:
-    def __init__(self):
+    def __init__(self, embedding_fn: Optional[EmbeddingEngine] = None):
         """
-        Initialize ChromaDB persistent client and embedding function.
+        Initialize ChromaDB persistent client. The embedding model can be
+        attached later (see attach_embedder): embeddings are always passed to
+        Chroma explicitly, so the collection itself never needs it, and BM25
+        search works before the model has loaded.
         """
         logger.info(f"Initializing VectorDB at {DB_DIR}")
         self.client = chromadb.PersistentClient(path=DB_DIR)
         
-        # Use sentence-transformers for embeddings
-        from chromadb.utils import embedding_functions
-        self.embedding_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name=EMBEDDING_MODEL_NAME
-        )
+        # Pluggable embedding backend (ONNX int8 or sentence-transformers)
+        self.embedding_fn = embedding_fn
         
         self.collection = self.client.get_or_create_collection(
             name="bharat_edge_docs",
-            embedding_function=self.embedding_fn
+            embedding_function=None
         )
 
-    def add_documents(self, chunks: List[str], metadatas: List[dict]):
+        # Query caches. The generation counter is part of every retrieval key,
+        # so bumping it on add/delete makes stale results unreachable.
+        self.index_generation = 0
+        self.source_generations = {}
+        self.generation_lock = threading.Lock()
+        self.query_embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE, sizeof=lambda v: 4 * len(v))
+        self.retrieval_cache = LRUCache(RETRIEVAL_CACHE_SIZE, sizeof=lambda chunks: sum(len(c.text) + 64 for c in chunks))
+
+        # BM25 index maintained alongside the collection for exact-term matches
+        self.lexical_index = LexicalIndex()
+        # Document records; their chunk ID sets drive source-filtered search
+        self.registry = DocumentRegistry()
+        self.document_embeddings = LRUCache(DOCUMENT_EMBEDDING_CACHE_DOCS, sizeof=lambda entry: entry[1].nbytes)
+        self._backfill_indexes()
+
+    def _backfill_indexes(self):
+        """
+        One-time migration for documents indexed before manifests, the
+        registry and BM25 existed: Chroma is the only record of them, so the
+        sources are read from its metadata and each gets whatever it lacks.
+        Runs until every source succeeds, then INDEX_BACKFILL_MARKER skips it.
+        """
+        if os.path.exists(INDEX_BACKFILL_MARKER):
+            return
+        # Pass 1: distinct sources and their last page, from metadata only
+        pages: Dict[str, int] = {}
+        offset = 0
+        while True:
+            rows = self.collection.get(include=["metadatas"], limit=BACKFILL_PAGE_SIZE, offset=offset)
+            for meta in rows["metadatas"]:
+                if meta and meta.get("source"):
+                    source = meta["source"]
+                    pages[source] = max(pages.get(source, 0), meta.get("page_end", meta.get("page", 0)) or 0)
+            if len(rows["ids"]) < BACKFILL_PAGE_SIZE:
+                break
+            offset += BACKFILL_PAGE_SIZE
+
+        failed = 0
+        for source, last_page in pages.items():
+            has_manifest = os.path.exists(self._manifest_path(source))
+            has_segment = self.lexical_index.has_document(source)
+            if has_manifest and has_segment and source in self.registry:
+                continue
+            try:
+                self._backfill_document(source, last_page, has_manifest, has_segment)
+            except Exception as e:
+                failed += 1
+                logger.warning(f"Failed to backfill indexes for {source}: {e}")
+        if failed:
+            logger.warning(f"Index backfill incomplete ({failed} documents failed); retrying next start.")
+            return
+        with open(INDEX_BACKFILL_MARKER, "w", encoding="utf-8") as f:
+            json.dump({"documents": len(pages), "completed_at": time.time()}, f)
+        logger.info(f"Index backfill complete for {len(pages)} documents.")
+
+    def _backfill_document(self, source: str, last_page: int, has_manifest: bool, has_segment: bool):
+        """
+        Page one document's chunks out of Chroma into a BM25 segment and
+        write the manifest and registry record it is missing.
+        """
+        segment = self.lexical_index.writer(source)
+        try:
+            offset = 0
+            while True:
+                rows = self.collection.get(where={"source": source}, include=["documents"], limit=BACKFILL_PAGE_SIZE, offset=offset)
+                for cid, text in zip(rows["ids"], rows["documents"]):
+                    segment.add(cid, text=text or "")
+                if len(rows["ids"]) < BACKFILL_PAGE_SIZE:
+                    break
+                offset += BACKFILL_PAGE_SIZE
+            if not has_manifest:
+                self.save_manifest(source, segment.chunk_ids())
+            if source not in self.registry:
+                self.registry.update(source, chunks=segment.n_docs, pages=last_page or None)
+            n_chunks = segment.n_docs
+            if has_segment:
+                segment.abort()
+            else:
+                self.lexical_index.commit(segment)
+        except BaseException:
+            segment.abort()
+            raise
+        logger.info(f"Backfilled indexes for {source} ({n_chunks} chunks).")
+
+    def attach_embedder(self, embedding_fn: Optional[EmbeddingEngine] = None):
+        """
+        Load (or set) the embedding model. Until then only BM25 search is available.
+        """
+        self.embedding_fn = embedding_fn or get_embedding_engine()
+
+    @property
+    def embedding_ready(self) -> bool:
+        return self.embedding_fn is not None
+
+    def _require_embedder(self):
+        if self.embedding_fn is None:
+            raise RuntimeError("Embedding model is still loading. Please retry shortly.")
+
+    @staticmethod
+    def chunk_id(chunk: str, meta: dict, seen: Dict[str, int]) -> str:
+        """
+        Stable, content-addressed ID: source + page + digest of the chunk text.
+        Identical text repeated on the same page gets an occurrence suffix,
+        tracked in `seen` across calls for the same document.
+        """
+        digest = hashlib.sha256(chunk.encode('utf-8')).hexdigest()[:16]
+        base_id = f"{meta['source']}::p{meta.get('page', 0)}::{digest}"
+        n = seen.get(base_id, 0)
+        seen[base_id] = n + 1
+        return base_id if n == 0 else f"{base_id}::{n}"
+
+    @staticmethod
+    def make_chunk_ids(chunks: List[str], metadatas: List[dict]) -> List[str]:
+        seen = {}
+        return [VectorDBClient.chunk_id(c, m, seen) for c, m in zip(chunks, metadatas)]
+
+    def _manifest_path(self, source: str) -> str:
+        name = hashlib.sha256(source.encode('utf-8')).hexdigest()[:24]
+        return os.path.join(MANIFEST_DIR, f"{name}.json")
+
+    def load_manifest(self, source: str) -> List[str]:
+        """
+        Chunk IDs currently stored for a document. Falls back to asking Chroma
+        for documents indexed before manifests existed.
+        """
+        path = self._manifest_path(source)
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    return json.load(f)["chunk_ids"]
+            except Exception as e:
+                logger.warning(f"Corrupt manifest for {source}, rebuilding from index: {e}")
+        existing = self.collection.get(where={"source": source}, include=[])
+        return existing['ids']
+
+    def save_manifest(self, source: str, chunk_ids: Iterable[str]):
+        """
+        Write the manifest, streaming `chunk_ids` so a large document's IDs
+        never need to be in memory at once.
+        """
+        path = self._manifest_path(source)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"source": source, "updated_at": time.time()})[:-1] + ', "chunk_ids": [')
+            for n, cid in enumerate(chunk_ids):
+                f.write((", " if n else "") + json.dumps(cid))
+            f.write("]}")
+        os.replace(tmp_path, path)
+
+    def add_documents(self, chunks: List[str], metadatas: List[dict]) -> Dict[str, int]:
         """
-        Embed and store document chunks.
+        Embed and store document chunks incrementally.
+        Only new or changed chunks are embedded; chunks that disappeared from
+        a re-uploaded document are deleted and unchanged ones are skipped.
         
         Args:
-            chunks: List of text strings
+            chunks: List of text strings (all chunks of each document)
             metadatas: List of dicts with 'source', 'page'
+        Returns:
+            Counts of added, deleted and unchanged chunks.
         """
-        ids = [f"id_{i}_{hash(c)}" for i, c in enumerate(chunks)]
-        self.collection.upsert(
-            documents=chunks,
-            metadatas=metadatas,
-            ids=ids
-        )
-        logger.info(f"Upserted {len(chunks)} chunks.")
+        stats = {"added": 0, "deleted": 0, "unchanged": 0}
+
+        # Group by source so each document is diffed against its own manifest
+        by_source: Dict[str, List[Tuple[str, dict]]] = {}
+        for chunk, meta in zip(chunks, metadatas):
+            by_source.setdefault(meta['source'], []).append((chunk, meta))
+
+        for source, items in by_source.items():
+            source_stats = self.add_document_stream(source, iter(items))
+            for key in stats:
+                stats[key] += source_stats[key]
+
+        return stats
+
+    def add_document_stream(
+        self,
+        source: str,
+        chunk_iter: Iterator[Tuple[str, dict]],
+        batch_size: int = INGEST_BATCH_SIZE,
+        on_stage: Optional[Callable[[str], None]] = None,
+        on_batch: Optional[Callable[[Dict[str, int]], None]] = None
+    ) -> Dict[str, int]:
+        """
+        Streaming variant of add_documents for a single document.
+        Pulls (chunk, metadata) pairs lazily and embeds + upserts new ones in
+        micro-batches of `batch_size`. The iterator is only advanced when the
+        current batch has room, so peak memory depends on batch size rather
+        than document size.
+        
+        Args:
+            on_stage: callback(stage) on switching between 'parse', 'embed' and 'index'
+            on_batch: callback(stats) after each committed batch
+        Returns:
+            Counts of added, deleted and unchanged chunks.
+        """
+        self._require_embedder()
+        old_ids = set(self.load_manifest(source))
+        stale = set(old_ids)  # shrinks to the IDs the new version no longer has
+        seen = {}
+        # The BM25 segment is built as chunks stream past, spilling to disk,
+        # so neither the ID list nor the term counts are held for the whole document
+        segment = self.lexical_index.writer(source)
+        stats = {"added": 0, "deleted": 0, "unchanged": 0, "batches": 0}
+        batch_ids, batch_docs, batch_metas = [], [], []
+
+        def flush():
+            if not batch_docs:
+                return
+            # Embed explicitly (instead of inside upsert) so embed and index are separate stages
+            if on_stage:
+                on_stage("embed")
+            embeddings = self.embedding_fn(batch_docs)
+            if on_stage:
+                on_stage("index")
+            self.collection.upsert(
+                documents=batch_docs,
+                embeddings=embeddings,
+                metadatas=batch_metas,
+                ids=batch_ids
+            )
+            self.bump_generation(source)
+            stats["added"] += len(batch_docs)
+            stats["batches"] += 1
+            batch_ids.clear()
+            batch_docs.clear()
+            batch_metas.clear()
+            if on_batch:
+                on_batch(dict(stats))
+            if on_stage:
+                on_stage("parse")
+
+        try:
+            for chunk, meta in chunk_iter:
+                cid = self.chunk_id(chunk, meta, seen)
+                segment.add(cid, text=chunk)
+                stale.discard(cid)
+                if cid in old_ids:
+                    stats["unchanged"] += 1
+                    continue
+                batch_ids.append(cid)
+                batch_docs.append(chunk)
+                batch_metas.append(meta)
+                if len(batch_docs) >= batch_size:
+                    flush()
+            flush()
+
+            to_delete = list(stale)
+            if to_delete:
+                self.collection.delete(ids=to_delete)
+                self.bump_generation(source)
+            stats["deleted"] = len(to_delete)
+            self.save_manifest(source, segment.chunk_ids())
+            n_chunks = segment.n_docs
+            if stats["added"] or to_delete or not self.lexical_index.has_document(source):
+                self.lexical_index.commit(segment)
+                self.bump_generation(source)
+            else:
+                segment.abort()
+        except BaseException:
+            segment.abort()
+            raise
+        self.registry.update(source, chunks=n_chunks)
+
+        logger.info(f"{source}: {stats['added']} added, {stats['deleted']} deleted, {stats['unchanged']} unchanged ({stats['batches']} batches).")
+        return stats
+
+    @staticmethod
+    def stored_tokens(meta: dict) -> Optional[int]:
+        """
+        The chunk's token count from ingestion, if it was counted exactly with
+        the tokenizer in use now (older chunks may hold estimates).
+        """
+        if meta.get('tokenizer') and meta['tokenizer'] == get_token_counter().name:
+            return meta.get('n_tokens')
+        return None
+
+    def bump_generation(self, source: str):
+        """
+        Invalidate cached retrieval results after the index changed.
+        Also records the per-document generation used by the answer cache.
+        """
+        with self.generation_lock:
+            self.index_generation += 1
+            self.source_generations[source] = self.index_generation
+
+    def source_generation(self, source: str) -> int:
+        return self.source_generations.get(source, 0)
+
+    def embed_query(self, query: str) -> List[float]:
+        """
+        Embed a query, reusing the LRU cache of normalized query -> vector.
+        """
+        # all-MiniLM-L6-v2 is uncased, so case and whitespace do not change the vector
+        key = " ".join(query.lower().split())
+        embedding = self.query_embedding_cache.get(key)
+        if embedding is None:
+            self._require_embedder()
+            embedding = self.embedding_fn([query])[0]
+            self.query_embedding_cache.put(key, embedding)
+        return embedding
 
     def search(self, query: str, k: int = 3, sources: List[str] = None) -> List[DocumentChunk]:
         """
         Semantic search for relevant chunks with optional source filtering.
+        Results are cached per (query, sources, k, index generation).
         """
+        cache_key = (" ".join(query.lower().split()), tuple(sorted(sources)) if sources else None, k, self.index_generation)
+        cached = self.retrieval_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
+
+        # Source filters on registered documents: score their chunk ID sets
+        # directly instead of having Chroma evaluate a metadata filter
+        if sources and all(s in self.registry for s in sources) and self.registry.chunk_count(sources) <= FILTERED_SEARCH_MAX_CHUNKS:
+            chunks = self._search_documents(query, k, sources)
+            self.retrieval_cache.put(cache_key, chunks)
+            return list(chunks)
+
         where_filter = None
         if sources and len(sources) > 0:
             if len(sources) == 1:
@@ -56,7 +366,7 @@ class VectorDBClient:
                 where_filter = {"$or": [{"source": s} for s in sources]}
 
         results = self.collection.query(
-            query_texts=[query],
+            query_embeddings=[self.embed_query(query)],
             n_results=k,
             where=where_filter
         )
@@ -66,18 +376,102 @@ class VectorDBClient:
         if results['documents']:
             for i in range(len(results['documents'][0])):
                 chunks.append(DocumentChunk(
+                    id=results['ids'][0][i],
                     text=results['documents'][0][i],
                     source=results['metadatas'][0][i]['source'],
                     page=results['metadatas'][0][i].get('page', 0),
-                    score=results['distances'][0][i] if 'distances' in results else 0.0
+                    score=results['distances'][0][i] if 'distances' in results else 0.0,
+                    tokens=self.stored_tokens(results['metadatas'][0][i])
                 ))
+        self.retrieval_cache.put(cache_key, chunks)
+        return list(chunks)
+
+    def lexical_search(self, query: str, k: int = 3, sources: List[str] = None) -> List[DocumentChunk]:
+        """
+        BM25 search over the lexical index. Scores are BM25 (higher is better).
+        Results share the retrieval cache with semantic search.
+        """
+        cache_key = ("bm25", " ".join(query.lower().split()), tuple(sorted(sources)) if sources else None, k, self.index_generation)
+        cached = self.retrieval_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
+
+        chunks = self.get_chunks_by_id(self.lexical_index.search(query, k, sources=sources))
+        self.retrieval_cache.put(cache_key, chunks)
+        return list(chunks)
+
+    def get_chunks_by_id(self, hits: List[Tuple[str, float]]) -> List[DocumentChunk]:
+        """
+        Fetch (chunk_id, score) hits by primary key, keeping their order.
+        IDs missing from the collection (mid re-ingestion) are skipped.
+        """
+        if not hits:
+            return []
+        results = self.collection.get(ids=[cid for cid, _ in hits], include=['documents', 'metadatas'])
+        by_id = {cid: i for i, cid in enumerate(results['ids'])}
+        chunks = []
+        for cid, score in hits:
+            i = by_id.get(cid)
+            if i is None:
+                continue
+            chunks.append(DocumentChunk(
+                id=cid,
+                text=results['documents'][i],
+                source=results['metadatas'][i]['source'],
+                page=results['metadatas'][i].get('page', 0),
+                score=score,
+                tokens=self.stored_tokens(results['metadatas'][i])
+            ))
         return chunks
 
+    def _document_embeddings(self, source: str) -> Tuple[List[str], np.ndarray]:
+        """
+        A document's chunk IDs and embedding matrix, cached per document generation.
+        """
+        key = (source, self.source_generation(source))
+        entry = self.document_embeddings.get(key)
+        if entry is None:
+            ids = self.load_manifest(source)
+            results = self.collection.get(ids=ids, include=['embeddings']) if ids else {"ids": [], "embeddings": []}
+            entry = (results['ids'], np.asarray(results['embeddings'], dtype=np.float32))
+            self.document_embeddings.put(key, entry)
+        return entry
+
+    def _search_documents(self, query: str, k: int, sources: List[str]) -> List[DocumentChunk]:
+        """
+        Exact nearest neighbours within the given documents. Scores are squared
+        L2 distances, the same metric the Chroma collection reports.
+        """
+        query_vec = np.asarray(self.embed_query(query), dtype=np.float32)
+        ids, distances = [], []
+        for source in sources:
+            doc_ids, matrix = self._document_embeddings(source)
+            if len(doc_ids):
+                ids.extend(doc_ids)
+                distances.append(((matrix - query_vec) ** 2).sum(axis=1))
+        if not ids:
+            return []
+        distances = np.concatenate(distances)
+        top = np.argsort(distances, kind="stable")[:k]
+        return self.get_chunks_by_id([(ids[i], float(distances[i])) for i in top])
+
+    def cache_stats(self) -> dict:
+        return {
+            "index_generation": self.index_generation,
+            "query_embeddings": self.query_embedding_cache.stats(),
+            "retrieval_results": self.retrieval_cache.stats(),
+            "lexical_index": self.lexical_index.stats()
+        }
+
     def get_all_chunks(self, sources: List[str], limit: int = 10) -> List[DocumentChunk]:
         """
         Fetch chunks directly by source filter without semantic search.
         Useful for summarization when query is vague.
         """
+        if sources and all(s in self.registry for s in sources):
+            ids = [cid for s in sources for cid in self.load_manifest(s)][:limit]
+            return self.get_chunks_by_id([(cid, None) for cid in ids])
+
         where_filter = None
         if sources and len(sources) > 0:
             if len(sources) == 1:
@@ -95,9 +489,11 @@ class VectorDBClient:
         if results['documents']:
             for i in range(len(results['documents'])):
                 chunks.append(DocumentChunk(
+                    id=results['ids'][i],
                     text=results['documents'][i],
                     source=results['metadatas'][i]['source'],
-                    page=results['metadatas'][i].get('page', 0)
+                    page=results['metadatas'][i].get('page', 0),
+                    tokens=self.stored_tokens(results['metadatas'][i])
                 ))
         return chunks
 
@@ -107,6 +503,12 @@ class VectorDBClient:
         """
         try:
             self.collection.delete(where={"source": filename})
+            self.lexical_index.delete_document(filename)
+            self.registry.remove(filename)
+            self.bump_generation(filename)
+            manifest_path = self._manifest_path(filename)
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
             logger.info(f"Deleted chunks for {filename}")
         except Exception as e:
             logger.error(f"Failed to delete chunks for {filename}: {e}")
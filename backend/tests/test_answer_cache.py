@@ -0,0 +1,21 @@
+from src.answer_cache import SemanticAnswerCache
+from src.models import DocumentChunk
+
+CHUNKS = [DocumentChunk(text="The deadline is 31 March.", source="plan.pdf", page=2, id="plan.pdf::p2::a")]
+
+def make_cache() -> SemanticAnswerCache:
+    return SemanticAnswerCache(lambda source: 0, max_entries=4, threshold=0.9)
+
+def test_store_and_lookup_same_context():
+    cache = make_cache()
+    cache.store([1.0, 0.0], CHUNKS, None, [], "31 March.")
+
+    assert cache.lookup([0.99, 0.05], CHUNKS, None, []) == "31 March."
+    assert cache.lookup([0.0, 1.0], CHUNKS, None, []) is None
+
+def test_store_without_embedding_is_skipped():
+    # BM25-only retrieval while the embedder loads has no query embedding
+    cache = make_cache()
+    cache.store(None, CHUNKS, None, [], "31 March.")
+
+    assert cache.stats()["entries"] == 0
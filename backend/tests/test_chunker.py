@@ -0,0 +1,94 @@
+import random
+import pytest
+from src.ingestion import TextChunker
+
+RecursiveCharacterTextSplitter = pytest.importorskip("langchain_text_splitters").RecursiveCharacterTextSplitter
+
+CHUNK_SIZE = 300
+CHUNK_OVERLAP = 60
+WORDS = ["tax", "invoice", "दस्तावेज़", "12.5", "total,", "amount", "the", "of", "GSTIN", "report"]
+
+def random_pages(n_pages: int, seed: int = 5):
+    rng = random.Random(seed)
+
+    def paragraph():
+        sentences = (" ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 18))) + rng.choice(".!?।")
+                     for _ in range(rng.randint(1, 8)))
+        return " ".join(sentences)
+    return [("\n\n".join(paragraph() for _ in range(rng.randint(1, 6))), n) for n in range(1, n_pages + 1)]
+
+def recursive_splitter() -> RecursiveCharacterTextSplitter:
+    # Same settings as DocumentIngestor.text_splitter
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+        separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""], length_function=len
+    )
+
+def locate(chunks, text: str):
+    """
+    (start, end) of each chunk in `text`, in order.
+    """
+    spans = []
+    start = 0
+    for chunk in chunks:
+        i = text.find(chunk, start)
+        assert i >= 0
+        spans.append((i, i + len(chunk)))
+        start = i + 1
+    return spans
+
+def covered(spans, text: str) -> bool:
+    seen = [False] * len(text)
+    for s, e in spans:
+        seen[s:e] = [True] * (e - s)
+    return all(seen[i] for i, ch in enumerate(text) if not ch.isspace())
+
+def test_chunk_sizes_and_coverage_match_recursive_splitter():
+    chunker = TextChunker(CHUNK_SIZE, CHUNK_OVERLAP)
+    splitter = recursive_splitter()
+    native_count = recursive_count = 0
+    for text, _ in random_pages(40):
+        native = chunker.split_text(text)
+        recursive = splitter.split_text(text)
+        native_count += len(native)
+        recursive_count += len(recursive)
+
+        assert all(len(c) <= CHUNK_SIZE for c in native)
+        assert covered(locate(native, text), text)
+        assert covered(locate(recursive, text), text)
+    assert abs(native_count - recursive_count) <= 0.1 * recursive_count
+
+def test_chunks_end_on_sentences_at_least_as_often_as_recursive_splitter():
+    pages = random_pages(40)
+    native = [c for c, _, _ in TextChunker(CHUNK_SIZE, CHUNK_OVERLAP).split_pages(pages)]
+    recursive = [c for text, _ in pages for c in recursive_splitter().split_text(text)]
+    sentence_end = lambda chunks: sum(c[-1] in ".!?।" for c in chunks) / len(chunks)
+
+    assert sentence_end(native) >= sentence_end(recursive)
+    # "12.5" is not a sentence end
+    assert not any(c.endswith("12.") for c in native)
+
+def test_overlap_is_bounded_and_starts_on_a_word():
+    chunker = TextChunker(CHUNK_SIZE, CHUNK_OVERLAP)
+    overlaps = []
+    for text, _ in random_pages(40):
+        spans = locate(chunker.split_text(text), text)
+        for (_, prev_end), (start, end) in zip(spans, spans[1:]):
+            overlaps.append(max(0, prev_end - start))
+            assert start == 0 or text[start - 1].isspace()
+            assert end == len(text) or text[end].isspace()
+
+    assert max(overlaps) <= CHUNK_OVERLAP
+    # Unlike the recursive splitter, most neighbouring chunks share some context
+    assert sum(1 for o in overlaps if o > 0) >= 0.8 * len(overlaps)
+
+def test_span_pages_reports_the_pages_each_chunk_covers():
+    pages = [(text[:120], n) for text, n in random_pages(60)]
+    joined = {n: text for text, n in pages}
+    chunks = list(TextChunker(CHUNK_SIZE, CHUNK_OVERLAP).split_pages(pages, span_pages=True))
+
+    assert any(first < last for _, first, last in chunks)
+    assert [first for _, first, _ in chunks] == sorted(first for _, first, _ in chunks)
+    for chunk, first, last in chunks:
+        assert len(chunk) <= CHUNK_SIZE
+        assert chunk in "\n\n".join(joined[n] for n in range(first, last + 1))
@@ -0,0 +1,104 @@
+import os
+import re
+import hashlib
+import threading
+import http.server
+import pytest
+from src.downloader import RangedDownloader, DownloadError
+
+PAYLOAD = os.urandom(3 * 256 * 1024 + 12345)  # Not a multiple of the segment or chunk size
+SHA256 = hashlib.sha256(PAYLOAD).hexdigest()
+CHUNK_BYTES = 16 * 1024
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves PAYLOAD with HEAD, GET and single-range GET. With `truncate_after`
+    set, each body is cut off after that many bytes and the connection dropped.
+    """
+
+    truncate_after = None
+    requests_seen = []
+
+    def log_message(self, *args):
+        pass
+
+    def _headers(self, status: int, start: int, end: int):
+        self.send_response(status)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", '"payload-v1"')
+        self.send_header("Content-Length", str(end - start))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(PAYLOAD)}")
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._headers(200, 0, len(PAYLOAD))
+
+    def do_GET(self):
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if match:
+            start, end = int(match.group(1)), int(match.group(2)) + 1
+            self._headers(206, start, end)
+        else:
+            start, end = 0, len(PAYLOAD)
+            self._headers(200, start, end)
+        self.requests_seen.append((start, end))
+        body = PAYLOAD[start:end]
+        if self.truncate_after is not None:
+            body = body[:self.truncate_after]
+            self.close_connection = True
+        self.wfile.write(body)
+
+@pytest.fixture
+def server():
+    RangeHandler.truncate_after = None
+    RangeHandler.requests_seen = []
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/model.gguf"
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_parallel_download_verifies_and_moves_into_place(server, tmp_path):
+    dest = str(tmp_path / "model.gguf")
+    downloader = RangedDownloader(server, dest, sha256=SHA256, segments=4, chunk_bytes=CHUNK_BYTES)
+
+    assert downloader.download() == SHA256
+    with open(dest, "rb") as f:
+        assert f.read() == PAYLOAD
+    assert len(RangeHandler.requests_seen) == 4
+    assert not os.path.exists(dest + ".part")
+    assert not os.path.exists(dest + ".part.json")
+
+def test_interrupted_download_resumes_from_manifest(server, tmp_path):
+    dest = str(tmp_path / "model.gguf")
+
+    # Every segment's connection drops part-way through
+    RangeHandler.truncate_after = 3 * CHUNK_BYTES
+    with pytest.raises(Exception):
+        RangedDownloader(server, dest, sha256=SHA256, segments=4, chunk_bytes=CHUNK_BYTES).download()
+    assert os.path.exists(dest + ".part.json")
+    assert not os.path.exists(dest)
+
+    RangeHandler.truncate_after = None
+    RangeHandler.requests_seen = []
+    downloader = RangedDownloader(server, dest, sha256=SHA256, segments=4, chunk_bytes=CHUNK_BYTES)
+    assert downloader.download() == SHA256
+    with open(dest, "rb") as f:
+        assert f.read() == PAYLOAD
+
+    # The second attempt only asked for what was missing
+    assert downloader.resumed_bytes > 0
+    assert sum(end - start for start, end in RangeHandler.requests_seen) == len(PAYLOAD) - downloader.resumed_bytes
+    assert not os.path.exists(dest + ".part.json")
+
+def test_checksum_mismatch_discards_partial_download(server, tmp_path):
+    dest = str(tmp_path / "model.gguf")
+    downloader = RangedDownloader(server, dest, sha256="0" * 64, segments=3, chunk_bytes=CHUNK_BYTES)
+
+    with pytest.raises(DownloadError, match="SHA-256 mismatch"):
+        downloader.download()
+    assert not os.path.exists(dest)
+    assert not os.path.exists(dest + ".part")
+    assert not os.path.exists(dest + ".part.json")
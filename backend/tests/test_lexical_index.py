@@ -0,0 +1,92 @@
+import os
+import random
+from collections import Counter
+import pytest
+import src.lexical_index as lexical_index
+from src.lexical_index import LexicalIndex, tokenize
+
+def random_texts(n: int, seed: int = 7):
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(200)] + ["इनवॉइस", "INV-2024/0113"]
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(0, 30))) for _ in range(n)]
+
+def build(index: LexicalIndex, source: str, texts, spill_postings: int = None):
+    writer = index.writer(source)
+    if spill_postings:
+        writer.spill_postings = spill_postings
+    for i, text in enumerate(texts):
+        writer.add(f"{source}::c{i}", text=text)
+    index.commit(writer)
+    return writer
+
+def test_tokenize_keeps_identifiers_and_indic_words():
+    tokens = tokenize("Invoice INV-2024/0113 इनवॉइस")
+    assert "inv-2024/0113" in tokens and "2024" in tokens
+    assert "इनवॉइस" in tokens
+
+@pytest.mark.parametrize("spill_postings", [None, 200])
+def test_segment_matches_in_memory_postings(tmp_path, monkeypatch, spill_postings):
+    # A tiny spill threshold and fan-in force many runs and multi-pass merges
+    monkeypatch.setattr(lexical_index, "LEXICAL_MERGE_FAN_IN", 3)
+    texts = random_texts(1500)
+    index = LexicalIndex(str(tmp_path))
+    writer = build(index, "doc.pdf", texts, spill_postings)
+
+    segment = index.segments["doc.pdf"]
+    assert segment.chunk_ids == [f"doc.pdf::c{i}" for i in range(len(texts))]
+    assert segment.doc_lens.tolist() == [len(tokenize(t)) for t in texts]
+    counts = [Counter(tokenize(t)) for t in texts]
+    for term in ("w0", "w199", "इनवॉइस", "inv-2024/0113"):
+        docs, freqs = segment.postings_for(term)
+        expected = [(i, c[term]) for i, c in enumerate(counts) if term in c]
+        assert list(zip(docs.tolist(), freqs.tolist())) == expected
+    assert not os.path.exists(writer.work_dir)
+    assert not os.path.exists(writer.tmp_path)
+
+def test_segments_reload_from_disk(tmp_path):
+    build(LexicalIndex(str(tmp_path)), "a.pdf", ["alpha beta", "gamma"])
+    reloaded = LexicalIndex(str(tmp_path))
+
+    assert reloaded.has_document("a.pdf")
+    assert reloaded.search("gamma", k=5)[0][0] == "a.pdf::c1"
+
+def test_search_ranks_and_filters_by_source(tmp_path):
+    index = LexicalIndex(str(tmp_path))
+    build(index, "a.pdf", ["tax invoice total", "weather report", "invoice invoice invoice"])
+    build(index, "b.pdf", ["invoice number", "unrelated text"])
+
+    hits = index.search("invoice", k=10)
+    assert {chunk_id for chunk_id, _ in hits} == {"a.pdf::c0", "a.pdf::c2", "b.pdf::c0"}
+    assert hits[0][0] == "a.pdf::c2"
+    assert [chunk_id for chunk_id, _ in index.search("invoice", k=10, sources=["b.pdf"])] == ["b.pdf::c0"]
+
+def test_delete_removes_document_from_lookup(tmp_path):
+    index = LexicalIndex(str(tmp_path))
+    build(index, "a.pdf", ["invoice total"])
+    build(index, "b.pdf", ["invoice number"])
+
+    index.delete_document("a.pdf")
+    assert not index.has_document("a.pdf")
+    assert [chunk_id for chunk_id, _ in index.search("invoice", k=10)] == ["b.pdf::c0"]
+    assert not LexicalIndex(str(tmp_path)).has_document("a.pdf")
+
+def test_rebuild_replaces_segment_and_empty_document_removes_it(tmp_path):
+    index = LexicalIndex(str(tmp_path))
+    build(index, "a.pdf", ["old words"])
+    build(index, "a.pdf", ["new words"])
+    assert index.search("old", k=5) == []
+    assert index.search("new", k=5)[0][0] == "a.pdf::c0"
+
+    build(index, "a.pdf", [])
+    assert not index.has_document("a.pdf")
+    assert os.listdir(str(tmp_path)) == []
+
+def test_aborted_writer_keeps_previous_segment(tmp_path):
+    index = LexicalIndex(str(tmp_path))
+    build(index, "a.pdf", ["kept text"])
+    writer = index.writer("a.pdf")
+    writer.add("a.pdf::c0", text="replacement")
+    writer.abort()
+
+    assert index.search("kept", k=5)[0][0] == "a.pdf::c0"
+    assert not os.path.exists(writer.work_dir)
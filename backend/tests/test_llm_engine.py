@@ -0,0 +1,102 @@
+import sys
+import types
+import importlib
+import pytest
+
+class FakeLlama:
+    """
+    Records constructor arguments instead of loading a model.
+    """
+
+    created = []
+    vocab_sizes = {}
+
+    def __init__(self, model_path: str, **kwargs):
+        self.model_path = model_path
+        self.kwargs = kwargs
+        self.created.append(self)
+
+    def n_vocab(self) -> int:
+        return self.vocab_sizes.get(self.model_path, 151936)
+
+class FakeDraftModel:
+    pass
+
+class FakePromptLookup(FakeDraftModel):
+    def __init__(self, max_ngram_size: int, num_pred_tokens: int):
+        self.num_pred_tokens = num_pred_tokens
+
+@pytest.fixture
+def engine_module(monkeypatch, tmp_path):
+    """
+    src.llm_engine imported against a fake llama_cpp, with a valid model
+    file and a fixed runtime profile.
+    """
+    llama_cpp = types.ModuleType("llama_cpp")
+    llama_cpp.Llama = FakeLlama
+    speculative = types.ModuleType("llama_cpp.llama_speculative")
+    speculative.LlamaDraftModel = FakeDraftModel
+    speculative.LlamaPromptLookupDecoding = FakePromptLookup
+    monkeypatch.setitem(sys.modules, "llama_cpp", llama_cpp)
+    monkeypatch.setitem(sys.modules, "llama_cpp.llama_speculative", speculative)
+    for name in ("src.llm_engine", "src.speculative"):
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    engine = importlib.import_module("src.llm_engine")
+    speculative_module = importlib.import_module("src.speculative")
+
+    model_path = tmp_path / "main.gguf"
+    draft_path = tmp_path / "draft.gguf"
+    model_path.write_bytes(b"GGUF")
+    draft_path.write_bytes(b"GGUF")
+    monkeypatch.setattr(engine, "LLM_MODEL_PATH", str(model_path))
+    monkeypatch.setattr(speculative_module, "DRAFT_MODEL_PATH", str(draft_path))
+    monkeypatch.setattr(engine, "BATCH_MAX_SEQUENCES", 1)
+    monkeypatch.setattr(engine, "SMALL_CONTEXT_WINDOW", 0)
+
+    class Registry:
+        def gguf(self, path):
+            return {"valid": True, "architecture": "qwen2", "quantization": "Q4_K_M"}
+    monkeypatch.setattr(engine, "get_model_registry", lambda: Registry())
+    monkeypatch.setattr(engine, "runtime_profile", lambda *args, **kwargs: {
+        "n_ctx": 4096, "n_threads": 4, "n_threads_batch": 4, "n_batch": 512,
+        "use_mmap": True, "use_mlock": False, "calibrated": False, "overrides": []
+    })
+    FakeLlama.created = []
+    FakeLlama.vocab_sizes = {}
+    return engine, str(model_path), str(draft_path)
+
+def main_models(model_path: str):
+    return [llm for llm in FakeLlama.created if llm.model_path == model_path]
+
+def test_prompt_lookup_draft_is_passed_to_the_constructor(engine_module):
+    engine_mod, model_path, _ = engine_module
+    engine = engine_mod.LLMEngine(speculative_mode="prompt_lookup")
+
+    assert engine.draft is not None
+    assert [llm.kwargs["draft_model"] for llm in main_models(model_path)] == [engine.draft]
+    assert engine.llm.kwargs["draft_model"] is engine.draft
+
+def test_gguf_draft_is_passed_to_the_constructor(engine_module):
+    engine_mod, model_path, draft_path = engine_module
+    engine = engine_mod.LLMEngine(speculative_mode="draft")
+
+    assert engine.draft is not None and engine.draft.n_vocab == 151936
+    assert engine.llm.kwargs["draft_model"] is engine.draft
+    assert len(main_models(model_path)) == 1
+    assert len(main_models(draft_path)) == 1
+
+def test_vocabulary_mismatch_reloads_without_draft(engine_module):
+    engine_mod, model_path, draft_path = engine_module
+    FakeLlama.vocab_sizes[draft_path] = 32000
+    engine = engine_mod.LLMEngine(speculative_mode="draft")
+
+    assert engine.draft is None
+    assert [llm.kwargs["draft_model"] is not None for llm in main_models(model_path)] == [True, False]
+    assert engine.llm.kwargs["draft_model"] is None
+
+def test_speculative_off_builds_no_draft(engine_module):
+    engine_mod, model_path, _ = engine_module
+    engine = engine_mod.LLMEngine(speculative_mode="off")
+
+    assert engine.draft is None
+    assert engine.llm.kwargs["draft_model"] is None
@@ -0,0 +1,95 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import src.ocr as ocr
+from src.ocr import OcrPool
+
+def needs_ocr(text: str) -> bool:
+    return len(text) < 16
+
+def text_layer(n_pages: int, seed: int = 3):
+    # Roughly half the pages are "scanned" (no text layer)
+    rng = random.Random(seed)
+    return [("text layer of page %d" % n if rng.random() < 0.5 else "", n) for n in range(1, n_pages + 1)]
+
+def fake_batch(file_path, page_nums):
+    """
+    Stand-in for the worker: finishes out of order, and pages divisible by 7
+    come back blank (dropped, like empty OCR output).
+    """
+    time.sleep(random.random() * 0.005)
+    return [(f"ocr page {n}", n) for n in page_nums if n % 7], 0, 100.0
+
+@pytest.fixture
+def pool(monkeypatch):
+    # Threads instead of processes, so the fake worker needs no pickling
+    monkeypatch.setattr(ocr, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(ocr, "_ocr_page_batch", fake_batch)
+    monkeypatch.setattr(ocr, "OCR_REORDER_PAGES", 5)
+    pool = OcrPool(max_workers=3, worker_memory_mb=1000, idle_seconds=60)
+    yield pool
+    pool.users = 0
+    pool.shutdown()
+
+def test_pages_come_out_in_page_order(pool):
+    pages = text_layer(300)
+    stats = {}
+    out = list(pool.ocr_pages("doc.pdf", iter(pages), needs_ocr, stats=stats))
+
+    expected = [n for text, n in pages if text or n % 7]
+    assert [n for _, n in out] == expected
+    scanned = [n for text, n in pages if not text]
+    assert stats["ocr_pages"] == len(scanned)
+    assert all(text == f"ocr page {n}" for text, n in out if n in scanned)
+
+def test_text_only_document_never_starts_the_pool(pool):
+    pages = [("a full text layer page", n) for n in range(1, 20)]
+
+    assert [n for _, n in pool.ocr_pages("doc.pdf", iter(pages), needs_ocr)] == list(range(1, 20))
+    assert pool.pool is None
+
+def test_reorder_buffer_stays_bounded(pool, monkeypatch):
+    # With OCR stalled, text pages pile up only to OCR_REORDER_PAGES before reading stops
+    consumed = []
+
+    def slow_batch(file_path, page_nums):
+        time.sleep(0.05)
+        return [(f"ocr page {n}", n) for n in page_nums], 0, 100.0
+    monkeypatch.setattr(ocr, "_ocr_page_batch", slow_batch)
+
+    def source():
+        yield "", 1
+        for n in range(2, 40):
+            consumed.append(n)
+            yield "a full text layer page", n
+
+    stream = pool.ocr_pages("doc.pdf", source(), needs_ocr)
+    assert next(stream)[1] == 1
+    # Page 1 needed OCR, so every text page read so far waited for it
+    assert len(consumed) <= ocr.OCR_REORDER_PAGES + 1
+    assert [n for _, n in stream] == list(range(2, 40))
+
+def test_failed_batch_skips_its_pages_and_keeps_order(pool, monkeypatch):
+    def failing_batch(file_path, page_nums):
+        if 4 in page_nums:
+            raise RuntimeError("reader crashed")
+        return [(f"ocr page {n}", n) for n in page_nums], 0, 100.0
+    monkeypatch.setattr(ocr, "_ocr_page_batch", failing_batch)
+    pages = [("" if n % 2 == 0 else "a full text layer page", n) for n in range(1, 30)]
+
+    out = [n for _, n in pool.ocr_pages("doc.pdf", iter(pages), needs_ocr)]
+    assert out == sorted(out)
+    assert 4 not in out
+    assert [n for n in out if n % 2] == list(range(1, 30, 2))
+
+def test_worker_over_memory_cap_restarts_pool(pool, monkeypatch):
+    def heavy_batch(file_path, page_nums):
+        return [(f"ocr page {n}", n) for n in page_nums], 0, 5000.0
+    monkeypatch.setattr(ocr, "_ocr_page_batch", heavy_batch)
+    pages = [("", n) for n in range(1, 4)]
+
+    assert [n for _, n in pool.ocr_pages("doc.pdf", iter(pages), needs_ocr)] == [1, 2, 3]
+    first = pool.pool
+    list(pool.ocr_pages("doc.pdf", iter(pages), needs_ocr))
+    assert pool.pool is not first
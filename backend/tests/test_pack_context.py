@@ -0,0 +1,69 @@
+import sys
+import types
+import random
+import importlib
+import pytest
+from src.models import DocumentChunk
+
+class WordCounter:
+    """
+    One token per whitespace-separated word, so costs are easy to reason about.
+    """
+
+    exact = False
+
+    def count(self, text: str) -> int:
+        return len(text.split())
+
+@pytest.fixture
+def engine(monkeypatch):
+    """
+    A RAGEngine imported without Chroma or llama.cpp behind it; pack_context
+    only needs the token counter.
+    """
+    vector_db = types.ModuleType("src.vector_db")
+    vector_db.VectorDBClient = object
+    llm_engine = types.ModuleType("src.llm_engine")
+    llm_engine.LLMEngine = object
+    monkeypatch.setitem(sys.modules, "src.vector_db", vector_db)
+    monkeypatch.setitem(sys.modules, "src.llm_engine", llm_engine)
+    monkeypatch.delitem(sys.modules, "src.rag_engine", raising=False)
+    rag_engine = importlib.import_module("src.rag_engine")
+    monkeypatch.setattr(rag_engine, "get_token_counter", lambda: WordCounter())
+    return rag_engine.RAGEngine.__new__(rag_engine.RAGEngine)
+
+def chunk(n: int, tokens: int) -> DocumentChunk:
+    # Prompt cost is tokens + 5 (citation header words) + 1 (separator)
+    return DocumentChunk(text="x", source="doc.pdf", page=n, id=f"doc.pdf::{n}", tokens=tokens)
+
+def test_top_chunk_is_kept_over_cheaper_lower_ranked_ones(engine):
+    top = chunk(1, 94)  # Costs 100
+    rest = [chunk(n, 14) for n in range(2, 12)]  # Cost 20 each; six of them outscore the top chunk
+
+    selected, used = engine.pack_context([top] + rest, budget=120)
+    assert selected == [top, rest[0]]
+    assert used == 120
+
+def test_top_chunk_over_budget_is_skipped(engine):
+    top = chunk(1, 500)
+    rest = [chunk(n, 14) for n in range(2, 6)]
+
+    selected, used = engine.pack_context([top] + rest, budget=60)
+    assert selected == rest[:3]
+    assert used <= 60
+
+def test_selection_never_exceeds_budget_and_keeps_rank_order(engine):
+    rng = random.Random(11)
+    for _ in range(200):
+        chunks = [chunk(n, rng.randint(1, 300)) for n in range(1, rng.randint(1, 15))]
+        budget = rng.randint(1, 1500)
+        selected, used = engine.pack_context(chunks, budget)
+
+        assert used <= budget
+        assert used == engine.context_tokens(selected)
+        assert [c.page for c in selected] == sorted(c.page for c in selected)
+        if chunks and engine.chunk_prompt_tokens(chunks[0], 1) <= budget:
+            assert selected[0] is chunks[0]
+
+def test_no_budget_selects_nothing(engine):
+    assert engine.pack_context([chunk(1, 10)], budget=0) == ([], 0)
@@ -0,0 +1,87 @@
+import threading
+import pytest
+from src.scheduler import GenerationScheduler, QueueFullError, DeadlineExceededError
+
+def acquire(scheduler: GenerationScheduler, ticket) -> list:
+    """
+    Wait until the ticket holds the model; returns the positions it reported.
+    """
+    return list(scheduler.wait(ticket, poll_seconds=0.01))
+
+def test_lower_priority_value_goes_first_and_fifo_within_priority():
+    scheduler = GenerationScheduler(max_queue=8, max_active=1)
+    running = scheduler.submit()
+    acquire(scheduler, running)
+
+    batch_a = scheduler.submit(priority=5)
+    batch_b = scheduler.submit(priority=5)
+    interactive = scheduler.submit(priority=0)
+    assert [scheduler.position(t) for t in (interactive, batch_a, batch_b)] == [1, 2, 3]
+    assert scheduler.position(running) == 0
+
+    order = []
+    lock = threading.Lock()
+
+    def worker(ticket):
+        acquire(scheduler, ticket)
+        with lock:
+            order.append(ticket)
+        scheduler.release(ticket)
+    threads = [threading.Thread(target=worker, args=(t,)) for t in (batch_b, batch_a, interactive)]
+    for thread in threads:
+        thread.start()
+    scheduler.release(running)
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert order == [interactive, batch_a, batch_b]
+    assert scheduler.stats()["completed"] == 4
+
+def test_full_queue_rejects():
+    scheduler = GenerationScheduler(max_queue=2, max_active=1)
+    scheduler.submit()
+    scheduler.submit()
+
+    with pytest.raises(QueueFullError):
+        scheduler.submit()
+    assert scheduler.stats()["rejected"] == 1
+
+def test_deadline_passes_while_queued():
+    scheduler = GenerationScheduler(max_queue=8, max_active=1)
+    running = scheduler.submit()
+    acquire(scheduler, running)
+    late = scheduler.submit(deadline_seconds=0.05)
+    after = scheduler.submit()
+
+    with pytest.raises(DeadlineExceededError, match="deadline"):
+        acquire(scheduler, late)
+    # The expired ticket leaves the queue, so the next one moves up
+    assert scheduler.position(after) == 1
+    scheduler.release(late)
+    scheduler.release(running)
+    assert acquire(scheduler, after) == []
+
+def test_cancel_queued_and_running_requests():
+    scheduler = GenerationScheduler(max_queue=8, max_active=1)
+    running = scheduler.submit()
+    acquire(scheduler, running)
+    queued = scheduler.submit()
+
+    errors = []
+
+    def waiter():
+        try:
+            acquire(scheduler, queued)
+        except DeadlineExceededError as e:
+            errors.append(str(e))
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    assert scheduler.cancel_request(queued.request_id)
+    thread.join(timeout=5)
+
+    assert errors == ["Request cancelled"]
+    assert scheduler.stats()["queued"] == 0
+    assert scheduler.cancel_request(running.request_id)
+    assert running.should_stop()
+    assert scheduler.release(running)["cancelled"]
+    assert not scheduler.cancel_request(running.request_id)
@@ -0,0 +1,47 @@
+import os
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+from onnxruntime.quantization import quantize_dynamic, QuantType
+
+# Source: cross-encoder/ms-marco-MiniLM-L-6-v2 (downloaded once, then offline)
+# Target: backend/models/rerankers/ms-marco-MiniLM-L-6-v2/onnx/model_int8.onnx
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_DIR = os.path.join(BASE_DIR, "backend", "models", "rerankers", "ms-marco-MiniLM-L-6-v2")
+ONNX_DIR = os.path.join(MODEL_DIR, "onnx")
+FP32_PATH = os.path.join(ONNX_DIR, "model.onnx")
+INT8_PATH = os.path.join(ONNX_DIR, "model_int8.onnx")
+
+os.makedirs(ONNX_DIR, exist_ok=True)
+
+print(f"Downloading 'ms-marco-MiniLM-L-6-v2' to: {MODEL_DIR}")
+tokenizer = AutoTokenizer.from_pretrained("cross-encoder/ms-marco-MiniLM-L-6-v2")
+model = AutoModelForSequenceClassification.from_pretrained("cross-encoder/ms-marco-MiniLM-L-6-v2")
+model.eval()
+
+# The backend expects tokenizer.json next to the model (fast tokenizer format)
+tokenizer.save_pretrained(MODEL_DIR)
+
+dummy = tokenizer(["what is the refund policy"], ["Refunds are issued within 30 days."], return_tensors="pt")
+
+print(f"[INFO] Exporting FP32 ONNX to: {FP32_PATH}")
+with torch.no_grad():
+    torch.onnx.export(
+        model,
+        (dummy["input_ids"], dummy["attention_mask"], dummy["token_type_ids"]),
+        FP32_PATH,
+        input_names=["input_ids", "attention_mask", "token_type_ids"],
+        output_names=["logits"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "token_type_ids": {0: "batch", 1: "sequence"},
+            "logits": {0: "batch"},
+        },
+        opset_version=14,
+    )
+
+print(f"[INFO] Quantizing to int8: {INT8_PATH}")
+quantize_dynamic(FP32_PATH, INT8_PATH, weight_type=QuantType.QInt8)
+os.remove(FP32_PATH)
+
+print("\nSUCCESS: ONNX re-ranker ready. Restart the backend to use it.")